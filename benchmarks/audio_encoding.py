@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Bandwidth versus CPU tradeoff of EncodedAudioSource.
+
+Encodes an audio file with each encoding and compression level in 100 ms
+chunks, as sent to the server, and reports per second of audio the bytes
+sent (including SEND_AUDIO headers) and the client CPU time spent encoding,
+along with the number of concurrent real-time sessions which one core can
+encode.
+
+Usage: python benchmarks/audio_encoding.py [audio_path [repeat]]
+"""
+from sys import argv
+from time import process_time
+
+from cpqdasr import FileAudioSource, EncodedAudioSource
+from cpqdasr.recognizer_protocol import send_audio_msg
+
+CONFIGS = [
+    ("pcm", None),
+    ("flac", 0.0),
+    ("flac", 0.5),
+    ("flac", 1.0),
+    ("ogg_vorbis", 0.5),
+    ("ogg_opus", 0.9),
+    ("mp3", 0.5),
+]
+
+
+def chunks(audio_path, encoding, level):
+    source = FileAudioSource(audio_path)
+    chunk_size = (source.sample_rate or 8000) // 10
+    source = FileAudioSource(audio_path, chunk_size=chunk_size)
+    if encoding == "pcm":
+        return source, source
+    return source, EncodedAudioSource(source, encoding, compression_level=level)
+
+
+def run(audio_path, encoding, level, repeat):
+    sent = 0
+    audio_bytes = 0
+    sample_rate = 8000
+    cpu = process_time()
+    for _ in range(repeat):
+        source, encoded = chunks(audio_path, encoding, level)
+        sample_rate = source.sample_rate or 8000
+        audio_bytes += source.data_size
+        for chunk in encoded:
+            sent += len(send_audio_msg(bytes(chunk), content_type="audio/x"))
+    cpu = process_time() - cpu
+    audio_seconds = audio_bytes / (2.0 * sample_rate)
+    return sent / audio_seconds, cpu * 1000 / audio_seconds
+
+
+def main():
+    audio_path = argv[1] if len(argv) > 1 else "tests/unit/res/audio/previsao-tempo-8k.wav"
+    repeat = int(argv[2]) if len(argv) > 2 else 20
+    print(
+        "{:>12} {:>6} {:>10} {:>8} {:>10} {:>12}".format(
+            "encoding", "level", "bytes/s", "ratio", "cpu ms/s", "sessions/core"
+        )
+    )
+    pcm = None
+    for encoding, level in CONFIGS:
+        rate, cpu_ms = run(audio_path, encoding, level, repeat)
+        if pcm is None:
+            pcm = rate
+        print(
+            "{:>12} {:>6} {:>10.0f} {:>8.2f} {:>10.3f} {:>12.0f}".format(
+                encoding,
+                "-" if level is None else level,
+                rate,
+                rate / pcm,
+                cpu_ms,
+                1000 / cpu_ms if cpu_ms > 0 else float("inf"),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Microbenchmark for RECOGNITION_RESULT parsing.
+
+Compares the former path (a new WsParser per message, str decoding and
+line splitting of the whole payload) with parse_message, on a partial
+result and on a final result with word alignment and interpretations.
+Both columns include the JSON decoding of the body, as in parse_response.
+
+Then times parse_response with each installed JSON backend, and with the
+body of partial results skipped, as when the listener does not reimplement
+on_partial_recognition.
+
+Usage: python benchmarks/parse_response.py [iterations]
+"""
+from sys import argv
+from timeit import timeit
+import json
+
+from cpqdasr.ws_parser import WsParser, parse_message
+from cpqdasr.recognizer_protocol import parse_response, set_json_backend
+
+
+def make_message(status, body):
+    body = json.dumps(body).encode()
+    head = (
+        "ASR 2.4 RECOGNITION_RESULT\n"
+        "Handle: 1548440093052_0\n"
+        "Result-Status: {}\n"
+        "Content-Type: application/json\n"
+        "Content-Length: {}\n\n".format(status, len(body))
+    )
+    return head.encode() + body
+
+
+def partial():
+    return make_message(
+        "PROCESSING",
+        {"alternatives": [{"text": "quero saber o saldo da minha conta"}]},
+    )
+
+
+def final():
+    words = "quero saber o saldo da minha conta corrente por favor".split()
+    alternatives = []
+    for i in range(3):
+        alternatives.append(
+            {
+                "text": " ".join(words),
+                "score": 90 - i,
+                "lm": "builtin:slm/general",
+                "interpretations": [{"slot": "saldo", "value": i}],
+                "interpretation_scores": [88],
+                "words": [
+                    {
+                        "text": w,
+                        "score": 95,
+                        "start_time": 0.3 * j,
+                        "end_time": 0.3 * j + 0.28,
+                    }
+                    for j, w in enumerate(words)
+                ],
+            }
+        )
+    return make_message(
+        "RECOGNIZED",
+        {
+            "alternatives": alternatives,
+            "segment_index": 0,
+            "last_segment": True,
+            "final_result": True,
+            "start_time": 0.25,
+            "end_time": 3.4,
+            "result_status": "RECOGNIZED",
+        },
+    )
+
+
+def before(msg):
+    parser = WsParser(msg)
+    parser.Parse()
+    body = parser.get_body()
+    return parser.get_command(), parser.get_params(), json.loads(body)
+
+
+def after(msg):
+    version, command, headers, body = parse_message(msg)
+    return command, headers, json.loads(str(body, "utf-8"))
+
+
+def main():
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    print("{:>10} {:>8} {:>14} {:>14}".format("", "bytes", "before us/msg", "after us/msg"))
+    for name, msg in [("partial", partial()), ("final", final())]:
+        assert before(msg) == after(msg)
+        t_before = timeit(lambda: before(msg), number=n) / n
+        t_after = timeit(lambda: after(msg), number=n) / n
+        print(
+            "{:>10} {:>8} {:>14.2f} {:>14.2f}".format(
+                name, len(msg), t_before * 1e6, t_after * 1e6
+            )
+        )
+    print()
+    print("{:>10} {:>14} {:>14} {:>14}".format("backend", "partial us", "skipped us", "final us"))
+    for backend in ["json", "ujson", "orjson"]:
+        try:
+            set_json_backend(backend)
+        except ImportError:
+            continue
+        p, f = partial(), final()
+        t_partial = timeit(lambda: parse_response(p), number=n) / n
+        t_skipped = timeit(lambda: parse_response(p, False), number=n) / n
+        t_final = timeit(lambda: parse_response(f), number=n) / n
+        print(
+            "{:>10} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+                backend, t_partial * 1e6, t_skipped * 1e6, t_final * 1e6
+            )
+        )
+    set_json_backend()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Deterministic benchmark of the client side of a recognition session.
+
+Replays a session trace with ReplayServer, running in a child process, and
+measures the client CPU time and wall time of each recognition, i.e. the
+cost of framing, parsing, dispatching and assembling results for the server
+traffic in the trace. Traces are written with SpeechRecognizer's "trace"
+argument, e.g. against a production server. If no trace is given, one is
+captured from the stand-in server.
+
+The audio file and language model must be the ones used for the trace.
+
+Usage: python benchmarks/replay_session.py [audio_path [trace_path [runs]]]
+"""
+from sys import argv
+from time import monotonic, process_time
+import os
+import tempfile
+
+from cpqdasr import SpeechRecognizer, LanguageModelList, FileAudioSource
+from cpqdasr import TraceWriter
+from cpqdasr.tools.loadgen import percentile
+from cpqdasr.tools.server import StandInServer, start_process, stop_process
+from cpqdasr.tools.replay import ReplayServer
+
+LM = LanguageModelList("builtin:slm/general")
+
+
+def recognize(url, audio_path, recognitions, trace=None):
+    asr = SpeechRecognizer(url, trace=trace)
+    samples = []
+    for _ in range(recognitions):
+        cpu, wall = process_time(), monotonic()
+        asr.recognize(FileAudioSource(audio_path), LM)
+        assert asr.wait_recognition_result()
+        samples.append((process_time() - cpu, monotonic() - wall))
+    asr.close()
+    return samples
+
+
+def capture(audio_path, trace_path):
+    with StandInServer(port=0) as server:
+        with TraceWriter(trace_path) as trace:
+            recognize(server.url, audio_path, 1, trace)
+
+
+def replay(trace_path, audio_path, runs, time_scale):
+    p, url = start_process(ReplayServer, trace=trace_path, time_scale=time_scale)
+    samples = []
+    for _ in range(runs):
+        samples += recognize(url, audio_path, 1)
+    stop_process(p)
+    return samples
+
+
+def main():
+    audio_path = argv[1] if len(argv) > 1 else "tests/unit/res/audio/pizza-8k.wav"
+    trace_path = argv[2] if len(argv) > 2 else None
+    runs = int(argv[3]) if len(argv) > 3 else 50
+    if trace_path is None:
+        trace_path = os.path.join(tempfile.mkdtemp(), "session.trace")
+        capture(audio_path, trace_path)
+    print("Trace: {} ({} bytes)".format(trace_path, os.path.getsize(trace_path)))
+    print("{:>12} {:>14} {:>14} {:>14}".format("time scale", "cpu p50 ms", "cpu p95 ms", "wall p50 ms"))
+    for time_scale in [0.0, 1.0]:
+        samples = replay(trace_path, audio_path, runs, time_scale)
+        cpu = sorted(s[0] * 1000 for s in samples)
+        wall = sorted(s[1] * 1000 for s in samples)
+        print(
+            "{:>12} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+                time_scale, percentile(cpu, 50), percentile(cpu, 95), percentile(wall, 50)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Microbenchmark for SEND_AUDIO framing.
+
+Compares the former path (send_audio_msg + ws4py's send) with
+ASRClient.send_audio (AudioFramer + in-place masking + scatter/gather write),
+writing to a local socket pair which is drained by a thread.
+
+Bytes copied are counted per stage for each path, and reported per second
+of 8kHz 16-bit audio:
+    before: header + payload concatenation, ws4py's bytearray for masking,
+            header + key + masked body concatenation and its bytes()
+            conversion, i.e. 4 copies of the payload, plus a Python-level
+            XOR for every byte
+    after:  the copy of the payload into the AudioFramer buffer. Masking is
+            done in place with numpy; without numpy, the big integer
+            fallback creates 4 temporary copies and writes back a 5th.
+
+numpy is imported here if installed, as _mask only uses it when the
+application already imported it; the masking path measured is printed.
+
+Usage: python benchmarks/send_audio_framing.py [chunk_size_bytes]
+"""
+from sys import argv, modules
+from threading import Thread
+from time import process_time
+import socket
+
+from cpqdasr.recognizer_protocol import send_audio_msg
+from cpqdasr.recognizer_protocol.ws4py_api import ASRClient
+
+try:
+    import numpy  # noqa: F401
+except ImportError:
+    pass
+
+BYTES_PER_SECOND = 8000 * 2
+AUDIO_SECONDS = 60
+
+
+def drain(sock):
+    while sock.recv(1 << 16):
+        pass
+
+
+def make_client():
+    client = ASRClient("ws://localhost:8025/asr-server/asr")
+    client.sock.close()
+    client.sock, peer = socket.socketpair()
+    t = Thread(target=drain, args=(peer,))
+    t.daemon = True
+    t.start()
+    return client
+
+
+def run(send, chunk_size):
+    payload = bytes(range(256)) * (chunk_size // 256) + bytes(chunk_size % 256)
+    chunks = AUDIO_SECONDS * BYTES_PER_SECOND // chunk_size
+    beg = process_time()
+    for _ in range(chunks):
+        send(payload)
+    return (process_time() - beg) / AUDIO_SECONDS
+
+
+def main():
+    chunk_size = int(argv[1]) if len(argv) > 1 else 4096
+    client = make_client()
+
+    def before(payload):
+        client.send(send_audio_msg(payload, False), binary=True)
+
+    def after(payload):
+        client.send_audio(payload, False)
+
+    copies_before = 4
+    has_numpy = modules.get("numpy") is not None
+    copies_after = 1 if has_numpy else 6
+    cpu_before = run(before, chunk_size)
+    cpu_after = run(after, chunk_size)
+    print(
+        "Chunk size: {} bytes, masking: {}".format(
+            chunk_size, "numpy" if has_numpy else "big integer"
+        )
+    )
+    print("{:>8} {:>22} {:>26}".format("", "bytes copied / audio s", "CPU ms / audio s"))
+    for name, copies, cpu in [
+        ("before", copies_before, cpu_before),
+        ("after", copies_after, cpu_after),
+    ]:
+        print(
+            "{:>8} {:>22} {:>26.3f}".format(
+                name, copies * BYTES_PER_SECOND, cpu * 1000
+            )
+        )
+    client.client_terminated = True
+
+
+if __name__ == "__main__":
+    main()
@@ -71,10 +71,9 @@ if __name__ == "__main__":
 
     source = BufferAudioSource()
     asr.recognize(source, lm)
-    audio, rate = sf.read(apath)
-
-    # From float32 to int16, and then to raw bytes
-    source.write((audio * 2 ** 15).astype("int16").tobytes())
+    # Decoded one second at a time, directly as int16 raw bytes
+    for block in sf.blocks(apath, blocksize=8000, dtype="int16"):
+        source.write(block.tobytes())
     source.finish()
     res = asr.wait_recognition_result()
 
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 from .recognizer import (
     SpeechRecognizer,
+    AsyncSpeechRecognizer,
+    SpeechRecognizerPool,
+    ReconnectPolicy,
     RecognitionException,
     LanguageModelList,
     PartialRecognitionResult,
 )
 from .recognizer import BufferAudioSource, FileAudioSource, MicAudioSource
+from .recognizer import PacedAudioSource, EncodedAudioSource, DecodedAudioSource
+from .recognizer import VoiceActivitySource
+from .recognizer import MultiChannelAudioSource, ChannelAudioSource
 from .recognizer import RecognitionListener
+from .recognizer_protocol import TraceWriter
 from .ws_parser import WsParser
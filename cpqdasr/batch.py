@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Batch transcription of audio files.
+
+Files are recognized by a fixed number of concurrent sessions from a
+SpeechRecognizerPool, so each session is created once and reused for many
+files. Results are appended to a JSONL file as soon as each file is done,
+in completion order. The same file is the checkpoint of the run: when
+resuming, files which already have a successful line are skipped, and
+failed ones are retried.
+
+Usage:
+    cpqdasr-batch -w ws://127.0.0.1:8025/asr-server/asr \\
+        -l builtin:slm/general -s 8 -o results.jsonl /path/to/audio_dir
+"""
+from argparse import ArgumentParser
+from fnmatch import fnmatch
+from queue import Queue, Empty
+from threading import Lock, Thread
+from time import time
+import json
+import logging
+import os
+import sys
+
+from .recognizer import (
+    SpeechRecognizerPool,
+    LanguageModelList,
+    FileAudioSource,
+    RecognitionException,
+)
+
+
+def list_inputs(path, pattern="*.wav"):
+    """
+    Lists the audio files to be transcribed.
+
+    :path:    Either a directory, which is searched recursively for files
+              matching <pattern>, or a manifest file with one audio path per
+              line. Blank lines and lines starting with '#' are ignored, and
+              relative paths are taken relative to the manifest.
+    :pattern: fnmatch pattern for file names when <path> is a directory
+    :returns: List of paths, in a stable order
+    """
+    if os.path.isdir(path):
+        paths = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if fnmatch(name, pattern):
+                    paths.append(os.path.join(root, name))
+        return paths
+    base = os.path.dirname(path)
+    paths = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            paths.append(os.path.join(base, line))
+    return paths
+
+
+def read_checkpoint(output_path):
+    """
+    Reads the paths which were successfully transcribed by a previous run
+    from its JSONL output. A truncated last line, e.g. from a crash while
+    writing, is ignored.
+
+    :returns: set of paths
+    """
+    done = set()
+    if not os.path.isfile(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["path"])
+    return done
+
+
+def _scores_to_dict(scores):
+    if scores is None:
+        return None
+    return {name: getattr(scores, name) for name in scores.__slots__}
+
+
+def result_to_dict(result):
+    """
+    Converts a RecognitionResult to a JSON serializable dict.
+    """
+    return {
+        "result_code": result.result_code,
+        "speech_segment_index": result.speech_segment_index,
+        "last_speech_segment": result.last_speech_segment,
+        "sentence_start_time_milliseconds": result.sentence_start_time_milliseconds,
+        "sentence_end_time_milliseconds": result.sentence_end_time_milliseconds,
+        "alternatives": result.alternatives,
+        "age_scores": _scores_to_dict(result.age_scores),
+        "gender_scores": _scores_to_dict(result.gender_scores),
+        "emotion_scores": _scores_to_dict(result.emotion_scores),
+    }
+
+
+class BatchTranscriber:
+    """
+    Transcribes a list of audio files with concurrent, reused sessions.
+
+    :server_url:        The CPqD ASR Server Websocket URL
+    :lm_list:           LanguageModelList used for every file
+    :output_path:       JSONL file to which one line per file is appended
+    :sessions:          Number of concurrent sessions
+    :config:            Recognition config for each START_RECOGNITION
+    :resume:            If True, files already transcribed in <output_path>
+                        are skipped. Otherwise, <output_path> is truncated.
+    :audio_sample_rate: Sample rate assumed for raw files, used for the
+                        throughput report
+    :recognizer_kwargs: kwargs for each SpeechRecognizer instance
+
+    Each output line has the file "path", its "status" ("ok" or "error"),
+    "audio_seconds", the "elapsed_seconds" of its recognition, and either
+    its "results" or its "error".
+    """
+
+    def __init__(
+        self,
+        server_url,
+        lm_list,
+        output_path,
+        sessions=4,
+        config=None,
+        resume=False,
+        audio_sample_rate=8000,
+        **recognizer_kwargs
+    ):
+        assert isinstance(lm_list, LanguageModelList)
+        assert sessions > 0
+        self._server_url = server_url
+        self._lm_list = lm_list
+        self._output_path = output_path
+        self._sessions = sessions
+        self._config = config
+        self._resume = resume
+        self._audio_sample_rate = audio_sample_rate
+        self._recognizer_kwargs = recognizer_kwargs
+        self._recognizer_kwargs["audio_sample_rate"] = audio_sample_rate
+        self._logger = logging.getLogger("cpqdasr")
+        self._lock = Lock()
+        self._output = None
+        self._pool = None
+        self._queue = None
+        self._total = 0
+        self._beg = None
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.audio_seconds = 0.0
+
+    @property
+    def wall_seconds(self):
+        if self._beg is None:
+            return 0.0
+        return time() - self._beg
+
+    @property
+    def throughput(self):
+        """
+        Audio hours transcribed per wall-clock hour, i.e. the real-time
+        factor of the whole run.
+        """
+        wall = self.wall_seconds
+        if wall <= 0:
+            return 0.0
+        return self.audio_seconds / wall
+
+    def summary(self):
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "audio_hours": self.audio_seconds / 3600,
+            "wall_hours": self.wall_seconds / 3600,
+            "audio_hours_per_wall_hour": self.throughput,
+        }
+
+    def run(self, paths):
+        """
+        Transcribes the given files and blocks until all are done.
+
+        :returns: The summary dict of the run
+        """
+        done = set()
+        if self._resume:
+            done = read_checkpoint(self._output_path)
+        self._queue = Queue()
+        for path in paths:
+            if path in done:
+                self.skipped += 1
+            else:
+                self._queue.put(path)
+        self._total = self._queue.qsize()
+        self._logger.info(
+            "Transcribing {} files, skipping {} already done".format(
+                self._total, self.skipped
+            )
+        )
+        self._beg = time()
+        self._output = open(self._output_path, "a" if self._resume else "w")
+        if self._resume and self._output.tell() > 0:
+            # A crashed run may have left an unterminated line
+            with open(self._output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._output.write("\n")
+        self._pool = SpeechRecognizerPool(
+            self._server_url,
+            min_size=min(self._sessions, self._total),
+            max_size=self._sessions,
+            max_idle_seconds=None,
+            **self._recognizer_kwargs
+        )
+        try:
+            self._pool.warm()
+            workers = [
+                Thread(target=self._worker)
+                for _ in range(min(self._sessions, self._total))
+            ]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        finally:
+            self._pool.close()
+            self._output.close()
+        summary = self.summary()
+        self._logger.info(
+            "Batch finished: {completed} ok, {failed} failed, {skipped} skipped, "
+            "{audio_hours_per_wall_hour:.2f} audio-h/h".format(**summary)
+        )
+        return summary
+
+    def _worker(self):
+        while True:
+            try:
+                path = self._queue.get_nowait()
+            except Empty:
+                return
+            self._write(self._transcribe(path))
+
+    def _transcribe(self, path):
+        record = {"path": path, "status": "ok", "audio_seconds": 0.0}
+        beg = time()
+        try:
+            with FileAudioSource(path) as source:
+                sample_rate = source.sample_rate or self._audio_sample_rate
+                record["audio_seconds"] = source.data_size / (
+                    sample_rate * source.sample_width * source.channels
+                )
+                with self._pool.leased() as asr:
+                    if asr.recognize(source, self._lm_list, self._config) is None:
+                        raise RecognitionException(
+                            "FAILURE", "Recognizer is not ready"
+                        )
+                    results = asr.wait_recognition_result()
+            if not results:
+                raise RecognitionException("FAILURE", "Recognition aborted")
+            record["results"] = [result_to_dict(r) for r in results]
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+        record["elapsed_seconds"] = time() - beg
+        return record
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._output.write(line)
+            self._output.flush()
+            if record["status"] == "ok":
+                self.completed += 1
+                self.audio_seconds += record["audio_seconds"]
+            else:
+                self.failed += 1
+                self._logger.warning(
+                    "Error on {}: {}".format(record["path"], record["error"])
+                )
+            self._logger.info(
+                "[{}/{}] {} {} ({:.2f} audio-h/h)".format(
+                    self.completed + self.failed,
+                    self._total,
+                    record["status"],
+                    record["path"],
+                    self.throughput,
+                )
+            )
+
+
+def _language_model(lm):
+    if os.path.isfile(lm):
+        alias = os.path.splitext(os.path.basename(lm))[0]
+        return LanguageModelList.grammar_from_path(alias, lm)
+    return LanguageModelList.from_uri(lm)
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog="cpqdasr-batch",
+        description="Transcribes a directory or a manifest of audio files "
+        "with the CPqD ASR Server, writing one JSON line per file.",
+    )
+    parser.add_argument("input", help="Audio directory or manifest file")
+    parser.add_argument("-w", "--url", required=True, help="ASR Server URL")
+    parser.add_argument(
+        "-l",
+        "--lm",
+        required=True,
+        action="append",
+        help="Language model URI or grammar path. May be repeated.",
+    )
+    parser.add_argument("-o", "--output", required=True, help="JSONL output")
+    parser.add_argument(
+        "-s", "--sessions", type=int, default=4, help="Concurrent sessions"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip files already transcribed in the output",
+    )
+    parser.add_argument(
+        "--pattern", default="*.wav", help="File pattern for input directories"
+    )
+    parser.add_argument("-u", "--user", default="")
+    parser.add_argument("-p", "--password", default="")
+    parser.add_argument(
+        "-r", "--sample-rate", type=int, default=8000, choices=[8000, 16000]
+    )
+    parser.add_argument(
+        "-v",
+        "--parameter",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Session parameter. May be repeated.",
+    )
+    parser.add_argument("--max-wait-seconds", type=float, default=600)
+    parser.add_argument(
+        "--log-level",
+        default="info",
+        choices=["error", "warning", "info", "debug"],
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper()),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    session_config = None
+    if args.parameter:
+        session_config = dict(p.split("=", 1) for p in args.parameter)
+    lm_list = LanguageModelList(*[_language_model(lm) for lm in args.lm])
+    transcriber = BatchTranscriber(
+        args.url,
+        lm_list,
+        args.output,
+        sessions=args.sessions,
+        resume=args.resume,
+        audio_sample_rate=args.sample_rate,
+        credentials=(args.user, args.password),
+        session_config=session_config,
+        max_wait_seconds=args.max_wait_seconds,
+    )
+    summary = transcriber.run(list_inputs(args.input, args.pattern))
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
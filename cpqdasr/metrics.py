@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Per-recognition latency and traffic metrics.
+
+SpeechRecognizer and ASRClient take a "metrics" argument with a MetricsSink,
+or a list of them, which receives a RecognitionMetrics instance whenever a
+recognition finishes, is cancelled or is aborted. Without sinks, no
+timestamp is taken and nothing is counted.
+
+Sinks are called from the WebSocket I/O thread, so they should not block.
+"""
+from threading import Lock
+import logging
+import socket
+
+
+class RecognitionMetrics:
+    """
+    Metrics of a single recognition. Durations are in seconds, and are None
+    if the corresponding phase did not happen.
+
+    Session phases, which are repeated for every recognition of a session:
+    :connect_seconds:         WebSocket connection and handshake
+    :create_session_seconds:  CREATE_SESSION round trip
+    :set_parameters_seconds:  SET_PARAMETERS round trip
+    :session_recognition:     Index of the recognition in its session,
+                              starting at 0, so that session phases may be
+                              accounted once per session
+
+    Recognition phases:
+    :define_grammar_seconds:  dict of DEFINE_GRAMMAR round trips by grammar
+                              id, which precede START_RECOGNITION
+    :first_partial_seconds:   From START_RECOGNITION to the first partial
+                              result
+    :final_latency_seconds:   From the last audio packet to the final result
+    :recognition_seconds:     From START_RECOGNITION to the final result
+    :result_status:           Result-Status of the final result, or
+                              "CANCELED" or "ABORTED"
+    :bytes_sent:              Bytes of ASR messages sent, audio and
+                              DEFINE_GRAMMAR included
+    :messages_sent:           Number of ASR messages sent
+    :messages_received:       Number of ASR messages received
+    :decode_errors:           Number of message bodies which could not be
+                              decoded
+
+    Send queue, only with SpeechRecognizer's send_queue_bytes:
+    :send_queue_high_water_bytes: Largest amount of audio in the queue
+    :send_queue_stall_seconds:    Time the audio source waited for room in
+                                  the queue, i.e. for the network
+    :send_queue_dropped_bytes:    Audio discarded from a full queue
+    """
+
+    def __init__(self):
+        self.connect_seconds = None
+        self.create_session_seconds = None
+        self.set_parameters_seconds = None
+        self.session_recognition = 0
+        self.define_grammar_seconds = {}
+        self.first_partial_seconds = None
+        self.final_latency_seconds = None
+        self.recognition_seconds = None
+        self.result_status = None
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.decode_errors = 0
+        self.send_queue_high_water_bytes = None
+        self.send_queue_stall_seconds = None
+        self.send_queue_dropped_bytes = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class MetricsSink:
+    """
+    Interface for metrics sinks. Subclass it, reimplementing "record".
+    """
+
+    def record(self, metrics):
+        """
+        Called when a recognition is finished.
+
+        :metrics: Instance of RecognitionMetrics
+        """
+        pass
+
+
+class CallbackSink(MetricsSink):
+    """
+    Calls fn(metrics) for each recognition.
+    """
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    def record(self, metrics):
+        self._fn(metrics)
+
+
+class LoggingSink(MetricsSink):
+    """
+    Logs one line per recognition, with every metric as key=value.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self._logger = logger or logging.getLogger("cpqdasr")
+        self._level = level
+
+    def record(self, metrics):
+        if self._logger.isEnabledFor(self._level):
+            self._logger.log(
+                self._level,
+                "Recognition metrics: "
+                + " ".join(
+                    "{}={}".format(k, v) for k, v in sorted(metrics.as_dict().items())
+                ),
+            )
+
+
+_TIMINGS = [
+    ("connect", "connect_seconds", "WebSocket connection time"),
+    ("create_session", "create_session_seconds", "CREATE_SESSION round trip"),
+    ("set_parameters", "set_parameters_seconds", "SET_PARAMETERS round trip"),
+    ("define_grammar", "define_grammar_seconds", "DEFINE_GRAMMAR round trip"),
+    ("first_partial", "first_partial_seconds", "Time to the first partial result"),
+    ("final_latency", "final_latency_seconds", "Final result after the last packet"),
+    ("recognition", "recognition_seconds", "Recognition time"),
+    ("send_queue_stall", "send_queue_stall_seconds", "Audio source send queue stall"),
+]
+
+_SESSION_TIMINGS = ("connect", "create_session", "set_parameters")
+
+_COUNTERS = [
+    ("sent_bytes", "bytes_sent", "Bytes of ASR messages sent"),
+    ("sent_messages", "messages_sent", "ASR messages sent"),
+    ("received_messages", "messages_received", "ASR messages received"),
+    ("decode_errors", "decode_errors", "Message bodies which could not be decoded"),
+    (
+        "send_queue_dropped_bytes",
+        "send_queue_dropped_bytes",
+        "Audio bytes dropped by send queues",
+    ),
+]
+
+
+def _timings(metrics):
+    """
+    Yields (name, seconds) for the timings of a RecognitionMetrics, with
+    session phases only on the first recognition of each session.
+    """
+    for name, attr, _ in _TIMINGS:
+        if name in _SESSION_TIMINGS and metrics.session_recognition > 0:
+            continue
+        value = getattr(metrics, attr)
+        if isinstance(value, dict):
+            for seconds in value.values():
+                yield name, seconds
+        elif value is not None:
+            yield name, value
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class OpenMetricsExporter(MetricsSink):
+    """
+    Aggregates metrics into histograms and counters, exported in the
+    OpenMetrics (Prometheus) text format by render().
+
+    :prefix:  Prefix of the metric names
+    :buckets: Upper bounds of the histogram buckets, in seconds
+    """
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    def __init__(
+        self,
+        prefix="cpqdasr",
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    ):
+        self._prefix = prefix
+        self._buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self._histograms = {
+            name: _Histogram(self._buckets) for name, _, _ in _TIMINGS
+        }
+        self._counters = {name: 0 for name, _, _ in _COUNTERS}
+        self._send_queue_high_water = 0
+        self._recognitions = {}
+
+    def record(self, metrics):
+        with self._lock:
+            for name, seconds in _timings(metrics):
+                self._histograms[name].observe(seconds)
+            for name, attr, _ in _COUNTERS:
+                self._counters[name] += getattr(metrics, attr)
+            if metrics.send_queue_high_water_bytes is not None:
+                self._send_queue_high_water = max(
+                    self._send_queue_high_water, metrics.send_queue_high_water_bytes
+                )
+            status = metrics.result_status
+            self._recognitions[status] = self._recognitions.get(status, 0) + 1
+
+    def render(self):
+        """
+        :returns: str with the current values in the OpenMetrics text format
+        """
+        lines = []
+        with self._lock:
+            for name, _, help_text in _TIMINGS:
+                metric = "{}_{}_seconds".format(self._prefix, name)
+                h = self._histograms[name]
+                lines.append("# TYPE {} histogram".format(metric))
+                lines.append("# UNIT {} seconds".format(metric))
+                lines.append("# HELP {} {}.".format(metric, help_text))
+                for bound, count in zip(h.buckets, h.counts):
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, count))
+                lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, h.count))
+                lines.append("{}_sum {}".format(metric, h.sum))
+                lines.append("{}_count {}".format(metric, h.count))
+            for name, _, help_text in _COUNTERS:
+                metric = "{}_{}".format(self._prefix, name)
+                lines.append("# TYPE {} counter".format(metric))
+                lines.append("# HELP {} {}.".format(metric, help_text))
+                lines.append("{}_total {}".format(metric, self._counters[name]))
+            metric = "{}_send_queue_high_water_bytes".format(self._prefix)
+            lines.append("# TYPE {} gauge".format(metric))
+            lines.append("# UNIT {} bytes".format(metric))
+            lines.append(
+                "# HELP {} Largest send queue of a recognition.".format(metric)
+            )
+            lines.append("{} {}".format(metric, self._send_queue_high_water))
+            metric = "{}_recognitions".format(self._prefix)
+            lines.append("# TYPE {} counter".format(metric))
+            lines.append("# HELP {} Recognitions by result status.".format(metric))
+            for status, count in sorted(self._recognitions.items()):
+                lines.append('{}_total{{status="{}"}} {}'.format(metric, status, count))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class StatsdSink(MetricsSink):
+    """
+    Sends metrics to a StatsD server over UDP, as timers in milliseconds and
+    counters, in a single datagram per recognition.
+
+    :host:   StatsD host
+    :port:   StatsD port
+    :prefix: Prefix of the metric names
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="cpqdasr"):
+        self._address = (host, port)
+        self._prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._logger = logging.getLogger("cpqdasr")
+
+    def record(self, metrics):
+        lines = [
+            "{}.{}:{:.3f}|ms".format(self._prefix, name, seconds * 1000)
+            for name, seconds in _timings(metrics)
+        ]
+        for name, attr, _ in _COUNTERS:
+            lines.append("{}.{}:{}|c".format(self._prefix, name, getattr(metrics, attr)))
+        if metrics.send_queue_high_water_bytes is not None:
+            lines.append(
+                "{}.send_queue_high_water_bytes:{}|g".format(
+                    self._prefix, metrics.send_queue_high_water_bytes
+                )
+            )
+        lines.append(
+            "{}.recognitions.{}:1|c".format(
+                self._prefix, str(metrics.result_status).lower()
+            )
+        )
+        try:
+            self._sock.sendto("\n".join(lines).encode(), self._address)
+        except OSError as e:
+            self._logger.warning("Error on sending metrics: {}".format(e))
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Recognition of multi-channel recordings, e.g. calls with the agent and the
+customer on separate channels.
+
+The file is read and decoded once by a MultiChannelAudioSource, and each
+channel is recognized concurrently by its own session, leased from a
+SpeechRecognizerPool so that sessions are reused between files. Sessions
+are in continuous mode, so that every utterance of a channel is
+recognized. The results of all channels are merged in time order, tagged
+with their channel.
+"""
+from collections import namedtuple
+import logging
+
+from .recognizer import (
+    SpeechRecognizerPool,
+    LanguageModelList,
+    MultiChannelAudioSource,
+    RecognitionException,
+)
+
+ChannelResult = namedtuple(
+    "ChannelResult", ["channel", "start_seconds", "end_seconds", "result"]
+)
+ChannelResult.__doc__ = """
+RecognitionResult of a channel, with its sentence start and end times in
+seconds.
+"""
+
+
+class MultiChannelRecognizer:
+    """
+    Recognizes every channel of an audio file concurrently.
+
+    :server_url:        The CPqD ASR Server Websocket URL
+    :lm_list:           LanguageModelList used for every channel
+    :config:            Recognition config for each START_RECOGNITION
+    :max_channels:      Maximum number of channels recognized at once, which
+                        is the maximum number of sessions kept open
+    :chunk_size:        Size of the blocks of audio which will be sent (in
+                        samples)
+    :recognizer_kwargs: kwargs for each SpeechRecognizer instance. Their
+                        audio_sample_rate must match the files.
+                        continuous_mode defaults to True, as a recognition
+                        otherwise ends at the first end of speech.
+
+    Example:
+        with MultiChannelRecognizer(url, lm_list) as recognizer:
+            for r in recognizer.recognize("call.wav"):
+                print(r.channel, r.start_seconds, r.result.alternatives[0])
+    """
+
+    def __init__(
+        self,
+        server_url,
+        lm_list,
+        config=None,
+        max_channels=2,
+        chunk_size=4096,
+        **recognizer_kwargs
+    ):
+        assert isinstance(lm_list, LanguageModelList)
+        assert max_channels > 0
+        self._lm_list = lm_list
+        self._config = config
+        self._max_channels = max_channels
+        self._chunk_size = chunk_size
+        self._logger = logging.getLogger("cpqdasr")
+        recognizer_kwargs.setdefault("continuous_mode", True)
+        self._pool = SpeechRecognizerPool(
+            server_url,
+            min_size=0,
+            max_size=max_channels,
+            max_idle_seconds=None,
+            **recognizer_kwargs
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def recognize(self, path, channels=None):
+        """
+        Recognizes the given channels of an audio file, and blocks until all
+        of them are done.
+
+        :path:     Path to the audio input, in any format supported by
+                   soundfile
+        :channels: Indexes of the channels to recognize. Defaults to all.
+        :returns: List of ChannelResult sorted by start time, then channel
+        """
+        with MultiChannelAudioSource(path, self._chunk_size) as source:
+            if channels is None:
+                channels = range(source.channels)
+            channels = sorted(set(channels))
+            if not channels or channels[-1] >= source.channels:
+                raise RecognitionException(
+                    "FAILURE",
+                    "Invalid channels {} for a file with {} channels".format(
+                        channels, source.channels
+                    ),
+                )
+            if len(channels) > self._max_channels:
+                raise RecognitionException(
+                    "FAILURE",
+                    "{} channels exceed max_channels={}".format(
+                        len(channels), self._max_channels
+                    ),
+                )
+            for s in source.sources:
+                if s.channel not in channels:
+                    s.close()
+            self._pool.warm(len(channels))
+            sessions = []
+            try:
+                # The send audio thread of each session consumes its own
+                # channel, so channels are sent and recognized concurrently
+                for c in channels:
+                    asr = self._pool.lease()
+                    sessions.append((c, asr))
+                    handle = asr.recognize(
+                        source.sources[c], self._lm_list, self._config
+                    )
+                    if handle is None:
+                        raise RecognitionException(
+                            "FAILURE", "Recognizer is not ready"
+                        )
+                    # A recognition may end before its audio, e.g. on
+                    # NO_MATCH, and its unread channel would otherwise
+                    # hold back the other ones
+                    handle.add_done_callback(
+                        lambda h, s=source.sources[c]: s.close()
+                    )
+                merged = []
+                for c, asr in sessions:
+                    results = asr.wait_recognition_result()
+                    if not results:
+                        raise RecognitionException(
+                            "FAILURE", "Recognition of channel {} aborted".format(c)
+                        )
+                    merged += [
+                        ChannelResult(
+                            c,
+                            r.sentence_start_time_milliseconds / 1000.0,
+                            r.sentence_end_time_milliseconds / 1000.0,
+                            r,
+                        )
+                        for r in results
+                    ]
+            except Exception:
+                for c, asr in sessions:
+                    source.sources[c].close()
+                    if not asr.is_idle():
+                        try:
+                            asr.cancel_recognition()
+                        except RecognitionException:
+                            # Finished or lost its connection
+                            pass
+                raise
+            finally:
+                for _, asr in sessions:
+                    self._pool.release(asr)
+        merged.sort(key=lambda r: (r.start_seconds, r.channel))
+        return merged
+
+    def close(self):
+        self._pool.close()
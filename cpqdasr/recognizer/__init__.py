@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
-from .speech_recognizer import SpeechRecognizer, RecognitionException
+from .speech_recognizer import (
+    SpeechRecognizer,
+    RecognitionException,
+    RecognitionHandle,
+)
+from .async_speech_recognizer import AsyncSpeechRecognizer
+from .pool import SpeechRecognizerPool
+from .reconnect import ReconnectPolicy
 from .language_model_list import LanguageModelList
 from .listener import RecognitionListener
 from .result import RecognitionResult, PartialRecognitionResult
 from .audio_source import BufferAudioSource, FileAudioSource, MicAudioSource
+from .audio_source import PacedAudioSource, EncodedAudioSource, DecodedAudioSource
+from .audio_source import VoiceActivitySource
+from .audio_source import MultiChannelAudioSource, ChannelAudioSource
@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+asyncio Speech Recognizer class.
+
+Same recognition flow as SpeechRecognizer, but driven by coroutines on a
+single event loop instead of one WebSocket I/O thread plus one send audio
+thread per session. Depends on the 'websockets' package, which is only
+imported when the first connection is made.
+"""
+from base64 import b64encode
+from collections import deque
+import asyncio
+import logging
+
+from cpqdasr.recognizer_protocol import (
+    create_session_msg,
+    set_parameters_msg,
+    release_session_msg,
+    cancel_recog_msg,
+    start_recog_msg,
+    start_input_timers_msg,
+    define_grammar_msg,
+    parse_response,
+    parse_recognition_result,
+    AudioFramer,
+)
+
+from .listener import RecognitionListener, _overrides
+from .language_model_list import LanguageModelList, GrammarCache
+from .result import PartialRecognitionResult
+from .result_stream import AsyncResultStream
+from .speech_recognizer import RecognitionException, _source_wav
+
+
+class AsyncSpeechRecognizer:
+    """
+    asyncio version of SpeechRecognizer.
+
+    Each instance represents a single recognition session in the configured
+    server. Audio sources may be either asynchronous iterators, which are
+    consumed directly, or regular iterators. Regular iterators whose
+    "blocking" attribute is False, e.g. FileAudioSource, are read inline;
+    the others, e.g. BufferAudioSource, are read in the given executor, or
+    in the loop's default executor, so that they do not stall the loop.
+    Each live blocking source holds a worker of the executor while it waits
+    for audio, so with many concurrent sessions either pass an executor
+    with a worker per session or feed the audio as asynchronous iterators.
+
+    With pipeline_grammars, the DEFINE_GRAMMAR messages of a recognition are
+    sent back to back, as in SpeechRecognizer. Partial results are skipped
+    and message bodies which cannot be decoded are counted in
+    decode_errors, also as in SpeechRecognizer. continuous_mode and
+    retained_results are also as in SpeechRecognizer, and so is
+    stream_results, which returns an asynchronous iterator.
+
+    Example:
+        async with AsyncSpeechRecognizer(url) as asr:
+            await asr.recognize(FileAudioSource(path), lm_list)
+            results = await asr.wait_recognition_result()
+    """
+
+    def __init__(
+        self,
+        server_url,
+        credentials=("", ""),
+        session_config=None,
+        user_agent=None,
+        channel_identifier=None,
+        listener=RecognitionListener(),
+        audio_sample_rate=8000,
+        audio_encoding="pcm",
+        max_wait_seconds=30,
+        auto_close=False,
+        pipeline_grammars=False,
+        skip_unused_partials=True,
+        continuous_mode=False,
+        retained_results=None,
+        executor=None,
+    ):
+        assert audio_sample_rate in [8000, 16000]
+        assert audio_encoding in ["pcm", "wav", "raw"]
+        assert isinstance(listener, RecognitionListener)
+        self._serverUrl = server_url
+        self._user = credentials[0]
+        self._password = credentials[1]
+        self._session_config = session_config
+        self._user_agent = user_agent
+        self._channel_identifier = channel_identifier
+        self._listener = listener
+        self._audio_sample_rate = audio_sample_rate
+        self._audio_encoding = audio_encoding
+        self._max_wait_seconds = max_wait_seconds
+        self._auto_close = auto_close
+        self._pipeline_grammars = pipeline_grammars
+        self._continuous_mode = continuous_mode
+        self._retained_results = retained_results
+        self._executor = executor
+        self._decode_partials = not skip_unused_partials or _overrides(
+            listener, "on_partial_recognition"
+        )
+        self.decode_errors = 0
+        self._logger = logging.getLogger("cpqdasr")
+        self._ws = None
+        self._status = "DISCONNECTED"
+        self._receive_task = None
+        self._send_audio_task = None
+        self._responses = {}
+        self._result_future = None
+        self._result_stream = None
+        self._is_recognizing = False
+        self._audio_source = None
+        self._framer = AudioFramer()
+        self._grammar_cache = GrammarCache()
+        self.recognition_list = []
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, etype, value, traceback):
+        await self.close()
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def grammar_cache(self):
+        """
+        GrammarCache with the inline grammars defined on the current session
+        and its hit and miss counters.
+        """
+        return self._grammar_cache
+
+    async def connect(self):
+        """
+        Opens the WebSocket connection and creates the recognition session,
+        applying the session config if one was given.
+        """
+        if self._ws is not None:
+            return
+        from websockets.asyncio.client import connect
+
+        # Grammars are defined per session
+        self._grammar_cache.clear()
+        credentials = b64encode(
+            b":".join([self._user.encode(), self._password.encode()])
+        )
+        credentials = b"Basic " + credentials
+        headers = [("Authorization", credentials.decode())]
+        self._ws = await asyncio.wait_for(
+            connect(self._serverUrl, additional_headers=headers, max_size=None),
+            self._max_wait_seconds,
+        )
+        self._receive_task = asyncio.ensure_future(self._receive_loop())
+        msg = create_session_msg(self._user_agent, self._channel_identifier)
+        await self._request("CREATE_SESSION", msg)
+        if self._session_config is not None:
+            self._status = "WAITING_CONFIG"
+            await self._request(
+                "SET_PARAMETERS", set_parameters_msg(self._session_config)
+            )
+        self._status = "IDLE"
+
+    async def _send(self, msg):
+        await self._ws.send(msg)
+        self._logger.debug(b"SEND: " + msg)
+
+    def _expect(self, key):
+        """
+        :key: Method of the expected RESPONSE, or a (method, Content-ID)
+              tuple for DEFINE_GRAMMAR
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._responses[key] = future
+        return future
+
+    async def _request(self, method, msg, key=None):
+        """
+        Sends a message and waits for the RESPONSE with the same Method.
+        Raises RecognitionException if the response is not successful.
+        """
+        key = key or method
+        future = self._expect(key)
+        await self._send(msg)
+        return await self._response(method, key, future)
+
+    async def _response(self, method, key, future):
+        try:
+            h = await asyncio.wait_for(future, self._max_wait_seconds)
+        except asyncio.TimeoutError:
+            self._responses.pop(key, None)
+            msg = "{} timeout after {} seconds".format(method, self._max_wait_seconds)
+            self._logger.warning(msg)
+            raise RecognitionException("FAILURE", msg)
+        if h.get("Result") != "SUCCESS":
+            msg = "Error on {}: {}".format(method, h.get("Error-Code", h))
+            self._logger.warning(msg)
+            raise RecognitionException("FAILURE", msg)
+        return h
+
+    async def _receive_loop(self):
+        from websockets.exceptions import ConnectionClosed
+
+        try:
+            async for data in self._ws:
+                self._received_message(data)
+                stream = self._result_stream
+                if stream is not None:
+                    # Stops reading the socket until the caller catches up
+                    await stream.wait_room()
+        except ConnectionClosed as e:
+            self._logger.info("ASR WS closed down {}".format(e))
+        finally:
+            self._abort()
+
+    def _abort(self):
+        if self._status != "DISCONNECTED":
+            self._status = "ABORTED"
+        self._logger.debug("Aborting")
+        for future in self._responses.values():
+            if not future.done():
+                future.set_result({"Result": "ABORTED"})
+        self._responses = {}
+        if self._result_future is not None and not self._result_future.done():
+            self._result_future.set_result(None)
+        if self._is_recognizing:
+            # Not read anymore, e.g. releases a producer waiting for room in
+            # a BufferAudioSource
+            self._close_audio_source()
+
+    def _close_audio_source(self):
+        close = getattr(self._audio_source, "close", None)
+        if close is not None:
+            close()
+
+    def _received_message(self, data):
+        self._logger.debug(data)
+        call, h, b = parse_response(
+            data, self._decode_partials or self._result_stream is not None
+        )
+        if b is None:
+            self.decode_errors += 1
+            self._logger.warning("Could not decode body of {}".format(call))
+            b = {}
+        if call not in [
+            "RESPONSE",
+            "START_OF_SPEECH",
+            "END_OF_SPEECH",
+            "RECOGNITION_RESULT",
+        ]:
+            self._logger.warning("Bad response:\n\n{}".format(call))
+            return
+
+        if call == "RESPONSE":
+            method = h.get("Method")
+            key = method
+            if method == "DEFINE_GRAMMAR":
+                key = self._grammar_key(h.get("Content-ID"))
+            if method == "RELEASE_SESSION":
+                self._status = "DISCONNECTED"
+            elif method == "START_RECOGNITION" and h.get("Result") == "SUCCESS":
+                self._status = "LISTENING"
+            elif method == "CANCEL_RECOGNITION":
+                self._status = "IDLE"
+            elif "Error-Code" in h and key not in self._responses:
+                self._logger.warning(
+                    "Non-fatal error in API call: Code " "{}".format(h["Error-Code"])
+                )
+                self._abort()
+            future = self._responses.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(h)
+            return
+
+        if call == "RECOGNITION_RESULT":
+            if h["Result-Status"] == "PROCESSING":
+                # Only decoded if used, see parse_response
+                if b:
+                    partial = PartialRecognitionResult(
+                        b.get("segment_index", 0),
+                        b["alternatives"][0]["text"].strip(),
+                    )
+                    self._listener.on_partial_recognition(partial)
+                    if self._result_stream is not None:
+                        self._result_stream.put(partial)
+            else:
+                result, last_segment = parse_recognition_result(h, b)
+                self.recognition_list.append(result)
+                self._listener.on_recognition_result(b)
+                self._listener.on_segment_result(result)
+                if self._result_stream is not None:
+                    self._result_stream.put(result)
+                if last_segment:
+                    self._status = h["Result-Status"]
+                    if (
+                        self._result_future is not None
+                        and not self._result_future.done()
+                    ):
+                        self._result_future.set_result(None)
+
+    def _grammar_key(self, grammar_id):
+        key = ("DEFINE_GRAMMAR", grammar_id)
+        if key in self._responses:
+            return key
+        # Without a matching Content-ID, responses are matched in order
+        for key in self._responses:
+            if isinstance(key, tuple):
+                return key
+        return None
+
+    async def _define_grammars(self, grammars):
+        """
+        Defines the inline grammars which are not defined on the session yet.
+        Raises RecognitionException if any of them fails.
+        """
+        grammars = [g for g in grammars if not self._grammar_cache.is_defined(*g)]
+        for grammar in grammars:
+            self._grammar_cache.discard(grammar[0])
+        if not self._pipeline_grammars:
+            for grammar in grammars:
+                key = ("DEFINE_GRAMMAR", grammar[0])
+                await self._request("DEFINE_GRAMMAR", define_grammar_msg(*grammar), key)
+                self._grammar_cache.add(*grammar)
+            return
+        pending = []
+        for grammar in grammars:
+            key = ("DEFINE_GRAMMAR", grammar[0])
+            pending.append((grammar, key, self._expect(key)))
+            await self._send(define_grammar_msg(*grammar))
+        outcomes = await asyncio.gather(
+            *[self._response("DEFINE_GRAMMAR", k, f) for _, k, f in pending],
+            return_exceptions=True
+        )
+        error = None
+        for (grammar, _, _), outcome in zip(pending, outcomes):
+            if isinstance(outcome, Exception):
+                error = error or outcome
+            else:
+                self._grammar_cache.add(*grammar)
+        if error is not None:
+            raise error
+
+    async def recognize(self, audio_source, lm_list, config=None, wav=True):
+        """
+        Starts a recognition with the given audio source and language models.
+
+        Returns as soon as START_RECOGNITION is sent, while audio is streamed
+        by a separate task once the server is listening.
+        """
+        assert isinstance(lm_list, LanguageModelList)
+        wav = _source_wav(audio_source, wav)
+        if self._ws is None:
+            await self.connect()
+        if self._is_recognizing:
+            msg = "Last recognition is still pending."
+            self._logger.error(msg)
+            raise RecognitionException("FAILURE", msg)
+        if self._status != "IDLE":
+            msg = "Recognizer is not ready: status is {}".format(self._status)
+            self._logger.warning(msg)
+            raise RecognitionException("FAILURE", msg)
+        self._is_recognizing = True
+        self._audio_source = audio_source
+        lm_uris = []
+        grammars = []
+        for lm in lm_list._lm_list:
+            if type(lm) == str:
+                lm_uris.append(lm)
+            elif type(lm) == tuple:
+                grammars.append(lm)
+                lm_uris.append("session:" + lm[0])
+        try:
+            await self._define_grammars(grammars)
+        except RecognitionException:
+            self._is_recognizing = False
+            raise
+        if self._retained_results is None:
+            self.recognition_list = []
+        else:
+            self.recognition_list = deque(maxlen=self._retained_results)
+        if self._continuous_mode:
+            config = dict(config or {})
+            config.setdefault("decoder.continuousMode", "true")
+        self._result_future = asyncio.get_running_loop().create_future()
+        self._result_stream = None
+        listening = self._expect("START_RECOGNITION")
+        await self._send(start_recog_msg(lm_uris, config))
+        await self._send(start_input_timers_msg())
+        self._send_audio_task = asyncio.ensure_future(
+            self._send_audio_loop(audio_source, listening, wav)
+        )
+
+    async def _audio_chunks(self, audio_source):
+        if hasattr(audio_source, "__aiter__"):
+            async for chunk in audio_source:
+                yield chunk
+            return
+        if not getattr(audio_source, "blocking", True):
+            for chunk in audio_source:
+                yield chunk
+            return
+        loop = asyncio.get_running_loop()
+        iterator = iter(audio_source)
+        while True:
+            chunk = await loop.run_in_executor(self._executor, next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def _send_audio_loop(self, audio_source, listening, wav):
+        try:
+            h = await asyncio.wait_for(listening, self._max_wait_seconds)
+        except asyncio.TimeoutError:
+            self._logger.warning("Timeout waiting for START_RECOGNITION")
+            self._abort()
+            return
+        if h.get("Result") != "SUCCESS":
+            self._logger.warning("Error on start recognition: {}".format(h))
+            self._abort()
+            return
+        content_type = getattr(audio_source, "content_type", None)
+        chunks = self._audio_chunks(audio_source)
+        b = None
+        async for x in chunks:
+            if b is None:
+                b = x
+                continue
+            if self._status != "LISTENING":
+                break
+            await self._ws.send(self._framer.frame(b, False, wav, content_type))
+            self._logger.debug("Send audio")
+            b = x
+        if b is None:
+            self._logger.warning("Empty audio source!")
+            b = b""
+        if self._status == "LISTENING":
+            await self._ws.send(self._framer.frame(b, True, wav, content_type))
+            self._logger.debug("Send audio")
+
+    def stream_results(self, max_pending=16):
+        """
+        Asynchronous iterator over the results of the current recognition,
+        as in SpeechRecognizer.stream_results. Each result is awaited for
+        at most max_wait_seconds.
+
+        Example:
+            await asr.recognize(source, lm_list)
+            async for result in asr.stream_results():
+                print(result)
+        """
+        stream = AsyncResultStream(max_pending)
+        if not self._is_recognizing:
+            self._logger.warning(
+                "Trying to stream results without having a recognition started!"
+            )
+            stream.finish()
+            return self._stream_results(stream)
+        stream.extend(self.recognition_list)
+        self._result_stream = stream
+        self._result_future.add_done_callback(lambda future: stream.finish())
+        return self._stream_results(stream)
+
+    async def _stream_results(self, stream):
+        try:
+            while True:
+                try:
+                    result = await stream.get(self._max_wait_seconds)
+                except asyncio.TimeoutError:
+                    msg = "Stream results timeout after {} seconds".format(
+                        self._max_wait_seconds
+                    )
+                    self._logger.warning(msg)
+                    await self.cancel_recognition()
+                    raise RecognitionException("FAILURE", msg)
+                if result is None:
+                    break
+                yield result
+        finally:
+            # The caller may stop iterating early
+            stream.finish(discard=True)
+        if (
+            self._result_stream is stream
+            and self._result_future is not None
+            and self._result_future.done()
+        ):
+            await self.wait_recognition_result()
+
+    async def _finish_recognition(self):
+        task = self._send_audio_task
+        self._send_audio_task = None
+        if task is not None:
+            if not task.done():
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                # e.g. the connection dropped while sending
+                self._logger.warning("Error on sending audio: {}".format(e))
+        self._result_future = None
+        self._result_stream = None
+        self._is_recognizing = False
+
+    async def wait_recognition_result(self):
+        if self._ws is None:
+            msg = "Trying to wait recognition with closed recognizer!"
+            self._logger.warning(msg)
+            return []
+        if not self._is_recognizing:
+            msg = "Trying to wait recognition without having one started!"
+            self._logger.warning(msg)
+            if self._auto_close:
+                await self.close()
+            return []
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(self._result_future), self._max_wait_seconds
+            )
+        except asyncio.TimeoutError:
+            msg = "Wait recognition timeout after " "{} seconds".format(
+                self._max_wait_seconds
+            )
+            self._logger.warning(msg)
+            await self.cancel_recognition()
+            if self._auto_close:
+                await self.close()
+            raise RecognitionException("FAILURE", msg)
+        await self._finish_recognition()
+        if self._status == "ABORTED":
+            self.recognition_list = []
+            ret = []
+        else:
+            self._status = "IDLE"
+            # The list is handed to the caller, so no copy is needed
+            ret = self.recognition_list
+            if isinstance(ret, deque):
+                ret = list(ret)
+            self.recognition_list = []
+        if self._auto_close:
+            await self.close()
+        return ret
+
+    async def cancel_recognition(self):
+        if not self._is_recognizing:
+            msg = "No recognition is being performed to be cancelled."
+            raise RecognitionException("FAILURE", msg)
+        if self._result_stream is not None:
+            # Also resumes the receive loop if it waits for room
+            self._result_stream.finish(discard=True)
+        cancelled = None
+        if self._ws is not None and self._status not in ["ABORTED", "DISCONNECTED"]:
+            cancelled = self._expect("CANCEL_RECOGNITION")
+            await self._send(cancel_recog_msg())
+        await self._finish_recognition()
+        self._close_audio_source()
+        self.recognition_list = []  # Clear result after cancelling
+        if cancelled is not None:
+            # The session only accepts a new recognition once idle
+            try:
+                await asyncio.wait_for(cancelled, self._max_wait_seconds)
+            except asyncio.TimeoutError:
+                self._responses.pop("CANCEL_RECOGNITION", None)
+                self._logger.warning(
+                    "Cancel recognition timeout after "
+                    "{} seconds".format(self._max_wait_seconds)
+                )
+
+    async def close(self):
+        try:
+            await self.cancel_recognition()
+        except RecognitionException:
+            pass
+        else:
+            self._logger.warning("Cancelled active recognition on close.")
+        if self._ws is not None:
+            try:
+                if self._status not in ["ABORTED", "DISCONNECTED"]:
+                    await self._send(release_session_msg())
+                await self._ws.close()
+            except Exception as e:
+                self._logger.warning(
+                    "Non-critical error on disconnect: " "{}".format(e)
+                )
+            if self._receive_task is not None:
+                await self._receive_task
+            self._ws = None
+            self._receive_task = None
+        self._status = "DISCONNECTED"
@@ -18,15 +18,34 @@
 
 Audio generation examples.
 
-Generators should always yield bytestrings. Our ASR interface only supports
+Generators should always yield bytestrings (or other bytes-like objects, such
+as memoryviews). Our ASR interface only supports
 linear PCM with little-endian signed 16bit samples. Their length may be
 variable, as long as they are smaller than the predefined maximum payload size
 from the configured websocket connection, and the length of each bytestring
 is modulo 0 with the size of the sample (i.e. is even in length).
+DecodedAudioSource converts files in other formats, sample rates or channel
+layouts to this format. EncodedAudioSource compresses the output of another
+source, and is sent with its own Content-Type.
+
+Native dependencies are imported when a source which needs them is created,
+so that importing cpqdasr does not load them: MicAudioSource needs pyaudio
+(cpqdasr[mic]), and the sources which decode, encode or analyze audio need
+soundfile and numpy (cpqdasr[file]). FileAudioSource, BufferAudioSource and
+PacedAudioSource need neither.
 """
-import soundfile as sf
-import pyaudio
-import time
+from bisect import bisect_right
+from collections import deque
+from threading import Condition
+from time import monotonic, sleep
+import logging
+import mmap
+import os
+import struct
+
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
 
 
 class MicAudioSource:
@@ -38,7 +57,8 @@ class MicAudioSource:
     predefined maximum payload from the configured websocket connection.
 
     :sample_rate: Sample rate for the captured audio
-    :sample_type: Sample type provided by pyaudio
+    :sample_type: Sample type provided by pyaudio. Defaults to
+                  pyaudio.paInt16.
     :chunk_size: Size of the blocks of audio which will be sent (in samples)
     :yields: bytestrings of size <chunk_size> * sizeof(<sample_type>)
 
@@ -46,7 +66,11 @@ class MicAudioSource:
     is halted when the recognition instance is cancelled or closed.
     """
 
-    def __init__(self, sample_rate=8000, sample_type=pyaudio.paInt16, chunk_size=4096):
+    def __init__(self, sample_rate=8000, sample_type=None, chunk_size=4096):
+        import pyaudio
+
+        if sample_type is None:
+            sample_type = pyaudio.paInt16
         self._audio = pyaudio.PyAudio()
         self._sample_rate = sample_rate
         self._sample_type = sample_type
@@ -75,80 +99,973 @@ class MicAudioSource:
         return self._stream.read(self._chunk_size)
 
 
-def FileAudioSource(path, chunk_size=4096):
+def _parse_wav_header(data):
+    """
+    Parses the header of a RIFF/WAVE file.
+
+    :data: bytes-like object with the file contents
+    :returns: dict with the format fields and the offset and size of the
+              data chunk, or None if data is not a RIFF/WAVE file
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    header = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset : offset + 4])
+        (chunk_size,) = struct.unpack_from("<I", data, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            fields = struct.unpack_from("<HHIIHH", data, body)
+            audio_format = fields[0]
+            if audio_format == _WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                # First two bytes of the SubFormat GUID
+                (audio_format,) = struct.unpack_from("<H", data, body + 24)
+            header = {
+                "audio_format": audio_format,
+                "channels": fields[1],
+                "sample_rate": fields[2],
+                "block_align": fields[4],
+                "bits_per_sample": fields[5],
+            }
+        elif chunk_id == b"data":
+            if header is None:
+                return None
+            # Streamed files may have an unset or oversized data length
+            header["data_offset"] = body
+            header["data_size"] = min(chunk_size, len(data) - body)
+            return header
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+class FileAudioSource:
     """
-    Simple audio file reader. Should be compatible with all files supported
-    by 'soundfile' package.
+    Memory-mapped audio file reader.
+
+    RIFF/WAVE files with 16-bit linear PCM samples have their header parsed,
+    and only the contents of their data chunk are yielded, so they are sent
+    as raw audio. Any other file is assumed to be raw 16-bit PCM, or to be
+    in a format which is decoded by the server, and is yielded as is.
 
     chunk_size is in samples, so the size in bytes of the sent packet is
-    2*chunk_size, since we are sending 16-bit signed PCM samples. chunk_size*2
-    should be smaller than the predefined maximum payload from the configured
-    websocket connection.
+    2*chunk_size for mono 16-bit PCM. Chunks are always aligned to sample
+    boundaries. chunk_size*2 should be smaller than the predefined maximum
+    payload from the configured websocket connection.
+
+    Chunks are zero-copy memoryview slices of the mapped file, so the file
+    is read by the page cache instead of a syscall and an allocation for
+    each chunk. The file is closed when the source is exhausted, when
+    "close" is called or when leaving a "with" block.
 
-    :path: Path to the audio input (any format supported by soundfile package)
+    :path: Path to the audio input
     :chunk_size: Size of the blocks of audio which will be sent (in samples)
 
-    :yields: bytestrings of size <chunk_size> * 2
+    :yields: memoryviews of size <chunk_size> * 2 (for mono 16-bit audio)
 
     Terminates when the audio file provided has no more content
+
+    Attributes:
+    :wav:          False if the header was stripped, or None if the file was
+                   not recognized and is sent as is
+    :sample_rate:  Sample rate from the WAVE header, or None
+    :sample_width: Size of each sample in bytes
+    :channels:     Number of channels
+    :data_size:    Size in bytes of the audio which will be yielded
+    :blocking:     False, as chunks are read from memory
     """
-    f = open(path, "rb")
-    bytestr = f.read(chunk_size)
-    while bytestr:
-        yield bytestr
-        bytestr = f.read(chunk_size)
+
+    def __init__(self, path, chunk_size=4096):
+        self._file = open(path, "rb")
+        self._map = None
+        self._view = memoryview(b"")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+        header = _parse_wav_header(self._view)
+        self.wav = None
+        self.sample_rate = None
+        self.sample_width = 2
+        self.channels = 1
+        self._offset = 0
+        self._end = len(self._view)
+        if (
+            header is not None
+            and header["audio_format"] == _WAVE_FORMAT_PCM
+            and header["bits_per_sample"] == 16
+        ):
+            self.wav = False
+            self.sample_rate = header["sample_rate"]
+            self.channels = header["channels"]
+            self._offset = header["data_offset"]
+            self._end = self._offset + header["data_size"]
+        frame_size = self.sample_width * self.channels
+        self._end -= (self._end - self._offset) % frame_size
+        self.data_size = self._end - self._offset
+        self._chunk_bytes = chunk_size * frame_size
+        self.blocking = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_view"):
+            self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._offset >= self._end:
+            self.close()
+            raise StopIteration
+        end = min(self._offset + self._chunk_bytes, self._end)
+        chunk = self._view[self._offset : end]
+        self._offset = end
+        return chunk
+
+    def close(self):
+        """
+        Closes the file. The mapping itself is released once no yielded
+        chunk is referenced anymore.
+        """
+        self._offset = self._end
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Chunks still referenced by the caller keep the mapping
+                # alive until they are garbage collected
+                pass
+        self._file.close()
 
 
 class BufferAudioSource:
     """
-    Very simple buffer source.
+    Buffer source backed by a ring buffer.
 
     This generator has a "write" method which updates its internal buffer,
-    which is periodically consumed by the ASR instance in which it is inserted.
+    which is consumed by the ASR instance in which it is inserted. Reads
+    block until a full chunk is available, and are woken up as soon as
+    "write" or "finish" is called.
 
-    :buffer_size: Size of the internal buffer (in bytes)
-    :yields: bytestrings of size <buffer_size>
+    :chunk_size: Size of the yielded chunks (in bytes)
+    :max_size:   Capacity of the internal buffer (in bytes). If None, the
+                 buffer grows as needed. Otherwise, "write" follows the
+                 overflow policy when the buffer is full.
+    :overflow:   Policy for writes to a full buffer:
+                 "block":       waits until the ASR instance consumes enough
+                                of the buffer (default)
+                 "drop":        discards the written bytes which do not fit
+                 "drop_oldest": discards the oldest buffered bytes to make
+                                room for the written ones
+    :yields: bytestrings of size <chunk_size>
 
     Terminates only if the "finish" method is called, in which case the
-    remaining buffer is sent regardless of its size.
+    remaining buffer is sent regardless of its size, or if the "close"
+    method is called, e.g. by the recognizer when the recognition is
+    cancelled or aborted, in which case the buffer is dropped and further
+    writes are discarded.
     """
 
-    def __init__(self, chunk_size=4096):
-        self._buffer = b""
+    def __init__(self, chunk_size=4096, max_size=None, overflow="block"):
+        assert overflow in ["block", "drop", "drop_oldest"]
+        assert max_size is None or max_size >= chunk_size
         self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._overflow = overflow
+        if max_size is None:
+            self._buffer = bytearray(4 * chunk_size)
+        else:
+            self._buffer = bytearray(max_size)
+        self._start = 0  # Position of the oldest byte in the ring
+        self._length = 0  # Number of buffered bytes
         self._finished = False
+        self._closed = False
+        self._cv = Condition()
+        self.dropped_bytes = 0
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        while True:
-            if len(self._buffer) >= self._chunk_size:
-                r = self._buffer[: self._chunk_size]
-                self._buffer = self._buffer[self._chunk_size :]
-                return r
-            elif self._finished:
-                if self._buffer:
-                    r = self._buffer
-                    self._buffer = b""
-                    return r
-                else:
-                    raise StopIteration
-            time.sleep(0.05)
+        with self._cv:
+            while (
+                self._length < self._chunk_size
+                and not self._finished
+                and not self._closed
+            ):
+                self._cv.wait()
+            if self._length == 0:
+                raise StopIteration
+            n = min(self._chunk_size, self._length)
+            r = self._read(n)
+            self._cv.notify_all()
+            return r
+
+    def __len__(self):
+        return self._length
+
+    def _read(self, n):
+        capacity = len(self._buffer)
+        end = self._start + n
+        if end <= capacity:
+            r = bytes(self._buffer[self._start : end])
+        else:
+            r = bytes(self._buffer[self._start :]) + bytes(
+                self._buffer[: end - capacity]
+            )
+        self._start = end % capacity
+        self._length -= n
+        return r
+
+    def _copy_in(self, data):
+        capacity = len(self._buffer)
+        n = len(data)
+        begin = (self._start + self._length) % capacity
+        first = min(n, capacity - begin)
+        self._buffer[begin : begin + first] = data[:first]
+        self._buffer[: n - first] = data[first:]
+        self._length += n
+
+    def _grow(self, size):
+        capacity = len(self._buffer)
+        while capacity < size:
+            capacity *= 2
+        buffer = bytearray(capacity)
+        first = min(self._length, len(self._buffer) - self._start)
+        buffer[:first] = self._buffer[self._start : self._start + first]
+        buffer[first : self._length] = self._buffer[: self._length - first]
+        self._buffer = buffer
+        self._start = 0
 
     def write(self, byte_str):
         """
         Writes to the buffer.
 
-        :byte_str: A byte string (char array). Currently only 16-bit signed
+        :byte_str: A byte string (char array) or any object supporting the
+                   buffer protocol. Currently only 16-bit signed
                    little-endian linear PCM is accepted.
+
+        Returns without writing once the source is closed, also if waiting
+        for room in the buffer.
         """
-        self._finished = False
-        self._buffer += byte_str
+        data = memoryview(byte_str).cast("B")
+        with self._cv:
+            if self._closed:
+                return
+            self._finished = False
+            if self._max_size is None:
+                if self._length + len(data) > len(self._buffer):
+                    self._grow(self._length + len(data))
+                self._copy_in(data)
+            elif self._overflow == "drop":
+                free = self._max_size - self._length
+                if len(data) > free:
+                    self.dropped_bytes += len(data) - free
+                    data = data[:free]
+                self._copy_in(data)
+            elif self._overflow == "drop_oldest":
+                if len(data) > self._max_size:
+                    self.dropped_bytes += len(data) - self._max_size
+                    data = data[len(data) - self._max_size :]
+                excess = self._length + len(data) - self._max_size
+                if excess > 0:
+                    self.dropped_bytes += excess
+                    self._start = (self._start + excess) % self._max_size
+                    self._length -= excess
+                self._copy_in(data)
+            else:
+                while len(data):
+                    while self._length == self._max_size and not self._closed:
+                        self._cv.wait()
+                    if self._closed:
+                        return
+                    n = min(len(data), self._max_size - self._length)
+                    self._copy_in(data[:n])
+                    data = data[n:]
+                    self._cv.notify_all()
+            self._cv.notify_all()
 
     def finish(self):
         """
         Signals the ASR instance that one's finished writing and is now waiting
         for the recognition result.
         """
-        self._finished = True
+        with self._cv:
+            self._finished = True
+            self._cv.notify_all()
+
+    def close(self):
+        """
+        Drops the buffered audio and stops the source: reads end and writes,
+        including the ones waiting for room in the buffer, return without
+        writing.
+        """
+        with self._cv:
+            self._closed = True
+            self._length = 0
+            self._cv.notify_all()
+
+
+class PacedAudioSource:
+    """
+    Wraps an audio source, yielding its chunks paced relative to real time.
+
+    Each chunk is yielded once the wall-clock time corresponding to its end
+    has elapsed since the first chunk was requested, at the given speed, as
+    if it was being captured live. Timing is computed from the sample rate
+    and sample width, so chunks may have any size.
+
+    :source:       The wrapped audio source
+    :rate:         Speed relative to real time, e.g. 1.0 for real time or 4.0
+                   for 4x real time. None sends chunks as fast as the source
+                   yields them, which maximizes batch throughput.
+    :sample_rate:  Sample rate of the audio. Defaults to the source's
+                   "sample_rate" attribute, or 8000.
+    :sample_width: Size of each sample in bytes. Defaults to the source's
+                   "sample_width" attribute, or 2.
+    :channels:     Number of channels. Defaults to the source's "channels"
+                   attribute, or 1.
+    :yields: the chunks yielded by the source
+
+    Attributes:
+    :target_rate:    The rate argument
+    :achieved_rate:  Seconds of audio yielded per second of wall-clock time
+    :audio_seconds:  Seconds of audio yielded so far
+    :blocking:       True, unless rate is None and the source does not block
+    """
+
+    def __init__(
+        self, source, rate=1.0, sample_rate=None, sample_width=None, channels=None
+    ):
+        assert rate is None or rate > 0
+        self._source = iter(source)
+        self._wrapped = source
+        self.target_rate = rate
+        if sample_rate is None:
+            sample_rate = getattr(source, "sample_rate", None) or 8000
+        if sample_width is None:
+            sample_width = getattr(source, "sample_width", None) or 2
+        if channels is None:
+            channels = getattr(source, "channels", None) or 1
+        self.sample_rate = sample_rate
+        self._bytes_per_second = float(sample_rate * sample_width * channels)
+        self._logger = logging.getLogger("cpqdasr")
+        self._start = None
+        self._end = None
+        self.audio_seconds = 0.0
+
+    @property
+    def wav(self):
+        return getattr(self._wrapped, "wav", None)
+
+    @property
+    def blocking(self):
+        if self.target_rate is not None:
+            return True
+        return getattr(self._wrapped, "blocking", True)
+
+    @property
+    def elapsed_seconds(self):
+        """Wall-clock time since the first chunk was requested."""
+        if self._start is None:
+            return 0.0
+        end = self._end if self._end is not None else monotonic()
+        return end - self._start
+
+    @property
+    def achieved_rate(self):
+        elapsed = self.elapsed_seconds
+        if elapsed <= 0:
+            return None
+        return self.audio_seconds / elapsed
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._start is None:
+            self._start = monotonic()
+        try:
+            chunk = next(self._source)
+        except StopIteration:
+            if self._end is None:
+                self._end = monotonic()
+                self._logger.info(
+                    "Paced audio source: target rate {}, achieved rate "
+                    "{:.3f}".format(self.target_rate, self.achieved_rate or 0.0)
+                )
+            raise
+        self.audio_seconds += len(chunk) / self._bytes_per_second
+        if self.target_rate is not None:
+            delay = self._start + self.audio_seconds / self.target_rate - monotonic()
+            if delay > 0:
+                sleep(delay)
+        return chunk
+
+    def close(self):
+        if hasattr(self._wrapped, "close"):
+            self._wrapped.close()
+
+
+class DecodedAudioSource:
+    """
+    Decodes an audio file in any format supported by soundfile (WAV, FLAC,
+    OGG, MP3, ...), downmixed to mono, resampled to sample_rate with a
+    polyphase filter and converted to 16-bit PCM.
+
+    The file is decoded block_size frames at a time, so memory does not
+    depend on the length of the file.
+
+    :path:        Path to the audio input
+    :sample_rate: Sample rate of the yielded audio, which should be the
+                  recognizer's audio_sample_rate
+    :chunk_size:  Size of the blocks of audio which will be sent (in samples)
+    :block_size:  Number of frames decoded at a time
+    :yields: bytestrings of size <chunk_size> * 2, except for the last one
+
+    Attributes:
+    :wav:                False, as no header is yielded
+    :sample_rate:        The sample_rate argument
+    :sample_width:       2
+    :channels:           1
+    :source_sample_rate: Sample rate of the file
+    :source_channels:    Number of channels of the file
+    :blocking:           False, as the file is read without waiting for it
+    """
+
+    def __init__(self, path, sample_rate=8000, chunk_size=4096, block_size=16384):
+        import soundfile as sf
+        from . import dsp
+
+        self._file = sf.SoundFile(path)
+        self.wav = False
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.channels = 1
+        self.source_sample_rate = self._file.samplerate
+        self.source_channels = self._file.channels
+        self._resampler = None
+        if self.source_sample_rate != sample_rate:
+            self._resampler = dsp.PolyphaseResampler(
+                self.source_sample_rate, sample_rate
+            )
+        self._chunk_bytes = 2 * chunk_size
+        self._block_size = block_size
+        self._pending = bytearray()
+        self._chunks = self._generate()
+        self.blocking = False
+
+    def _generate(self):
+        from . import dsp
+
+        blocks = self._file.blocks(self._block_size, dtype="float32", always_2d=True)
+        for block in blocks:
+            block = dsp.downmix(block)
+            if self._resampler is not None:
+                block = self._resampler.process(block)
+            yield dsp.to_int16(block).tobytes()
+        if self._resampler is not None:
+            yield dsp.to_int16(self._resampler.flush()).tobytes()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while len(self._pending) < self._chunk_bytes:
+            data = next(self._chunks, None)
+            if data is None:
+                break
+            self._pending += data
+        if not self._pending:
+            self.close()
+            raise StopIteration
+        chunk = bytes(self._pending[: self._chunk_bytes])
+        del self._pending[: self._chunk_bytes]
+        return chunk
+
+    def close(self):
+        self._chunks.close()
+        self._pending = bytearray()
+        self._file.close()
+
+
+class MultiChannelAudioSource:
+    """
+    Reads a multi-channel audio file once, splitting it into one source of
+    16-bit mono PCM per channel, e.g. for call recordings with the agent and
+    the customer on separate channels.
+
+    Each block read from the file is shared by all the channel sources as
+    strided NumPy views, so channels are de-interleaved without a copy until
+    each chunk is serialized for sending. The file is read on demand by
+    whichever channel runs out of audio first. A channel source may be
+    iterated from its own thread, as long as all the others are consumed too:
+    a channel which is <max_pending> chunks ahead of another waits for it.
+    Closing a channel source drops its pending audio and stops the wait.
+
+    :path:        Path to the audio input, in any format supported by
+                  soundfile
+    :chunk_size:  Size of the blocks of audio which will be sent (in samples)
+    :max_pending: Maximum number of chunks held for a channel
+
+    Attributes:
+    :sources:     List with one ChannelAudioSource per channel
+    :sample_rate: Sample rate of the file
+    :channels:    Number of channels of the file
+    :frames:      Number of samples per channel
+    """
+
+    def __init__(self, path, chunk_size=4096, max_pending=16):
+        import soundfile as sf
+
+        assert max_pending > 0
+        self._file = sf.SoundFile(path)
+        self.sample_rate = self._file.samplerate
+        self.channels = self._file.channels
+        self.frames = self._file.frames
+        self._blocks = self._file.blocks(chunk_size, dtype="int16", always_2d=True)
+        self._max_pending = max_pending
+        self._cv = Condition()
+        self._pending = [deque() for _ in range(self.channels)]
+        self._open = [True] * self.channels
+        self._eof = False
+        self.sources = [ChannelAudioSource(self, c) for c in range(self.channels)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    @property
+    def audio_seconds(self):
+        return self.frames / float(self.sample_rate)
+
+    def _read(self):
+        """
+        Reads the next block, queueing a view of each channel. Called with
+        the lock held.
+        """
+        block = next(self._blocks, None)
+        if block is None:
+            self._eof = True
+            self._file.close()
+        else:
+            for c, pending in enumerate(self._pending):
+                if self._open[c]:
+                    pending.append(block[:, c])
+        self._cv.notify_all()
+
+    def _next(self, channel):
+        with self._cv:
+            pending = self._pending[channel]
+            while not pending and self._open[channel] and not self._eof:
+                if any(len(p) >= self._max_pending for p in self._pending):
+                    self._cv.wait()
+                else:
+                    self._read()
+            if not pending:
+                return None
+            view = pending.popleft()
+            self._cv.notify_all()
+        return view.tobytes()
+
+    def _close(self, channel):
+        with self._cv:
+            self._open[channel] = False
+            self._pending[channel].clear()
+            if not any(self._open) and not self._eof:
+                self._eof = True
+                self._blocks.close()
+                self._file.close()
+            self._cv.notify_all()
+
+    def close(self):
+        for c in range(self.channels):
+            self._close(c)
+
+
+class ChannelAudioSource:
+    """
+    Source of a single channel of a MultiChannelAudioSource.
+
+    :yields: bytestrings of size <chunk_size> * 2, except for the last one
+
+    Attributes:
+    :channel:      Index of the channel
+    :wav:          False, as no header is yielded
+    :sample_rate:  Sample rate of the file
+    :sample_width: 2
+    :channels:     1
+    """
+
+    def __init__(self, parent, channel):
+        self._parent = parent
+        self.channel = channel
+        self.wav = False
+        self.sample_rate = parent.sample_rate
+        self.sample_width = 2
+        self.channels = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self._parent._next(self.channel)
+        if chunk is None:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        self._parent._close(self.channel)
+
+
+class VoiceActivitySource:
+    """
+    Wraps a source of 16-bit mono PCM, shortening the stretches without
+    speech, so that silence and background noise are neither sent nor
+    decoded by the server.
+
+    Audio is classified in frames: a frame is speech if its energy is above
+    energy_threshold and its zero crossing rate is below max_zcr, which
+    rejects broadband noise of the same energy. Non-speech stretches longer
+    than max_silence_ms are cut in the middle, keeping padding_ms next to
+    the speech on each side, so that the server still detects the end of
+    each utterance. Silence before the first speech is cut down to
+    padding_ms, and after the last speech to max_silence_ms - padding_ms.
+
+    Only the last padding_ms of non-speech are held back until it is known
+    whether speech follows, so memory is bounded.
+
+    Result times refer to the audio which was sent, and are translated to
+    times in the original audio by original_time().
+
+    :source:           The wrapped audio source
+    :sample_rate:      Sample rate of the audio. Defaults to the source's
+                       "sample_rate" attribute, or 8000.
+    :frame_ms:         Frame length
+    :energy_threshold: Minimum energy of speech frames, in dBFS
+    :max_zcr:          Maximum zero crossing rate of speech frames, from 0
+                       to 1
+    :padding_ms:       Audio kept before and after speech
+    :max_silence_ms:   Longest non-speech stretch which is sent as is. Must
+                       be at least 2 * padding_ms.
+    :yields: bytestrings with the kept audio, of variable size
+
+    Attributes:
+    :offsets:       List of (sent sample, original sample) pairs, one for
+                    the start of the audio and one after each cut
+    :audio_seconds: Seconds of audio read from the source
+    :sent_seconds:  Seconds of audio yielded
+    :blocking:      Whether the source blocks
+    """
+
+    def __init__(
+        self,
+        source,
+        sample_rate=None,
+        frame_ms=20,
+        energy_threshold=-35.0,
+        max_zcr=0.5,
+        padding_ms=300,
+        max_silence_ms=1000,
+    ):
+        assert max_silence_ms >= 2 * padding_ms
+        if getattr(source, "wav", None):
+            raise ValueError("Voice activity detection needs raw PCM audio")
+        if sample_rate is None:
+            sample_rate = getattr(source, "sample_rate", None) or 8000
+        self._source = iter(source)
+        self._wrapped = source
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+        self.channels = 1
+        self._frame_size = sample_rate * frame_ms // 1000
+        self._frame_bytes = 2 * self._frame_size
+        self._energy_threshold = energy_threshold
+        self._max_zcr = max_zcr
+        self._padding = padding_ms // frame_ms
+        self._head = (max_silence_ms - padding_ms) // frame_ms
+        self._remainder = b""
+        # Non-speech frames since the last speech frame, or None before the
+        # first speech frame
+        self._run = None
+        self._held = deque(maxlen=self._padding)
+        self._read = 0  # Samples read
+        self._sent = 0  # Samples yielded
+        self._cut = False  # Whether frames were dropped since the last sent
+        self.offsets = [(0, 0)]
+
+    @property
+    def wav(self):
+        return getattr(self._wrapped, "wav", None)
+
+    @property
+    def blocking(self):
+        return getattr(self._wrapped, "blocking", True)
+
+    @property
+    def audio_seconds(self):
+        return self._read / float(self.sample_rate)
+
+    @property
+    def sent_seconds(self):
+        return self._sent / float(self.sample_rate)
+
+    def original_time(self, seconds):
+        """
+        Translates a time in the sent audio, e.g. a word start time from a
+        result, to the time in the original audio.
+        """
+        sample = seconds * self.sample_rate
+        i = bisect_right(self.offsets, (sample, float("inf"))) - 1
+        sent, original = self.offsets[max(i, 0)]
+        return (original + sample - sent) / float(self.sample_rate)
+
+    def _keep(self, out, frame, position):
+        if self._cut:
+            self.offsets.append((self._sent, position))
+            self._cut = False
+        out.append(frame)
+        self._sent += self._frame_size
+
+    def _process(self, data):
+        import numpy as np
+        from . import dsp
+
+        samples = np.frombuffer(data, dtype="<i2")
+        energy, zcr = dsp.frame_features(samples, self._frame_size)
+        speech = (energy > self._energy_threshold) & (zcr < self._max_zcr)
+        view = memoryview(data)
+        out = []
+        for i, is_speech in enumerate(speech.tolist()):
+            frame = view[i * self._frame_bytes : (i + 1) * self._frame_bytes]
+            position = self._read + i * self._frame_size
+            if is_speech:
+                for held_position, held in self._held:
+                    self._keep(out, held, held_position)
+                self._held.clear()
+                self._keep(out, frame, position)
+                self._run = 0
+            elif self._run is not None and self._run < self._head:
+                self._keep(out, frame, position)
+                self._run += 1
+            else:
+                if len(self._held) == self._padding:
+                    self._cut = True
+                if self._padding:
+                    self._held.append((position, frame))
+                else:
+                    self._cut = True
+        self._read += len(speech) * self._frame_size
+        return b"".join(out)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for chunk in self._source:
+            data = self._remainder + bytes(chunk)
+            end = len(data) - len(data) % self._frame_bytes
+            self._remainder = data[end:]
+            out = self._process(data[:end])
+            if out:
+                return out
+        if self._remainder:
+            # The last partial frame is sent if the audio before it was
+            position = self._read
+            self._read += len(self._remainder) // 2
+            remainder, self._remainder = self._remainder, b""
+            if self._run is not None and self._run < self._head:
+                if self._cut:
+                    self.offsets.append((self._sent, position))
+                    self._cut = False
+                self._sent += len(remainder) // 2
+                return remainder
+        raise StopIteration
+
+    def close(self):
+        if hasattr(self._wrapped, "close"):
+            self._wrapped.close()
+
+
+class _StreamSink:
+    """
+    Write-only file object for soundfile, which keeps only the bytes which
+    were not taken yet. Writes to bytes which were already taken, i.e. the
+    header updates made by libsndfile when the file is closed, are dropped,
+    which leaves the stream length unset as in any live stream.
+    """
+
+    def __init__(self):
+        self._pending = bytearray()
+        self._taken = 0  # Stream position of the first pending byte
+        self._pos = 0
+        self._length = 0
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        n = len(data)
+        if self._pos < self._taken:
+            skip = min(n, self._taken - self._pos)
+            self._pos += skip
+            data = data[skip:]
+        i = self._pos - self._taken
+        if i > len(self._pending):
+            self._pending.extend(bytes(i - len(self._pending)))
+        self._pending[i : i + len(data)] = data
+        self._pos += len(data)
+        self._length = max(self._length, self._pos)
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        return b""
+
+    def take(self):
+        data = bytes(self._pending)
+        self._taken += len(data)
+        self._pending = bytearray()
+        return data
+
+
+# Encoding name: (soundfile format, subtype, Content-Type)
+_ENCODINGS = {
+    "flac": ("FLAC", "PCM_16", "audio/flac"),
+    "ogg_vorbis": ("OGG", "VORBIS", "audio/ogg"),
+    "ogg_opus": ("OGG", "OPUS", "audio/ogg"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+}
+
+
+class EncodedAudioSource:
+    """
+    Wraps a source of 16-bit linear PCM, yielding it compressed as a single
+    stream, e.g. in FLAC, which is lossless and typically 30 to 55% smaller
+    than PCM for speech (see benchmarks/audio_encoding.py). The recognizer
+    sends it with the "content_type" attribute as the Content-Type of the
+    audio.
+
+    Encoders work on blocks of samples (1152 samples for FLAC with
+    compression_level 0), so chunks are yielded as blocks are completed,
+    and the rest of the stream is yielded when the source is exhausted. To
+    pace the audio, wrap the PCM source with PacedAudioSource, not this one.
+
+    :source:            The wrapped audio source, which yields 16-bit PCM
+    :encoding:          "flac" (lossless), "ogg_vorbis", "ogg_opus" or
+                        "mp3" (lossy)
+    :sample_rate:       Sample rate of the audio. Defaults to the source's
+                        "sample_rate" attribute, or 8000.
+    :channels:          Number of channels. Defaults to the source's
+                        "channels" attribute, or 1.
+    :compression_level: From 0 (fastest) to 1 (smallest)
+    :content_type:      Content-Type for the server. Defaults to the one of
+                        the encoding, e.g. "audio/flac".
+    :yields: bytestrings with the next part of the stream
+
+    Attributes:
+    :pcm_bytes:     Bytes read from the source so far
+    :encoded_bytes: Bytes yielded so far
+    :blocking:      Whether the source blocks
+    """
+
+    def __init__(
+        self,
+        source,
+        encoding="flac",
+        sample_rate=None,
+        channels=None,
+        compression_level=0.0,
+        content_type=None,
+    ):
+        import soundfile as sf
+
+        if encoding not in _ENCODINGS:
+            raise ValueError("Unsupported audio encoding: {}".format(encoding))
+        sf_format, subtype, default_content_type = _ENCODINGS[encoding]
+        if sample_rate is None:
+            sample_rate = getattr(source, "sample_rate", None) or 8000
+        if channels is None:
+            channels = getattr(source, "channels", None) or 1
+        self._source = iter(source)
+        self._wrapped = source
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.content_type = content_type or default_content_type
+        self._frame_size = 2 * channels
+        self._remainder = b""
+        self._sink = _StreamSink()
+        self._encoder = sf.SoundFile(
+            self._sink,
+            "w",
+            sample_rate,
+            channels,
+            subtype,
+            format=sf_format,
+            compression_level=compression_level,
+        )
+        self.pcm_bytes = 0
+        self.encoded_bytes = 0
+
+    @property
+    def blocking(self):
+        return getattr(self._wrapped, "blocking", True)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._encoder.closed:
+            raise StopIteration
+        for chunk in self._source:
+            chunk = memoryview(chunk).cast("B")
+            self.pcm_bytes += len(chunk)
+            if self._remainder:
+                chunk = self._remainder + bytes(chunk)
+            # Partial frames are kept for the next chunk
+            end = len(chunk) - len(chunk) % self._frame_size
+            self._remainder = bytes(chunk[end:])
+            self._encoder.buffer_write(chunk[:end], "int16")
+            data = self._sink.take()
+            if data:
+                self.encoded_bytes += len(data)
+                return data
+        self._encoder.close()
+        data = self._sink.take()
+        self.encoded_bytes += len(data)
+        return data
+
+    def close(self):
+        if not self._encoder.closed:
+            self._encoder.close()
+        if hasattr(self._wrapped, "close"):
+            self._wrapped.close()
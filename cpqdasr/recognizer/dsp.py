@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Vectorized signal processing for audio sources: downmixing, sample
+conversion and streaming polyphase resampling.
+"""
+from math import gcd
+
+import numpy as np
+
+
+def downmix(block):
+    """
+    Averages the channels of a (frames, channels) block into a mono array.
+    """
+    if block.ndim == 1:
+        return block
+    if block.shape[1] == 1:
+        return block[:, 0]
+    return block.mean(axis=1, dtype=block.dtype)
+
+
+def to_int16(block):
+    """
+    Converts float samples in [-1, 1) to 16-bit PCM, clipping overflows.
+    """
+    return np.clip(np.rint(block * 32768.0), -32768, 32767).astype("<i2")
+
+
+def lowpass_filter(up, down, zero_crossings=10, beta=5.0):
+    """
+    Designs the anti-aliasing filter for resampling by up/down: a
+    Kaiser-windowed sinc with its cutoff at the lower Nyquist frequency,
+    as in scipy.signal.resample_poly.
+
+    :returns: float64 array with the filter taps, at the upsampled rate,
+              scaled by up to make up for zero stuffing
+    """
+    factor = max(up, down)
+    half = zero_crossings * factor
+    n = np.arange(-half, half + 1)
+    cutoff = 1.0 / factor
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(2 * half + 1, beta)
+    return taps * (up / taps.sum())
+
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler with zero phase delay.
+
+    Output sample n is the filtered input at time n * down / up, computed
+    only from the filter phase which has non-zero taps at that time. Blocks
+    of any size may be given to process(); the output is the same as for
+    the whole signal at once, up to the samples which still depend on
+    future input, which are returned by flush().
+
+    :from_rate: Input sample rate
+    :to_rate:   Output sample rate
+    """
+
+    def __init__(self, from_rate, to_rate):
+        g = gcd(int(from_rate), int(to_rate))
+        self.up = int(to_rate) // g
+        self.down = int(from_rate) // g
+        taps = lowpass_filter(self.up, self.down)
+        self._center = len(taps) // 2
+        self._width = -(-len(taps) // self.up)  # Taps per phase
+        padded = np.zeros(self._width * self.up)
+        padded[: len(taps)] = taps
+        # Row p holds the taps of phase p, reversed to match input windows
+        self._phases = padded.reshape(self._width, self.up).T[:, ::-1].copy()
+        # Input before the first sample is zero
+        self._buffer = np.zeros(self._width - 1, dtype=np.float32)
+        self._offset = 1 - self._width  # Input index of _buffer[0]
+        self._received = 0  # Input samples received
+        self._next = 0  # Index of the next output sample
+
+    def _last_input(self, n):
+        return (n * self.down + self._center) // self.up
+
+    def _run(self, end):
+        """
+        Computes the outputs up to (excluding) index end, whose inputs must
+        be in the buffer, and drops the inputs which are no longer needed.
+        """
+        if end <= self._next:
+            return np.zeros(0, dtype=np.float32)
+        n = np.arange(self._next, end, dtype=np.int64)
+        t = n * self.down + self._center
+        starts = t // self.up - (self._width - 1) - self._offset
+        windows = np.lib.stride_tricks.sliding_window_view(self._buffer, self._width)
+        out = np.einsum(
+            "ij,ij->i", self._phases[t % self.up], windows[starts], dtype=np.float64
+        ).astype(np.float32)
+        self._next = end
+        keep = self._last_input(end) - (self._width - 1) - self._offset
+        keep = max(0, min(keep, len(self._buffer)))
+        self._buffer = self._buffer[keep:]
+        self._offset += keep
+        return out
+
+    def process(self, block):
+        """
+        :block: 1-D array of float samples
+        :returns: float32 array with the output samples which are complete
+        """
+        block = np.asarray(block, dtype=np.float32)
+        self._buffer = np.concatenate([self._buffer, block])
+        self._received += len(block)
+        last = self._offset + len(self._buffer) - 1
+        # First n whose last input is not available yet
+        end = ((last + 1) * self.up - self._center - 1) // self.down + 1
+        return self._run(end)
+
+    def flush(self):
+        """
+        :returns: float32 array with the remaining output samples, computed
+                  with zeros after the last input
+        """
+        total = -(-self._received * self.up // self.down)
+        if total <= self._next:
+            return np.zeros(0, dtype=np.float32)
+        pad = self._last_input(total - 1) + 1 - (self._offset + len(self._buffer))
+        if pad > 0:
+            self._buffer = np.concatenate(
+                [self._buffer, np.zeros(pad, dtype=np.float32)]
+            )
+        return self._run(total)
+
+
+def frame_features(samples, frame_size):
+    """
+    Computes the energy and zero crossing rate of each complete frame.
+
+    :samples:    1-D int16 array
+    :frame_size: Samples per frame
+    :returns: Tuple of float arrays with the energy of each frame in dBFS
+              and the fraction of its consecutive samples which change sign
+    """
+    n = len(samples) // frame_size
+    frames = samples[: n * frame_size].reshape(n, frame_size).astype(np.float32)
+    power = np.einsum("ij,ij->i", frames, frames) / (frame_size * 32768.0 ** 2)
+    energy = 10.0 * np.log10(np.maximum(power, 1e-10))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_size - 1.0)
+    return energy, zcr
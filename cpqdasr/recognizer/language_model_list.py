@@ -5,6 +5,7 @@ Created on Tue Dec 26 16:25:15 2017
 
 @author: valterf
 """
+from hashlib import sha256
 import os
 
 
@@ -80,3 +81,43 @@ class LanguageModelList:
         with open(path, "r") as f:
             body = f.read()
         return alias, body
+
+
+class GrammarCache:
+    """
+    Inline grammars defined on a WebSocket session, by id and content hash,
+    so that DEFINE_GRAMMAR is only sent for new or changed grammars.
+
+    Attributes:
+    :hits:   Number of grammars which did not have to be defined again
+    :misses: Number of grammars which had to be defined
+    """
+
+    def __init__(self):
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def is_defined(self, grammar_id, body):
+        """
+        Checks if the grammar is already defined with the same body, counting
+        a hit or a miss.
+        """
+        if self._digests.get(grammar_id) == sha256(body.encode()).digest():
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, grammar_id, body):
+        self._digests[grammar_id] = sha256(body.encode()).digest()
+
+    def discard(self, grammar_id):
+        self._digests.pop(grammar_id, None)
+
+    def clear(self):
+        """
+        Forgets all grammars, e.g. when a new session is created. Counters
+        are kept.
+        """
+        self._digests = {}
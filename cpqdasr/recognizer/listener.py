@@ -65,9 +65,29 @@ class RecognitionListener:
         """
         Called when a final result is available.
 
+        :result: Decoded body of the RECOGNITION_RESULT message, as a dict
+        """
+        pass
+
+    def on_segment_result(self, result):
+        """
+        Called with the final result of each speech segment, as it arrives.
+        In continuous mode, a recognition has any number of segments, which
+        may be consumed here instead of kept until the recognition ends.
+
         :result: Instance of RecognitionResult
         """
         pass
 
     def on_error(self, error):
         pass
+
+
+def _overrides(listener, name):
+    """
+    Returns True if the listener reimplements the named callback, either in
+    a subclass or by assigning it on the instance.
+    """
+    callback = getattr(listener, name)
+    callback = getattr(callback, "__func__", callback)
+    return callback is not getattr(RecognitionListener, name)
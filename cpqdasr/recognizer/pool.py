@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Pool of pre-connected SpeechRecognizer instances.
+
+Creating a SpeechRecognizer costs a WebSocket handshake, a CREATE_SESSION
+round trip and, if a session config is given, a SET_PARAMETERS round trip.
+The pool keeps sessions open in the IDLE state so that a recognition can
+start on an already created session.
+"""
+from contextlib import contextmanager
+from threading import Condition, Event, Thread
+from time import time
+import logging
+
+from .speech_recognizer import SpeechRecognizer, RecognitionException
+
+
+class SpeechRecognizerPool:
+    """
+    Thread-safe pool of SpeechRecognizer instances with lease/release
+    semantics.
+
+    :server_url:            The CPqD ASR Server Websocket URL
+    :min_size:              Number of idle sessions kept open by warm() and
+                            maintain()
+    :max_size:              Maximum number of sessions, leased or idle
+    :max_idle_seconds:      Idle sessions older than this are closed by
+                            maintain(), as long as min_size is preserved.
+                            None disables eviction.
+    :maintenance_interval:  If set, a daemon thread calls maintain() every
+                            <maintenance_interval> seconds
+    :recognizer_kwargs:     kwargs for each SpeechRecognizer instance
+
+    Example:
+        pool = SpeechRecognizerPool(url, min_size=4, max_size=32)
+        pool.warm()
+        with pool.leased() as asr:
+            asr.recognize(FileAudioSource(path), lm_list)
+            results = asr.wait_recognition_result()
+        pool.close()
+    """
+
+    def __init__(
+        self,
+        server_url,
+        min_size=1,
+        max_size=8,
+        max_idle_seconds=300,
+        maintenance_interval=None,
+        **recognizer_kwargs
+    ):
+        assert 0 <= min_size <= max_size
+        assert max_size > 0
+        assert "connect_on_recognize" not in recognizer_kwargs
+        assert "auto_close" not in recognizer_kwargs
+        self._server_url = server_url
+        self._min_size = min_size
+        self._max_size = max_size
+        self._max_idle_seconds = max_idle_seconds
+        self._recognizer_kwargs = recognizer_kwargs
+        self._logger = logging.getLogger("cpqdasr")
+        self._cv = Condition()
+        self._idle = []  # (SpeechRecognizer, release timestamp), newest last
+        self._size = 0  # Leased + idle + being created
+        self._closed = False
+        self._stop_maintenance = Event()
+        self._maintenance_thread = None
+        if maintenance_interval is not None:
+            self._maintenance_thread = Thread(
+                target=self._maintenance_loop, args=(maintenance_interval,)
+            )
+            self._maintenance_thread.daemon = True
+            self._maintenance_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        """Number of sessions owned by the pool, leased or idle."""
+        return self._size
+
+    @property
+    def idle_count(self):
+        """Number of sessions ready to be leased."""
+        return len(self._idle)
+
+    def _create(self):
+        """
+        Opens a new session. The caller must have reserved a slot in
+        self._size, which is released if the session fails to start.
+        """
+        asr = None
+        try:
+            asr = SpeechRecognizer(self._server_url, **self._recognizer_kwargs)
+            if asr.wait_ready():
+                return asr
+            self._logger.warning("Pool session failed to become ready")
+        except Exception as e:
+            self._logger.warning("Error on creating pool session: {}".format(e))
+        if asr is not None:
+            asr.close()
+        with self._cv:
+            self._size -= 1
+            self._cv.notify()
+        return None
+
+    def _discard(self, asr):
+        try:
+            asr.close()
+        except Exception as e:
+            self._logger.warning(
+                "Non-critical error on closing pool session: {}".format(e)
+            )
+        with self._cv:
+            self._size -= 1
+            self._cv.notify()
+
+    def warm(self, n=None):
+        """
+        Opens sessions until there are at least <n> idle sessions in the pool,
+        or the pool reaches max_size. Sessions are created concurrently.
+
+        :n: Target of idle sessions. Defaults to min_size.
+        :returns: The number of idle sessions after warming up
+        """
+        if n is None:
+            n = self._min_size
+        with self._cv:
+            missing = min(n - len(self._idle), self._max_size - self._size)
+            missing = max(missing, 0)
+            self._size += missing
+        created = []
+
+        def create():
+            asr = self._create()
+            if asr is not None:
+                created.append(asr)
+
+        threads = [Thread(target=create) for _ in range(missing)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        with self._cv:
+            now = time()
+            for asr in created:
+                self._idle.append((asr, now))
+            self._cv.notify_all()
+            return len(self._idle)
+
+    def lease(self, timeout=None):
+        """
+        Takes an idle session from the pool. If none is available, a new one
+        is created while the pool is below max_size; otherwise, waits until a
+        session is released.
+
+        :timeout: Maximum time to wait for a session, in seconds. None waits
+                  indefinitely.
+        :returns: A SpeechRecognizer in the IDLE state
+        """
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            with self._cv:
+                while True:
+                    if self._closed:
+                        raise RecognitionException("FAILURE", "Pool is closed")
+                    if self._idle:
+                        asr, _ = self._idle.pop()
+                        break
+                    if self._size < self._max_size:
+                        self._size += 1
+                        asr = None
+                        break
+                    remaining = None if deadline is None else deadline - time()
+                    if remaining is not None and remaining <= 0:
+                        msg = "No session available after {} seconds".format(
+                            timeout
+                        )
+                        raise RecognitionException("FAILURE", msg)
+                    self._cv.wait(remaining)
+            if asr is None:
+                asr = self._create()
+                if asr is None:
+                    raise RecognitionException(
+                        "FAILURE", "Could not create a new session"
+                    )
+                return asr
+            if asr.is_idle():
+                return asr
+            # Health check failed, i.e. the session was dropped while idle
+            self._discard(asr)
+
+    def release(self, asr):
+        """
+        Returns a leased session to the pool. Sessions which are not idle,
+        e.g. with a pending recognition or a dropped connection, are closed.
+        """
+        if self._closed or not asr.is_idle():
+            self._discard(asr)
+            return
+        with self._cv:
+            self._idle.append((asr, time()))
+            self._cv.notify()
+
+    @contextmanager
+    def leased(self, timeout=None):
+        """
+        Context manager version of lease/release.
+        """
+        asr = self.lease(timeout)
+        try:
+            yield asr
+        finally:
+            self.release(asr)
+
+    def maintain(self):
+        """
+        Closes unhealthy sessions and sessions idle for longer than
+        max_idle_seconds, then warms the pool back to min_size.
+        """
+        now = time()
+        discarded = []
+        with self._cv:
+            kept = []
+            # Oldest sessions are evicted first
+            for asr, released in self._idle:
+                evictable = len(self._idle) - len(discarded) > self._min_size
+                expired = (
+                    self._max_idle_seconds is not None
+                    and now - released > self._max_idle_seconds
+                )
+                if not asr.is_idle() or (expired and evictable):
+                    discarded.append(asr)
+                else:
+                    kept.append((asr, released))
+            self._idle = kept
+        for asr in discarded:
+            self._discard(asr)
+        if not self._closed:
+            self.warm()
+
+    def _maintenance_loop(self, interval):
+        while not self._stop_maintenance.wait(interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                self._logger.warning("Error on pool maintenance: {}".format(e))
+
+    def close(self):
+        """
+        Closes all idle sessions. Leased sessions are closed when released.
+        """
+        self._stop_maintenance.set()
+        with self._cv:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._cv.notify_all()
+        for asr, _ in idle:
+            self._discard(asr)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Reconnection of a SpeechRecognizer whose connection drops mid-recognition.
+
+With a ReconnectPolicy, the audio sent since START_RECOGNITION is kept in a
+bounded ReplayBuffer. If the connection drops before the final result, the
+recognizer reconnects with exponential backoff, creates a new session with
+the same parameters and grammars, starts the recognition again and resends
+the buffered audio at line speed before resuming the live audio source.
+"""
+from collections import deque
+import random
+
+
+class ReconnectPolicy:
+    """
+    Parameters of the reconnection of a dropped recognition.
+
+    :max_attempts:   Maximum number of reconnections per recognition
+    :initial_delay:  Seconds before the first reconnection
+    :max_delay:      Maximum seconds between reconnections
+    :multiplier:     Growth factor of the delay after each failed attempt
+    :jitter:         Random fraction added to each delay, so that clients
+                     dropped together do not reconnect together
+    :replay_seconds: Seconds of audio kept for replay. A recognition with
+                     more audio than this cannot be recovered.
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        initial_delay=0.1,
+        max_delay=5.0,
+        multiplier=2.0,
+        jitter=0.1,
+        replay_seconds=60.0,
+    ):
+        assert max_attempts >= 0
+        assert initial_delay >= 0 and max_delay >= 0
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.replay_seconds = replay_seconds
+
+    def delay(self, attempt):
+        """
+        :attempt: Index of the reconnection attempt, starting at 0
+        :returns: Seconds to wait before the attempt
+        """
+        delay = min(self.initial_delay * self.multiplier ** attempt, self.max_delay)
+        return delay * (1 + random.uniform(0, self.jitter))
+
+
+class ReplayBuffer:
+    """
+    Audio chunks sent since the start of a recognition, up to max_bytes.
+    Once max_bytes is exceeded, the buffer is dropped and marked as
+    overflowed, as a partial replay would not recognize the same audio.
+
+    Attributes:
+    :size:       Bytes in the buffer
+    :overflowed: True if the audio exceeded max_bytes
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._chunks = deque()
+        self.size = 0
+        self.overflowed = False
+
+    def append(self, chunk):
+        if self.overflowed:
+            return
+        # Sources such as FileAudioSource yield views of buffers which may
+        # be released, so chunks are copied
+        chunk = bytes(chunk)
+        self.size += len(chunk)
+        if self.size > self._max_bytes:
+            self.overflowed = True
+            self._chunks.clear()
+            self.size = 0
+            return
+        self._chunks.append(chunk)
+
+    def chunks(self):
+        """
+        :returns: List with the buffered chunks, in order
+        """
+        return list(self._chunks)
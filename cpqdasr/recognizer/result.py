@@ -22,6 +22,8 @@ unified API from CPqD SDKs.
 
 
 class PartialRecognitionResult:
+    __slots__ = ("speechSegmentIndex", "text")
+
     def __init__(self, speech_segment_index, text):
         assert type(speech_segment_index) is int
         assert type(text) is str
@@ -30,6 +32,8 @@ class PartialRecognitionResult:
 
 
 class AgeResponse:
+    __slots__ = ("age", "event", "confidence", "p")
+
     def __init__(
             self, event=None, age=None, confidence=None, p=None
     ):
@@ -38,24 +42,76 @@ class AgeResponse:
         self.confidence = confidence
         self.p = p
 
+    @classmethod
+    def from_dict(cls, scores):
+        if scores is None:
+            return cls()
+        return cls(
+            event=scores["event"],
+            age=scores["age"],
+            p=scores["p"],
+            confidence=scores["confidence"],
+        )
+
 
 class GenderResponse:
+    __slots__ = ("event", "gender", "p")
+
     def __init__(self, event=None, p=None, gender=None):
         self.event = event
         self.gender = gender
         self.p = p
 
+    @classmethod
+    def from_dict(cls, scores):
+        if scores is None:
+            return cls()
+        return cls(event=scores["event"], p=scores["p"], gender=scores["gender"])
+
 
 class EmotionResponse:
+    __slots__ = ("emotion", "event", "p", "p_groups")
+
     def __init__(self, p=None, event=None, emotion=None, p_groups=None):
         self.emotion = emotion
         self.event = event
         self.p = p
         self.p_groups = p_groups
 
+    @classmethod
+    def from_dict(cls, scores):
+        if scores is None:
+            return cls()
+        return cls(
+            event=scores["event"],
+            p=scores["p"],
+            emotion=scores["emotion"],
+            p_groups=scores["p_groups"],
+        )
 
 
 class RecognitionResult:
+    """
+    Final result of a speech segment.
+
+    If the decoded RECOGNITION_RESULT body is given as "body", the score
+    objects which are not given are only built from it on first access,
+    as most applications never read them.
+    """
+
+    __slots__ = (
+        "result_code",
+        "speech_segment_index",
+        "last_speech_segment",
+        "sentence_start_time_milliseconds",
+        "sentence_end_time_milliseconds",
+        "alternatives",
+        "_age_scores",
+        "_gender_scores",
+        "_emotion_scores",
+        "_body",
+    )
+
     def __init__(
             self,
             result_code,
@@ -67,6 +123,7 @@ class RecognitionResult:
             age_scores=None,
             gender_scores=None,
             emotion_scores=None,
+            body=None,
     ):
         assert type(result_code) is str
         assert type(speech_segment_index) is int
@@ -80,6 +137,42 @@ class RecognitionResult:
         self.sentence_start_time_milliseconds = sentence_start_time_milliseconds
         self.sentence_end_time_milliseconds = sentence_end_time_milliseconds
         self.alternatives = alternatives
-        self.age_scores = age_scores
-        self.gender_scores = gender_scores
-        self.emotion_scores = emotion_scores
+        self._age_scores = age_scores
+        self._gender_scores = gender_scores
+        self._emotion_scores = emotion_scores
+        self._body = body
+
+    def _scores(self, cls, key):
+        if self._body is None:
+            return None
+        return cls.from_dict(self._body.get(key))
+
+    @property
+    def age_scores(self):
+        if self._age_scores is None:
+            self._age_scores = self._scores(AgeResponse, "age_scores")
+        return self._age_scores
+
+    @age_scores.setter
+    def age_scores(self, value):
+        self._age_scores = value
+
+    @property
+    def gender_scores(self):
+        if self._gender_scores is None:
+            self._gender_scores = self._scores(GenderResponse, "gender_scores")
+        return self._gender_scores
+
+    @gender_scores.setter
+    def gender_scores(self, value):
+        self._gender_scores = value
+
+    @property
+    def emotion_scores(self):
+        if self._emotion_scores is None:
+            self._emotion_scores = self._scores(EmotionResponse, "emotion_scores")
+        return self._emotion_scores
+
+    @emotion_scores.setter
+    def emotion_scores(self, value):
+        self._emotion_scores = value
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Bounded queues of recognition results, which back stream_results.
+
+The connection handler puts partial and final results as they are received
+and the application iterates over them. Partial results are dropped while
+the queue is full, as later ones supersede them, while final results wait
+for room, which stops the handler from reading the socket, so that a slow
+consumer pushes back on the server instead of buffering without limit.
+"""
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Condition
+import asyncio
+
+from .result import PartialRecognitionResult
+
+
+class ResultStream:
+    """
+    Thread-safe queue of results for SpeechRecognizer.stream_results.
+
+    :max_pending: Capacity of the queue, in results
+
+    Attributes:
+    :dropped_partials: Partial results dropped from a full queue
+    """
+
+    def __init__(self, max_pending=16):
+        assert max_pending > 0
+        self._max_pending = max_pending
+        self._cv = Condition()
+        self._results = deque()
+        self._finished = False
+        self.dropped_partials = 0
+
+    def _full(self):
+        return len(self._results) >= self._max_pending
+
+    def put(self, result):
+        """
+        Queues a result. Waits for room if it is a final result, unless the
+        stream is finished.
+        """
+        with self._cv:
+            if isinstance(result, PartialRecognitionResult) and self._full():
+                self.dropped_partials += 1
+                return
+            while self._full() and not self._finished:
+                self._cv.wait()
+            if self._finished:
+                return
+            self._results.append(result)
+            self._cv.notify_all()
+
+    def extend(self, results):
+        """
+        Queues results without waiting, e.g. the ones received before the
+        stream was attached.
+        """
+        with self._cv:
+            self._results.extend(results)
+            self._cv.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Waits for a result.
+
+        :timeout: Maximum time to wait, in seconds
+        :returns: The oldest result, or None once the stream is finished and
+                  empty
+        :raises: concurrent.futures.TimeoutError on timeout
+        """
+        with self._cv:
+            if not self._cv.wait_for(
+                lambda: self._results or self._finished, timeout
+            ):
+                raise FutureTimeoutError()
+            if not self._results:
+                return None
+            result = self._results.popleft()
+            self._cv.notify_all()
+            return result
+
+    def finish(self, discard=False):
+        """
+        Signals that no more results will be queued, waking up the handler
+        if it waits for room. The queued results are still returned by get,
+        unless discard is True.
+        """
+        with self._cv:
+            self._finished = True
+            if discard:
+                self._results.clear()
+            self._cv.notify_all()
+
+
+class AsyncResultStream:
+    """
+    asyncio version of ResultStream, for AsyncSpeechRecognizer. put never
+    waits, as it is called while a message is handled, so the receive loop
+    waits in wait_room before reading the next message instead.
+    """
+
+    def __init__(self, max_pending=16):
+        assert max_pending > 0
+        self._max_pending = max_pending
+        self._results = deque()
+        self._finished = False
+        self._changed = asyncio.Event()
+        self.dropped_partials = 0
+
+    def _full(self):
+        return len(self._results) >= self._max_pending
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def put(self, result):
+        if self._finished:
+            return
+        if isinstance(result, PartialRecognitionResult) and self._full():
+            self.dropped_partials += 1
+            return
+        self._results.append(result)
+        self._notify()
+
+    def extend(self, results):
+        self._results.extend(results)
+        self._notify()
+
+    async def wait_room(self):
+        """
+        Waits until the queue has room or the stream is finished.
+        """
+        while self._full() and not self._finished:
+            await self._changed.wait()
+
+    async def get(self, timeout=None):
+        """
+        As ResultStream.get, but raises asyncio.TimeoutError on timeout.
+        """
+        while not self._results and not self._finished:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        if not self._results:
+            return None
+        result = self._results.popleft()
+        self._notify()
+        return result
+
+    def finish(self, discard=False):
+        self._finished = True
+        if discard:
+            self._results.clear()
+        self._notify()
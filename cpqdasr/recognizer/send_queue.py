@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Bounded queue of audio between the audio source and the socket.
+
+Without a send queue, the send audio thread of a SpeechRecognizer reads a
+chunk from the audio source and sends it before reading the next one, so a
+slow network stalls the source, e.g. overrunning a microphone. With a
+SendQueue, a reader thread moves chunks from the source to the queue and
+the send audio thread sends them from the queue, and the overflow policy
+decides what happens when the network falls behind by more than max_bytes.
+"""
+from collections import deque
+from threading import Condition
+from time import monotonic
+
+
+class SendQueue:
+    """
+    Thread-safe queue of audio chunks, bounded in bytes.
+
+    :max_bytes: Capacity of the queue. A larger chunk is still accepted
+                when the queue is empty.
+    :overflow:  Policy for chunks which do not fit:
+                "block":       the reader waits until the queue has room,
+                               which stalls the audio source (default)
+                "drop_oldest": the oldest queued chunks are discarded to
+                               make room, so audio is lost but neither the
+                               source nor the latency is held back.
+                               Meant for live sources, as a file is read
+                               faster than it can be sent.
+                "coalesce":    as "block", but all the queued chunks are
+                               sent as a single SEND_AUDIO message, so the
+                               per-message overhead drops when the network
+                               falls behind
+
+    Attributes:
+    :size:             Bytes in the queue
+    :high_water_bytes: Largest size reached
+    :stall_seconds:    Total time the reader waited for room
+    :dropped_bytes:    Bytes discarded by "drop_oldest"
+    """
+
+    def __init__(self, max_bytes, overflow="block"):
+        assert overflow in ["block", "drop_oldest", "coalesce"]
+        assert max_bytes > 0
+        self._max_bytes = max_bytes
+        self._overflow = overflow
+        self._cv = Condition()
+        self._chunks = deque()
+        self._finished = False
+        self._closed = False
+        self.size = 0
+        self.high_water_bytes = 0
+        self.stall_seconds = 0.0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def put(self, chunk):
+        """
+        Queues a chunk, following the overflow policy if it does not fit.
+
+        :returns: False if the queue was closed, so the reader should stop
+        """
+        n = memoryview(chunk).nbytes
+        with self._cv:
+            if self._overflow == "drop_oldest":
+                while self._chunks and self.size + n > self._max_bytes:
+                    dropped = self._chunks.popleft()
+                    self.size -= memoryview(dropped).nbytes
+                    self.dropped_bytes += memoryview(dropped).nbytes
+            elif self._chunks and self.size + n > self._max_bytes:
+                beg = monotonic()
+                while (
+                    self._chunks
+                    and self.size + n > self._max_bytes
+                    and not self._closed
+                ):
+                    self._cv.wait()
+                self.stall_seconds += monotonic() - beg
+            if self._closed:
+                return False
+            self._chunks.append(chunk)
+            self.size += n
+            self.high_water_bytes = max(self.high_water_bytes, self.size)
+            self._cv.notify_all()
+            return True
+
+    def get(self):
+        """
+        Waits for audio.
+
+        :returns: The oldest chunk, or all the queued audio joined with
+                  "coalesce", or None once the queue is finished and empty
+                  or closed
+        """
+        with self._cv:
+            while not self._chunks and not self._finished and not self._closed:
+                self._cv.wait()
+            if self._closed or not self._chunks:
+                return None
+            if self._overflow == "coalesce" and len(self._chunks) > 1:
+                chunk = b"".join(self._chunks)
+                self._chunks.clear()
+                self.size = 0
+            else:
+                chunk = self._chunks.popleft()
+                self.size -= memoryview(chunk).nbytes
+            self._cv.notify_all()
+            return chunk
+
+    def finish(self):
+        """
+        Signals that no more chunks will be queued. The queued ones are
+        still returned by get.
+        """
+        with self._cv:
+            self._finished = True
+            self._cv.notify_all()
+
+    def close(self):
+        """
+        Discards the queued chunks and wakes up the reader and the writer.
+        """
+        with self._cv:
+            self._closed = True
+            self._chunks.clear()
+            self.size = 0
+            self._cv.notify_all()
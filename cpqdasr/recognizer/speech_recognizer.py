@@ -20,23 +20,61 @@ Main Speech Recognizer class:
     http://speech-doc.cpqd.com.br/asr/get_started/sdks.html
 """
 from sys import stderr
-from threading import Condition, Thread
+from threading import Lock, Thread
 from base64 import b64encode
-from time import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as futures_wait
 import logging
-import copy
+import weakref
 
 from cpqdasr.recognizer_protocol import WS4PYClient
+from cpqdasr.recognizer_protocol.ws4py_api import _set_result
 from cpqdasr.recognizer_protocol import (
-    send_audio_msg,
-    cancel_recog_msg,
     start_recog_msg,
     start_input_timers_msg,
     define_grammar_msg,
 )
 
 from .listener import RecognitionListener
-from .language_model_list import LanguageModelList
+from .language_model_list import LanguageModelList, GrammarCache
+from .reconnect import ReplayBuffer
+from .send_queue import SendQueue
+from .result_stream import ResultStream
+
+
+def _source_wav(audio_source, wav):
+    """
+    Audio sources which know whether they yield a WAV header, such as
+    FileAudioSource, take precedence over the wav argument of recognize.
+    """
+    source_wav = getattr(audio_source, "wav", None)
+    if source_wav is not None:
+        return source_wav
+    return wav
+
+
+def _recognition_callback(recognizer, ws, handle):
+    """
+    Done callback for the recognition future of the connection ws. A
+    future keeps its callbacks once they run, and the connection is
+    reachable from its I/O thread, so the recognizer and handle are only
+    weakly referenced, or else a recognizer which is no longer used would
+    never be collected, closed and its session released.
+    """
+    recognizer = weakref.ref(recognizer)
+    handle = weakref.ref(handle)
+
+    def done(future):
+        r, h = recognizer(), handle()
+        if h is None:
+            return
+        if r is None:
+            _set_result(h._future, future.result())
+        else:
+            r._recognition_done(ws, h, future)
+
+    return done
 
 
 class RecognitionException(Exception):
@@ -45,12 +83,110 @@ class RecognitionException(Exception):
         self.code = c
 
 
+class RecognitionHandle:
+    """
+    Handle for a recognition started with SpeechRecognizer.recognize.
+
+    Backed by a concurrent.futures.Future which is completed by the
+    connection handler as soon as the last speech segment is received, or
+    when the connection is aborted, so waiting on it does not poll.
+    """
+
+    def __init__(self, recognizer, future):
+        self._recognizer = recognizer
+        self._future = future
+        self._results = None
+
+    def done(self):
+        """
+        Returns True if the recognition finished, was aborted or cancelled.
+        """
+        return self._future.done()
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+    def result(self, timeout=None):
+        """
+        Waits for the recognition result, as in
+        SpeechRecognizer.wait_recognition_result. Results are kept, so this
+        may be called any number of times.
+
+        :timeout: Maximum time to wait, in seconds. Defaults to the
+                  recognizer's max_wait_seconds. On timeout, the recognition
+                  is cancelled and RecognitionException is raised.
+        :returns: List of RecognitionResult, which is empty if the
+                  recognition was cancelled or aborted
+        """
+        if self._results is None:
+            if self._recognizer._handle is self:
+                self._recognizer.wait_recognition_result(timeout)
+            else:
+                self._results = []
+        return self._results
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(handle) when the recognition finishes, is aborted or is
+        cancelled. If the handle is already done, fn is called immediately.
+        Otherwise, it is called from the connection handler thread, so it
+        should not block.
+        """
+        self._future.add_done_callback(lambda future: fn(self))
+
+    def cancel(self):
+        """
+        Cancels the recognition if it is still running.
+
+        :returns: True if the recognition was cancelled
+        """
+        if self._future.done() or self._recognizer._handle is not self:
+            return False
+        self._recognizer.cancel_recognition()
+        return True
+
+
 class SpeechRecognizer:
     """
     Class which recognizes speech and returns structured results.
 
     Each instance represents a single recognition session in the configured
-    server.
+    server. If a TraceWriter is given as "trace", every message of the
+    session is written to it. If a MetricsSink, or a list of them, is given
+    as "metrics", it receives the RecognitionMetrics of each recognition
+    (see cpqdasr.metrics).
+
+    Inline grammars are defined once per session. With pipeline_grammars,
+    the DEFINE_GRAMMAR messages of a recognition are sent back to back and
+    START_RECOGNITION is sent once all of them are acknowledged, instead of
+    waiting for each response in turn.
+
+    Unless skip_unused_partials is False, partial results are only decoded
+    if the listener reimplements on_partial_recognition.
+
+    If a ReconnectPolicy is given as "reconnect", a recognition whose
+    connection drops before its final result is recovered: the recognizer
+    reconnects, recreates the session with its parameters and grammars,
+    starts the recognition again and replays the audio sent so far before
+    resuming the audio source. Results of the dropped connection are
+    discarded, and the listener receives the partial results of the new
+    one. The number of recovered recognitions is kept in "reconnects".
+
+    With send_queue_bytes, audio is read from the source by its own thread
+    into a SendQueue of that many bytes, from which the send audio thread
+    writes to the socket, so that the source is not stalled by the network
+    until the queue is full. send_queue_overflow is the SendQueue policy
+    for a full queue: "block", "drop_oldest" or "coalesce". The queue of
+    the last recognition is available as "send_queue", and its statistics
+    are recorded in the recognition metrics.
+
+    With continuous_mode, the server recognizes every speech segment of the
+    audio instead of stopping at the end of the first one, e.g. for whole
+    calls. Each final result is numbered by its speech_segment_index and
+    handed to the listener's on_segment_result as it arrives, while
+    wait_recognition_result returns only the last retained_results of them,
+    if set, so that memory does not grow with the length of the audio. Note
+    that max_wait_seconds also bounds the wait for a continuous recognition.
 
     For an example of use, see the example in:
         http://speech-doc.cpqd.com.br/asr/get_started/sdks.html
@@ -71,11 +207,21 @@ class SpeechRecognizer:
         max_wait_seconds=30,
         connect_on_recognize=False,
         auto_close=False,
+        trace=None,
+        metrics=None,
+        pipeline_grammars=False,
+        skip_unused_partials=True,
+        reconnect=None,
+        send_queue_bytes=None,
+        send_queue_overflow="block",
+        continuous_mode=False,
+        retained_results=None,
         _wav=True,
     ):
         assert audio_sample_rate in [8000, 16000]
         assert audio_encoding in ["pcm", "wav", "raw"]
         assert isinstance(listener, RecognitionListener)
+        assert send_queue_overflow in ["block", "drop_oldest", "coalesce"]
         self._serverUrl = server_url
         self._user = credentials[0]
         self._password = credentials[1]
@@ -88,20 +234,37 @@ class SpeechRecognizer:
         self._max_wait_seconds = max_wait_seconds
         self._connect_on_recognize = connect_on_recognize
         self._auto_close = auto_close
+        self._trace = trace
+        self._metrics = metrics
+        self._pipeline_grammars = pipeline_grammars
+        self._skip_unused_partials = skip_unused_partials
+        self._reconnect = reconnect
+        self._send_queue_bytes = send_queue_bytes
+        self._send_queue_overflow = send_queue_overflow
+        self._continuous_mode = continuous_mode
+        self._retained_results = retained_results
         self._logger = logging.getLogger("cpqdasr")
-        self._cv_define_grammar = Condition()
-        self._cv_create_session = Condition()
-        self._cv_send_audio = Condition()
-        self._cv_wait_recog = Condition()
-        self._cv_wait_cancel = Condition()
+        self._lock = Lock()  # Guards the connection and handle on recovery
         self._ws = None
         self._send_audio_thread = None
         self._is_recognizing = False
+        self._handle = None
         self._join_thread = False
+        self._listening = None
+        self._grammar_cache = GrammarCache()
 
         # Recognition attributes
         self._audio_source = None
+        self._audio_exhausted = False
         self._recog_config = None
+        self._lm_uris = []
+        self._grammars = []
+        self._replay = None
+        self._attempts = 0  # Reconnection attempts of the recognition
+        self._send_queue = None
+        self._read_audio_thread = None
+        self._result_stream = None
+        self.reconnects = 0
 
         if not connect_on_recognize:
             self._connect()
@@ -116,44 +279,150 @@ class SpeechRecognizer:
             )
             credentials = b"Basic " + credentials
             headers = [("Authorization", credentials.decode())]
+            # Grammars are defined per session
+            self._grammar_cache.clear()
             self._ws = WS4PYClient(
                 url=self._serverUrl,
-                cv_define_grammar=self._cv_define_grammar,
-                cv_create_session=self._cv_create_session,
-                cv_send_audio=self._cv_send_audio,
-                cv_wait_recog=self._cv_wait_recog,
-                cv_wait_cancel=self._cv_wait_cancel,
                 listener=self._listener,
                 user_agent=self._user_agent,
                 channel_identifier=self._channel_identifier,
                 config=self._session_config,
                 headers=headers,
+                trace=self._trace,
+                metrics=self._metrics,
+                skip_unused_partials=self._skip_unused_partials,
+                retained_results=self._retained_results,
             )
             self._ws.connect()
 
-    def _send_audio_loop(self):
-        with self._cv_send_audio:
-            while self._ws.status not in ["LISTENING", "NO_INPUT_TIMEOUT", "ABORTED"]:
-                self._logger.debug("Waiting for send audio notify")
-                self._cv_send_audio.wait(0.5)  # Break loop as soon as ready
+    @property
+    def grammar_cache(self):
+        """
+        GrammarCache with the inline grammars defined on the current session
+        and its hit and miss counters.
+        """
+        return self._grammar_cache
+
+    @property
+    def decode_errors(self):
+        """
+        Number of message bodies of the current session which could not be
+        decoded.
+        """
+        if self._ws is None:
+            return 0
+        return self._ws.decode_errors
+
+    def wait_ready(self, timeout=None):
+        """
+        Connects if needed and waits until the session is created and
+        configured on the server.
+
+        :timeout: Maximum time to wait, in seconds. Defaults to
+                  max_wait_seconds.
+        :returns: True if the recognizer is idle and ready to recognize
+        """
+        if timeout is None:
+            timeout = self._max_wait_seconds
+        if self._ws is None:
+            self._connect()
+        try:
+            self._ws.session_created.result(timeout)
+        except FutureTimeoutError:
+            pass
+        return self.is_idle()
+
+    def is_idle(self):
+        """
+        Returns True if the recognizer has an open session which is not
+        performing a recognition.
+        """
+        return (
+            self._ws is not None
+            and not self._ws.terminated
+            and self._ws.status == "IDLE"
+            and not self._is_recognizing
+        )
+
+    @property
+    def send_queue(self):
+        """
+        SendQueue of the current or last recognition, or None if
+        send_queue_bytes is not set.
+        """
+        return self._send_queue
+
+    def _read_audio(self):
+        """
+        :returns: The next chunk of the audio source, or of the send queue
+                  if there is one, which is kept for replay if reconnecting
+                  is enabled, or None once the source is exhausted
+        """
+        if self._send_queue is not None:
+            chunk = self._send_queue.get()
+        elif self._audio_exhausted:
+            return None
+        else:
             try:
-                b = next(self._audio_source)
+                chunk = next(self._audio_source)
             except StopIteration:
+                self._audio_exhausted = True
+                return None
+        if chunk is not None and self._replay is not None:
+            self._replay.append(chunk)
+        return chunk
+
+    def _read_audio_loop(self, queue):
+        try:
+            for chunk in self._audio_source:
+                if not queue.put(chunk):
+                    return
+        except Exception as e:
+            self._logger.warning("Error on reading audio: {}".format(e))
+        finally:
+            queue.finish()
+
+    def _send_audio_loop(self, ws, listening, replay):
+        # Completed with False if the connection is aborted or the
+        # recognition is finished before the server starts listening
+        if not listening.result():
+            return
+        try:
+            self._send_audio(ws, replay)
+        except Exception as e:
+            # e.g. the connection dropped while sending
+            self._logger.warning("Error on sending audio: {}".format(e))
+
+    def _send_audio(self, ws, replay):
+        """
+        Sends the replayed chunks, if any, and then the rest of the audio
+        source on the connection ws.
+        """
+
+        def stopped():
+            # Recognition finished, cancelled or aborted
+            return ws.status != "LISTENING" or self._join_thread
+
+        for chunk in replay:
+            if stopped():
+                return
+            ws.send_audio(chunk, False, self._wav, self._content_type)
+        b = self._read_audio()
+        if b is None:
+            if stopped():
+                return
+            if not replay:
                 self._logger.warning("Empty audio source!")
-                self._ws.send(send_audio_msg(b"", True), binary=True)
+            ws.send_audio(b"", True, content_type=self._content_type)
+            return
+        for x in iter(self._read_audio, None):
+            if stopped():
                 return
-            self._ws._time_wait_recog = time()
-            for x in self._audio_source:
-                if self._ws.status != "LISTENING":
-                    b = x
-                    break
-                if self._join_thread:
-                    b = x
-                    break
-                self._ws.send(send_audio_msg(b, False, self._wav), binary=True)
-                self._logger.debug("Send audio")
-                b = x
-            self._ws.send(send_audio_msg(b, True), binary=True)
+            ws.send_audio(b, False, self._wav, self._content_type)
+            self._logger.debug("Send audio")
+            b = x
+        if not stopped():
+            ws.send_audio(b, True, content_type=self._content_type)
             self._logger.debug("Send audio")
 
     def _disconnect(self):
@@ -166,7 +435,20 @@ class SpeechRecognizer:
                 )
             self._ws = None
 
-    def wait_recognition_result(self):
+    def wait_recognition_result(self, max_wait_seconds=None):
+        """
+        Waits for the result of the current recognition.
+
+        :max_wait_seconds: Maximum time to wait, in seconds. Defaults to the
+                           value given to the constructor. On timeout, the
+                           recognition is cancelled and RecognitionException
+                           is raised.
+        :returns: List of RecognitionResult, which is empty if there is no
+                  recognition or if it was aborted. With retained_results,
+                  only the latest results are returned.
+        """
+        if max_wait_seconds is None:
+            max_wait_seconds = self._max_wait_seconds
         if self._ws is None:
             msg = "Trying to wait recognition with closed recognizer!"
             self._logger.warning(msg)
@@ -177,79 +459,361 @@ class SpeechRecognizer:
             if self._auto_close:
                 self.close()
             return []
-        with self._cv_wait_recog:
-            self._cv_wait_recog.wait(self._max_wait_seconds)
-            if self._ws.status == "ABORTED":
-                self._ws.recognition_list = []
-                return []
-            elif self._ws.status not in [
-                "RECOGNIZED",
-                "NO_MATCH",
-                "NO_SPEECH",
-                "NO_INPUT_TIMEOUT",
-            ]:
-                msg = "Wait recognition timeout after " "{} seconds".format(
-                    self._max_wait_seconds
-                )
-                self._logger.warning(msg)
-                self.cancel_recognition()
-                if self._auto_close:
-                    self.close()
-                raise RecognitionException("FAILURE", msg)
-            else:
-                self._ws.on_wait_recognition_finished()
-                ret = copy.deepcopy(self._ws.recognition_list)
-                # By specification, we clean the recognition list after
-                # calling wait_recognition_result
-                self._ws.recognition_list = []
-                if self._send_audio_thread is not None:
-                    self._finish_recognition()
-                if self._auto_close:
-                    self.close()
-                return ret
+        handle = self._handle
+        try:
+            finished = handle._future.result(max_wait_seconds)
+        except FutureTimeoutError:
+            msg = "Wait recognition timeout after " "{} seconds".format(
+                max_wait_seconds
+            )
+            self._logger.warning(msg)
+            self.cancel_recognition()
+            if self._auto_close:
+                self.close()
+            raise RecognitionException("FAILURE", msg)
+        if not finished:
+            # Connection aborted
+            self._ws.recognition_list = []
+            ret = []
+        else:
+            self._ws.on_wait_recognition_finished()
+            # By specification, we clean the recognition list after
+            # calling wait_recognition_result, so the caller owns it
+            ret = self._ws.recognition_list
+            if isinstance(ret, deque):
+                ret = list(ret)
+            self._ws.recognition_list = []
+        handle._results = ret
+        if self._send_audio_thread is not None:
+            self._finish_recognition()
+        if self._auto_close:
+            self.close()
+        return ret
+
+    def stream_results(self, max_wait_seconds=None, max_pending=16):
+        """
+        Iterates over the results of the current recognition as they are
+        received: PartialRecognitionResult for each partial result and
+        RecognitionResult for the final result of each speech segment, so
+        that, in continuous mode, a segment may be processed while the next
+        ones are still being spoken. Final results received before this
+        call are yielded first.
+
+        At most max_pending results are queued for the caller. Partial
+        results which do not fit are dropped, while a final result which
+        does not fit holds the connection until there is room, so a slow
+        caller slows the server down instead of queueing without limit.
+
+        Iteration stops after the last speech segment, or if the
+        recognition is cancelled or aborted. After the last segment, the
+        recognizer is ready for a new recognition, as after
+        wait_recognition_result. If the connection drops and the
+        recognition is recovered (see "reconnect"), the results of the
+        replayed audio are yielded again.
+
+        :max_wait_seconds: Maximum time to wait for each result, in seconds.
+                           Defaults to the value given to the constructor.
+                           On timeout, the recognition is cancelled and
+                           RecognitionException is raised.
+        :max_pending:      Capacity of the result queue
+        :returns: Iterator of results, which is empty if there is no
+                  recognition
+        """
+        if max_wait_seconds is None:
+            max_wait_seconds = self._max_wait_seconds
+        handle = self._handle
+        if handle is None or self._ws is None:
+            self._logger.warning(
+                "Trying to stream results without having a recognition started!"
+            )
+            return iter(())
+        stream = ResultStream(max_pending)
+        with self._lock:
+            self._result_stream = stream
+            self._ws.attach_result_stream(stream)
+        # Cancelling also wakes up the connection handler if it waits for room
+        handle.add_done_callback(lambda h: stream.finish(discard=h.cancelled()))
+        return self._stream_results(handle, stream, max_wait_seconds)
+
+    def _stream_results(self, handle, stream, max_wait_seconds):
+        try:
+            while True:
+                try:
+                    result = stream.get(max_wait_seconds)
+                except FutureTimeoutError:
+                    msg = "Stream results timeout after {} seconds".format(
+                        max_wait_seconds
+                    )
+                    self._logger.warning(msg)
+                    self.cancel_recognition()
+                    raise RecognitionException("FAILURE", msg)
+                if result is None:
+                    break
+                yield result
+        finally:
+            # The caller may stop iterating early
+            stream.finish(discard=True)
+        if self._handle is handle and handle.done():
+            self.wait_recognition_result()
 
     def recognize(self, audio_source, lm_list, config=None, wav=True):
-        self._wav = wav
+        """
+        Starts a recognition with the given audio source and language models.
+
+        :audio_source: Iterator of audio chunks (see audio_source module)
+        :lm_list:      Instance of LanguageModelList
+        :config:       Dict of recognition parameters
+        :wav:          True if the audio has a WAV header. Ignored if the
+                       audio source has a "wav" attribute which is not None,
+                       as with FileAudioSource.
+        :returns: RecognitionHandle for the started recognition, or None if
+                  the session could not be started
+        """
+        self._wav = _source_wav(audio_source, wav)
+        # Set by sources of compressed audio, e.g. EncodedAudioSource
+        self._content_type = getattr(audio_source, "content_type", None)
         assert isinstance(lm_list, LanguageModelList)
-        if self._ws is None:
-            self._connect()
+        sample_rate = getattr(audio_source, "sample_rate", None)
+        if sample_rate is not None and sample_rate != self._audio_sample_rate:
+            self._logger.warning(
+                "Audio source sample rate is {} Hz, but recognizer expects "
+                "{} Hz".format(sample_rate, self._audio_sample_rate)
+            )
         if self._is_recognizing:
             msg = "Last recognition is still pending."
             self._logger.error(msg)
             raise RecognitionException("FAILURE", msg)
+        if (
+            self._reconnect is not None
+            and self._ws is not None
+            and self._ws.connection_lost
+        ):
+            self._logger.info("Connection lost while idle, reconnecting")
+            self._ws = None
+        if self._ws is None:
+            self._connect()
         self._is_recognizing = True
-        if not self._ws.is_connected():
-            with self._cv_create_session:
-                self._cv_create_session.wait(self._max_wait_seconds)
+        try:
+            self._ws.session_created.result(self._max_wait_seconds)
+        except FutureTimeoutError:
+            pass
         if self._ws.status != "IDLE":
             self._logger.warning(
                 "Recognize timeout after {} " "seconds".format(self._max_wait_seconds)
             )
-            return
+            self._is_recognizing = False
+            return None
+        if self._continuous_mode:
+            config = dict(config or {})
+            config.setdefault("decoder.continuousMode", "true")
         self._recog_config = config
         self._audio_source = audio_source
-        lm_uris = []
+        self._audio_exhausted = False
+        self._lm_uris = []
+        self._grammars = []
         for lm in lm_list._lm_list:
             if type(lm) == str:
-                lm_uris.append(lm)
+                self._lm_uris.append(lm)
             elif type(lm) == tuple:
-                msg = define_grammar_msg(*lm)
-                self._ws._time_define_grammar = time()
-                self._ws.send(msg, binary=True)
-                self._logger.debug(b"SEND: " + msg)
-                with self._cv_define_grammar:
-                    self._cv_define_grammar.wait(self._max_wait_seconds)
-                lm_uris.append("session:" + lm[0])
-        msg = start_recog_msg(lm_uris, self._recog_config)
-        self._ws.send(msg, binary=True)
+                self._grammars.append(lm)
+                self._lm_uris.append("session:" + lm[0])
+        if not self._define_grammars(self._grammars):
+            self._is_recognizing = False
+            return None
+        self._replay = None
+        self._attempts = 0
+        if self._reconnect is not None:
+            self._replay = ReplayBuffer(
+                int(self._reconnect.replay_seconds * self._audio_sample_rate * 2)
+            )
+        self._send_queue = None
+        if self._send_queue_bytes is not None:
+            self._send_queue = SendQueue(
+                self._send_queue_bytes, self._send_queue_overflow
+            )
+        self._result_stream = None
+        self._handle = RecognitionHandle(self, Future())
+        self._start_recognition(self._handle, [])
+        if self._send_queue is not None:
+            # Reads ahead while START_RECOGNITION is pending
+            self._read_audio_thread = Thread(
+                target=self._read_audio_loop, args=(self._send_queue,)
+            )
+            self._read_audio_thread.daemon = True
+            self._read_audio_thread.start()
+        return self._handle
+
+    def _start_recognition(self, handle, replay):
+        """
+        Sends START_RECOGNITION on the current connection and starts the
+        send audio thread, which first sends the replayed chunks.
+        """
+        ws = self._ws
+        self._listening, recognition = ws.new_recognition(self._send_queue)
+        if self._result_stream is not None:
+            ws.attach_result_stream(self._result_stream)
+        recognition.add_done_callback(_recognition_callback(self, ws, handle))
+        msg = start_recog_msg(self._lm_uris, self._recog_config)
+        ws.send(msg, binary=True)
         msg = start_input_timers_msg()
-        self._ws.send(msg, binary=True)
+        ws.send(msg, binary=True)
         self._logger.debug(b"SEND: " + msg)
-        self._send_audio_thread = Thread(target=self._send_audio_loop)
+        self._send_audio_thread = Thread(
+            target=self._send_audio_loop, args=(ws, self._listening, replay)
+        )
         self._send_audio_thread.start()
 
+    def _recognition_done(self, ws, handle, future):
+        """
+        Completes the handle when the recognition on the connection ws is
+        finished, unless the connection dropped and the recognition can be
+        recovered on a new one. Called from the ws4py I/O thread.
+        """
+        finished = future.result()
+        if (
+            not finished
+            and ws.connection_lost
+            and self._reconnect is not None
+            and self._handle is handle
+            and not handle._future.done()
+        ):
+            if self._replay.overflowed:
+                self._logger.warning(
+                    "Connection lost with more than {} seconds of audio "
+                    "sent, which cannot be replayed".format(
+                        self._reconnect.replay_seconds
+                    )
+                )
+            else:
+                recover = Thread(target=self._recover, args=(handle,))
+                recover.daemon = True
+                recover.start()
+                return
+        if finished:
+            _set_result(handle._future, True)
+        else:
+            self._abandon_recognition(handle)
+
+    def _abandon_recognition(self, handle):
+        """
+        Completes handle as aborted, closing the audio source of the
+        recognition, which is not read anymore, e.g. to release a producer
+        waiting for room in a BufferAudioSource.
+        """
+        if self._handle is handle:
+            self._close_audio_source()
+        _set_result(handle._future, False)
+
+    def _close_audio_source(self):
+        close = getattr(self._audio_source, "close", None)
+        if close is not None:
+            close()
+
+    def _recover(self, handle):
+        """
+        Reconnects with backoff and restarts the recognition of handle,
+        replaying the audio sent so far. Completes the handle with False if
+        every attempt fails.
+        """
+        policy = self._reconnect
+        sender = self._send_audio_thread
+        if sender is not None:
+            # The audio source is only read by one thread at a time
+            sender.join(self._max_wait_seconds)
+            if sender.is_alive():
+                self._logger.warning("Send audio thread did not stop")
+                self._abandon_recognition(handle)
+                return
+        while self._attempts < policy.max_attempts:
+            attempt = self._attempts
+            self._attempts += 1
+            # Returns early if the recognition is cancelled
+            futures_wait([handle._future], policy.delay(attempt))
+            self._logger.warning(
+                "Connection lost, reconnecting (attempt {} of {})".format(
+                    attempt + 1, policy.max_attempts
+                )
+            )
+            with self._lock:
+                if handle._future.done():
+                    return
+                # The dropped connection cannot release its session
+                self._ws = None
+                try:
+                    self._connect()
+                except Exception as e:
+                    self._logger.warning("Error on reconnecting: {}".format(e))
+                    continue
+            try:
+                self._ws.session_created.result(self._max_wait_seconds)
+            except FutureTimeoutError:
+                pass
+            if self._ws.status != "IDLE":
+                continue
+            if not self._define_grammars(self._grammars):
+                continue
+            with self._lock:
+                if handle._future.done():
+                    return
+                replay = self._replay.chunks()
+                self._start_recognition(handle, replay)
+            self.reconnects += 1
+            self._logger.info(
+                "Recognition restarted, replaying {} bytes of audio".format(
+                    sum(len(c) for c in replay)
+                )
+            )
+            return
+        self._logger.warning(
+            "Could not recover recognition after {} attempts".format(self._attempts)
+        )
+        self._abandon_recognition(handle)
+
+    def _define_grammars(self, grammars):
+        """
+        Defines the inline grammars which are not defined on the session yet.
+
+        :returns: True if all grammars are defined
+        """
+        pending = []
+        for grammar in grammars:
+            if self._grammar_cache.is_defined(*grammar):
+                continue
+            self._grammar_cache.discard(grammar[0])
+            msg = define_grammar_msg(*grammar)
+            pending.append((grammar, self._ws.define_grammar(msg, grammar[0])))
+            if not self._pipeline_grammars and not self._wait_grammars(pending):
+                return False
+        return self._wait_grammars(pending)
+
+    def _wait_grammars(self, pending):
+        """
+        Waits for the responses of the pending grammars, which are then
+        cleared from the list.
+
+        :pending: List of (grammar, future) for each DEFINE_GRAMMAR sent
+        :returns: True if all grammars were defined
+        """
+        done, _ = futures_wait([f for _, f in pending], self._max_wait_seconds)
+        defined = True
+        for grammar, future in pending:
+            if future in done and future.result():
+                self._grammar_cache.add(*grammar)
+            else:
+                self._logger.warning("Could not define grammar {}".format(grammar[0]))
+                defined = False
+        del pending[:]
+        return defined
+
     def _finish_recognition(self):
         self._join_thread = True
+        _set_result(self._listening, False)
+        if self._send_queue is not None:
+            # Wakes up the send audio thread if it waits for audio. The
+            # reader thread stops once it reads the next chunk, without
+            # being joined, as a live source may not yield one soon.
+            self._send_queue.close()
+            self._read_audio_thread = None
         self._send_audio_thread.join(self._max_wait_seconds)
         self._join_thread = False
         if self._send_audio_thread.is_alive():
@@ -258,18 +822,30 @@ class SpeechRecognizer:
                 "{} seconds".format(self._max_wait_seconds)
             )
         self._send_audio_thread = None
+        self._result_stream = None
         self._is_recognizing = False
+        self._handle = None
 
     def cancel_recognition(self):
         if self._send_audio_thread is not None:
-            if not self._ws.terminated:
-                self._ws.send(cancel_recog_msg(), binary=True)
-            #                with self._cv_wait_recog:
-            #                    self._cv_wait_recog.wait(self._max_wait_seconds)
-            #                if self._ws.status != "IDLE":
-            #                    self._logger.warning("Timeout on waiting Cancel Recognition")
+            cancelled = None
+            with self._lock:
+                if self._ws.is_connected() and not self._ws.terminated:
+                    cancelled = self._ws.cancel_recognition()
+                self._handle._results = []
+                self._handle._future.cancel()
             self._finish_recognition()
+            self._close_audio_source()
             self._ws.recognition_list = []  # Clear result after cancelling
+            if cancelled is not None:
+                # The session only accepts a new recognition once idle
+                try:
+                    cancelled.result(self._max_wait_seconds)
+                except FutureTimeoutError:
+                    self._logger.warning(
+                        "Cancel recognition timeout after "
+                        "{} seconds".format(self._max_wait_seconds)
+                    )
         else:
             msg = "No recognition is being performed to be cancelled."
             raise RecognitionException("FAILURE", msg)
@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 from .protocol import *
 from .ws4py_api import ASRClient as WS4PYClient
+from .trace import TraceWriter, read_trace
+from .json_backend import set_json_backend
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+JSON decoding of ASR message bodies.
+
+The fastest installed backend is used: orjson, then ujson, then the
+standard library. set_json_backend selects one explicitly, e.g. to compare
+them or to rule one out when debugging.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _orjson_loads(data):
+    return orjson.loads(data)
+
+
+def _ujson_loads(data):
+    return ujson.loads(bytes(data))
+
+
+def _json_loads(data):
+    return json.loads(str(data, "utf-8"))
+
+
+_BACKENDS = {
+    "orjson": (orjson, _orjson_loads),
+    "ujson": (ujson, _ujson_loads),
+    "json": (json, _json_loads),
+}
+
+json_backend = None
+loads = None
+
+
+def set_json_backend(name=None):
+    """
+    Selects the JSON backend.
+
+    :name: "orjson", "ujson" or "json". None picks the fastest installed.
+    :returns: Name of the selected backend
+    """
+    global json_backend, loads
+    if name is None:
+        name = next(n for n in ["orjson", "ujson", "json"] if _BACKENDS[n][0])
+    if name not in _BACKENDS:
+        raise ValueError("Unknown JSON backend: {}".format(name))
+    if _BACKENDS[name][0] is None:
+        raise ImportError("JSON backend {} is not installed".format(name))
+    json_backend = name
+    loads = _BACKENDS[name][1]
+    return name
+
+
+set_json_backend()
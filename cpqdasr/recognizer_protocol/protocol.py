@@ -18,8 +18,9 @@
 
 ASR Server WebSocket API message builders/parsers
 """
-import json
-from cpqdasr.ws_parser import WsParser
+from cpqdasr.ws_parser import parse_message
+from . import json_backend
+from ..recognizer.result import RecognitionResult
 
 
 VERSION = "ASR 2.4"
@@ -76,10 +77,18 @@ def start_input_timers_msg():
     return msg
 
 
-def send_audio_msg(payload, last=False, audio_wav=True):
+def _audio_content_type(audio_wav, content_type):
+    if content_type is not None:
+        return content_type
+    return "audio/wav" if audio_wav else "audio/raw"
+
+
+def send_audio_msg(payload, last=False, audio_wav=True, content_type=None):
     """
     Payload should be a valid bytestring representing a raw waveform. Every
-    2 bytes (16bit) should represent a little-endian sample.
+    2 bytes (16bit) should represent a little-endian sample, unless a
+    content_type is given for compressed audio, e.g. "audio/flac", which
+    overrides audio_wav.
     """
     if last:
         last = "true"
@@ -90,10 +99,7 @@ def send_audio_msg(payload, last=False, audio_wav=True):
 
     # Brackets are a placeholder for payload size
     msg += "Content-Length: {}\n"
-    if audio_wav:
-        msg += "Content-Type: audio/wav\n\n"
-    else:
-        msg += "Content-Type: audio/raw\n\n"
+    msg += "Content-Type: {}\n\n".format(_audio_content_type(audio_wav, content_type))
 
     # Adding payload size and converting to binary
     msg = msg.format(len(payload)).encode()
@@ -101,6 +107,56 @@ def send_audio_msg(payload, last=False, audio_wav=True):
     return msg
 
 
+class AudioFramer:
+    """
+    Builds SEND_AUDIO messages into a single reusable bytearray.
+
+    Equivalent to send_audio_msg, but the header is pre-encoded for each
+    (last, content type) pair, so that only the Content-Length digits are
+    formatted for each chunk, and the payload is copied once into a buffer
+    which is reused while the message size does not change (i.e. for
+    constant-sized chunks).
+
+    The returned bytearray is only valid until the next call to frame().
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._headers = {}
+
+    def _header(self, last, audio_wav, content_type):
+        key = (last, audio_wav, content_type)
+        if key not in self._headers:
+            prefix = "{} SEND_AUDIO\nLastPacket: {}\nContent-Length: ".format(
+                VERSION, "true" if last else "false"
+            )
+            suffix = "\nContent-Type: {}\n\n".format(
+                _audio_content_type(audio_wav, content_type)
+            )
+            self._headers[key] = (prefix.encode(), suffix.encode())
+        return self._headers[key]
+
+    def frame(self, payload, last=False, audio_wav=True, content_type=None):
+        """
+        Payload should be a bytes-like object representing a raw waveform,
+        or compressed audio of the given content_type, as in send_audio_msg.
+        """
+        prefix, suffix = self._header(last, audio_wav, content_type)
+        length = b"%d" % len(payload)
+        i = len(prefix)
+        j = i + len(length)
+        start = j + len(suffix)
+        end = start + len(payload)
+        if len(self._buffer) != end:
+            self._buffer = bytearray(end)
+        buf = self._buffer
+        buf[:i] = prefix
+        buf[i:j] = length
+        buf[j:start] = suffix
+        buf[start:end] = payload
+        return buf
+
+
 def release_session_msg():
     return "{} RELEASE_SESSION".format(VERSION).encode()
 
@@ -109,23 +165,64 @@ def cancel_recog_msg():
     return "{} CANCEL_RECOGNITION".format(VERSION).encode()
 
 
-def parse_response(msg):
+def parse_response(msg, decode_partials=True):
     """
     Parses CPqD ASR messages and returns a string corresponding to the
     response type and two dicts, the first one corresponding to the
     header, and the second one to the JSON body.
+
+    The body is None if it could not be decoded, and it is empty if there
+    is no body, or if it is a partial result and decode_partials is False.
+
+    :msg:             Either a ws4py message or the raw message payload
+    :decode_partials: If False, bodies of PROCESSING results are skipped
     """
-    msg = msg.data
-    parser = WsParser(msg)
-    parser.Parse()
-    r = parser.get_command()
-    h = parser.get_params()
-    body = parser.get_body()
+    msg = getattr(msg, "data", msg)
+    version, r, h, body = parse_message(msg)
     b = {}
-    try:
-      if body:
-          b = json.loads(body)
-    except:
-      pass
+    if body and (
+        decode_partials
+        or r != "RECOGNITION_RESULT"
+        or h.get("Result-Status") != "PROCESSING"
+    ):
+        try:
+            b = json_backend.loads(body)
+        except ValueError:
+            b = None
 
     return r, h, b
+
+
+def _milliseconds(seconds):
+    return int(round(seconds * 1000))
+
+
+def parse_recognition_result(h, b):
+    """
+    Builds a RecognitionResult from the header and body of a final
+    RECOGNITION_RESULT message, as returned by parse_response.
+
+    In continuous mode, the server sends a final result for each speech
+    segment, numbered by "segment_index", and only the last one has
+    "last_segment" set. A body without "last_segment", e.g. one which could
+    not be decoded, ends the recognition.
+
+    Returns a tuple with the result and a bool which is True if this is the
+    last speech segment of the recognition.
+    """
+    if "alternatives" in b:
+        result = b["alternatives"]
+    else:
+        result = []
+    last_segment = bool(b.get("last_segment", True))
+    # Score objects are built from the body on first access
+    recognition_result = RecognitionResult(
+        result_code=h["Result-Status"],
+        speech_segment_index=b.get("segment_index", 0),
+        last_speech_segment=last_segment,
+        sentence_start_time_milliseconds=_milliseconds(b.get("start_time", 0)),
+        sentence_end_time_milliseconds=_milliseconds(b.get("end_time", 0)),
+        alternatives=result,
+        body=b,
+    )
+    return recognition_result, last_segment
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Binary traces of ASR WebSocket sessions.
+
+A trace file starts with TRACE_MAGIC, followed by one record per event:
+    kind:       1 byte, TRACE_OPEN, TRACE_SENT or TRACE_RECEIVED
+    timestamp:  float64, monotonic seconds since the trace was created
+    length:     uint32, length of the payload
+    payload:    the message as sent or received, without WebSocket framing
+All numbers are little-endian. TRACE_OPEN records have an empty payload and
+mark the start of a new connection.
+"""
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+import struct
+
+TRACE_MAGIC = b"ASRTRACE\x01"
+TRACE_OPEN = 0
+TRACE_SENT = 1
+TRACE_RECEIVED = 2
+
+_RECORD = struct.Struct("<BdI")
+
+TraceRecord = namedtuple("TraceRecord", ["kind", "timestamp", "payload"])
+
+
+class TraceWriter:
+    """
+    Writes a session trace, from any thread.
+
+    :path:  Path of the trace file, which is truncated
+    :audio: If False, only the headers of SEND_AUDIO messages are written,
+            which keeps traces small. Replaying does not need the audio.
+    """
+
+    def __init__(self, path, audio=False):
+        self._file = open(path, "wb")
+        self._file.write(TRACE_MAGIC)
+        self._audio = audio
+        self._lock = Lock()
+        self._start = monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+    def _write(self, kind, payload):
+        with self._lock:
+            if self._file.closed:
+                return
+            header = _RECORD.pack(kind, monotonic() - self._start, len(payload))
+            self._file.write(header)
+            self._file.write(payload)
+
+    def open_connection(self):
+        self._write(TRACE_OPEN, b"")
+
+    def sent(self, payload):
+        if not self._audio and payload.startswith(b"ASR 2.4 SEND_AUDIO"):
+            end = payload.find(b"\n\n")
+            if end >= 0:
+                payload = payload[: end + 2]
+        self._write(TRACE_SENT, bytes(payload))
+
+    def received(self, payload):
+        self._write(TRACE_RECEIVED, payload)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """
+    Reads a trace file.
+
+    :returns: list of TraceRecord
+    """
+    records = []
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError("{} is not an ASR trace file".format(path))
+    offset = len(TRACE_MAGIC)
+    while offset + _RECORD.size <= len(data):
+        kind, timestamp, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        records.append(TraceRecord(kind, timestamp, data[offset : offset + length]))
+        offset += length
+    return records
+
+
+def split_connections(records):
+    """
+    Splits trace records into one list per connection, without the
+    TRACE_OPEN records.
+    """
+    connections = []
+    for record in records:
+        if record.kind == TRACE_OPEN:
+            connections.append([])
+        elif connections:
+            connections[-1].append(record)
+    return connections
@@ -18,37 +18,98 @@
 
 ASR Server ws4py connection handler
 """
-from time import time
+from time import monotonic
 from sys import stderr
-from threading import Condition
+from collections import deque
+from struct import pack
+from concurrent.futures import Future, InvalidStateError
+from threading import Lock
+import os
+import sys
 from ws4py.client.threadedclient import WebSocketClient
 import logging
 
-from ..recognizer.listener import RecognitionListener
-from ..recognizer.result import (
-    RecognitionResult,
-    PartialRecognitionResult,
-    AgeResponse,
-    GenderResponse,
-    EmotionResponse,
-)
+from ..metrics import RecognitionMetrics
+from ..recognizer.listener import RecognitionListener, _overrides
+from ..recognizer.result import PartialRecognitionResult
 from .protocol import (
     create_session_msg,
     set_parameters_msg,
     release_session_msg,
+    cancel_recog_msg,
     parse_response,
+    parse_recognition_result,
+    AudioFramer,
 )
 
 
+def _mask(key, data):
+    """
+    Applies the WebSocket masking to the bytearray data with the 4-byte key,
+    in place. Uses numpy if the application already imported it, e.g. through
+    soundfile, XORing whole 32-bit words, or else XORs everything at once as
+    big integers instead of byte by byte. numpy is not imported just for
+    this, as the import costs as much as the speedup saves in about ten
+    minutes of audio.
+    """
+    n = len(data)
+    np = sys.modules.get("numpy")
+    if np is None:
+        key = int.from_bytes((key * (n // 4 + 1))[:n], "little")
+        data[:] = (int.from_bytes(data, "little") ^ key).to_bytes(n, "little")
+        return
+    words = n // 4
+    buf = np.frombuffer(data, dtype=np.uint8)
+    buf[: 4 * words].view(np.uint32)[:] ^= np.frombuffer(key, dtype=np.uint32)[0]
+    for i in range(4 * words, n):
+        buf[i] ^= key[i % 4]
+
+
+def _set_result(future, result):
+    """
+    Completes a future unless it is already done, e.g. cancelled by the
+    user from another thread.
+    """
+    try:
+        if not future.done():
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
 class ASRClient(WebSocketClient):
+    """
+    ws4py connection handler for a single recognition session.
+
+    Server responses are signalled through concurrent.futures.Future
+    instances, completed from received_message on the ws4py I/O thread:
+    :session_created: result is True when the session is created and
+                      configured, or False if the connection is aborted
+    :define_grammar:  returns a future with the DEFINE_GRAMMAR outcome.
+                      Several grammars may be pending at once, and responses
+                      are matched to them by Content-ID.
+    :new_recognition: returns the futures for START_RECOGNITION and for the
+                      final result of a recognition
+
+    If a TraceWriter is given as "trace", every message sent or received is
+    written to it, e.g. to be served back by cpqdasr.tools.replay.
+
+    If a MetricsSink, or a list of them, is given as "metrics", a
+    RecognitionMetrics is recorded for each recognition.
+
+    If skip_unused_partials is True, the bodies of partial results are not
+    decoded unless the listener reimplements on_partial_recognition.
+    Message bodies which cannot be decoded are counted in decode_errors.
+
+    Final results are kept in recognition_list. If retained_results is set,
+    only that many of the latest ones are kept, e.g. in continuous mode,
+    where a recognition has a result per speech segment. Results are also
+    put in the ResultStream given to attach_result_stream, if any.
+    """
+
     def __init__(
         self,
         url,
-        cv_define_grammar,
-        cv_create_session,
-        cv_send_audio,
-        cv_wait_recog,
-        cv_wait_cancel,
         listener=RecognitionListener(),
         user_agent=None,
         channel_identifier=None,
@@ -59,31 +120,53 @@ class ASRClient(WebSocketClient):
         heartbeat_freq=None,
         ssl_options=None,
         headers=None,
+        trace=None,
+        metrics=None,
+        skip_unused_partials=True,
+        retained_results=None,
     ):
         super(ASRClient, self).__init__(
             url, protocols, extensions, heartbeat_freq, ssl_options, headers
         )
-        assert isinstance(cv_define_grammar, Condition)
-        assert isinstance(cv_create_session, Condition)
-        assert isinstance(cv_send_audio, Condition)
-        assert isinstance(cv_wait_recog, Condition)
-        assert isinstance(cv_wait_cancel, Condition)
         self._user_agent = user_agent
         self._channel_identifier = channel_identifier
         self._listener = listener
         self._config = config
+        self._trace = trace
+        self._retained_results = retained_results
+        self._decode_partials = not skip_unused_partials or _overrides(
+            listener, "on_partial_recognition"
+        )
+        self.decode_errors = 0
+        # Set when the connection is closed, e.g. dropped by the network
+        self.connection_lost = False
         self._logger = logging.getLogger("cpqdasr")
         self._status = "DISCONNECTED"
-        self._cv_define_grammar = cv_define_grammar
-        self._time_define_grammar = 0
-        self._cv_create_session = cv_create_session
-        self._time_create_session = 0
-        self._cv_send_audio = cv_send_audio
-        self._time_send_audio = 0
-        self._cv_wait_recog = cv_wait_recog
-        self._time_wait_recog = 0
-        self._cv_wait_cancel = cv_wait_cancel
-        self._cv_opened = Condition()
+        self._sinks = None
+        if metrics is not None:
+            if not isinstance(metrics, (list, tuple)):
+                metrics = [metrics]
+            self._sinks = tuple(metrics)
+        # Metrics state, only used if there are sinks
+        self._recog_metrics = None
+        self._phase_time = None
+        self._connect_seconds = None
+        self._create_session_seconds = None
+        self._set_parameters_seconds = None
+        self._session_recognitions = 0
+        self._start_time = None
+        self._last_packet_time = None
+        self.session_created = Future()
+        # Pending DEFINE_GRAMMAR requests: [grammar_id, future, send time]
+        self._grammar_requests = []
+        self._listening_future = None
+        self._recognition_future = None
+        self._cancel_future = None
+        self._send_queue = None
+        self._result_stream = None
+        # Orders results between recognition_list and the result stream
+        self._results_lock = Lock()
+        self._framer = AudioFramer()
         self.recognition_list = []
         self.daemon = False
 
@@ -93,26 +176,205 @@ class ASRClient(WebSocketClient):
     def is_connected(self):
         return self._status != "DISCONNECTED" and self._status != "WAITING_CONFIG"
 
+    def connect(self):
+        if self._sinks is not None:
+            self._phase_time = monotonic()
+        super(ASRClient, self).connect()
+
     def _finish_connect(self):
-        with self._cv_create_session:
-            self._status = "IDLE"
-            self._cv_create_session.notify_all()
+        self._status = "IDLE"
+        if self._sinks is not None and self._config is not None:
+            self._set_parameters_seconds = monotonic() - self._phase_time
+        _set_result(self.session_created, True)
+
+    def _emit_metrics(self, result_status):
+        metrics = self._recog_metrics
+        if metrics is None:
+            return
+        self._recog_metrics = None
+        metrics.result_status = result_status
+        queue = self._send_queue
+        if queue is not None:
+            metrics.send_queue_high_water_bytes = queue.high_water_bytes
+            metrics.send_queue_stall_seconds = queue.stall_seconds
+            metrics.send_queue_dropped_bytes = queue.dropped_bytes
+        for sink in self._sinks:
+            try:
+                sink.record(metrics)
+            except Exception as e:
+                self._logger.warning("Error on recording metrics: {}".format(e))
 
     def _abort(self):
         self._status = "ABORTED"
         self._logger.debug("Aborting")
-        with self._cv_define_grammar:
-            self._logger.debug("Aborting define grammar")
-            self._cv_define_grammar.notify_all()
-        with self._cv_create_session:
-            self._logger.debug("Aborting create session")
-            self._cv_create_session.notify_all()
-        with self._cv_send_audio:
-            self._logger.debug("Aborting send audio")
-            self._cv_send_audio.notify_all()
-        with self._cv_wait_recog:
-            self._logger.debug("Aborting wait recog")
-            self._cv_wait_recog.notify_all()
+        if self._recog_metrics is not None:
+            self._emit_metrics("ABORTED")
+        _set_result(self.session_created, False)
+        for _, future, _ in self._grammar_requests:
+            _set_result(future, False)
+        self._grammar_requests = []
+        for future in [
+            self._listening_future,
+            self._recognition_future,
+            self._cancel_future,
+        ]:
+            if future is not None:
+                _set_result(future, False)
+
+    def define_grammar(self, msg, grammar_id=None):
+        """
+        Sends a DEFINE_GRAMMAR message, without waiting for the responses of
+        previous ones.
+
+        :grammar_id: Content-ID of the grammar, which matches the response to
+                     this request. If the server does not echo it, responses
+                     are matched in order.
+        :returns: Future whose result is True if the grammar was defined, or
+                  False if it was not or the connection is aborted
+        """
+        future = Future()
+        start = None
+        if self._sinks is not None:
+            # Grammars are defined before the recognition which uses them
+            self._begin_metrics()
+            start = monotonic()
+        self._grammar_requests.append([grammar_id, future, start])
+        self.send(msg, binary=True)
+        self._logger.debug(b"SEND: " + msg)
+        return future
+
+    def _pop_grammar_request(self, grammar_id):
+        requests = self._grammar_requests
+        for i, request in enumerate(requests):
+            if request[0] == grammar_id:
+                return requests.pop(i)
+        if requests:
+            return requests.pop(0)
+        return None
+
+    def new_recognition(self, send_queue=None):
+        """
+        Creates the futures for a recognition, which must be called before
+        sending START_RECOGNITION.
+
+        :send_queue: SendQueue of the recognition, whose statistics are
+                     recorded in its metrics
+
+        :returns: A tuple with a future whose result is True when the server
+                  starts listening, and a future whose result is True when
+                  the last speech segment is received. Both results are False
+                  if the connection is aborted.
+        """
+        self.recognition_list = self._new_recognition_list()
+        self._send_queue = send_queue
+        self._result_stream = None
+        self._listening_future = Future()
+        self._recognition_future = Future()
+        if self._sinks is not None:
+            self._begin_metrics()
+            self._start_time = monotonic()
+            self._last_packet_time = None
+        return self._listening_future, self._recognition_future
+
+    def _begin_metrics(self):
+        """
+        Creates the metrics of the next recognition, unless the
+        DEFINE_GRAMMAR messages sent for it already did, so that they are
+        accounted in its traffic.
+        """
+        if self._recog_metrics is not None:
+            return
+        metrics = RecognitionMetrics()
+        metrics.connect_seconds = self._connect_seconds
+        metrics.create_session_seconds = self._create_session_seconds
+        metrics.set_parameters_seconds = self._set_parameters_seconds
+        metrics.session_recognition = self._session_recognitions
+        self._session_recognitions += 1
+        self._recog_metrics = metrics
+
+    def attach_result_stream(self, stream):
+        """
+        Puts the results of the current recognition in the ResultStream
+        stream, starting with the final results already received. Partial
+        results are decoded while a stream is attached.
+        """
+        with self._results_lock:
+            stream.extend(self.recognition_list)
+            self._result_stream = stream
+
+    def _new_recognition_list(self):
+        if self._retained_results is None:
+            return []
+        return deque(maxlen=self._retained_results)
+
+    def cancel_recognition(self):
+        """
+        Sends a CANCEL_RECOGNITION message.
+
+        :returns: Future whose result is True once the server responds and
+                  the session is idle again
+        """
+        self._cancel_future = Future()
+        if self._recog_metrics is not None:
+            self._emit_metrics("CANCELED")
+        msg = cancel_recog_msg()
+        self.send(msg, binary=True)
+        self._logger.debug(b"SEND: " + msg)
+        return self._cancel_future
+
+    def send_audio(self, payload, last=False, audio_wav=True, content_type=None):
+        """
+        Sends a SEND_AUDIO message, built with a reusable AudioFramer and
+        written as a single binary WebSocket frame.
+        """
+        if last and self._recog_metrics is not None:
+            self._last_packet_time = monotonic()
+        frame = self._framer.frame(payload, last, audio_wav, content_type)
+        self._send_binary_frame(frame)
+
+    def send(self, payload, binary=False):
+        if self._trace is not None and isinstance(payload, (bytes, bytearray)):
+            self._trace.sent(payload)
+        if self._recog_metrics is not None:
+            self._recog_metrics.messages_sent += 1
+            self._recog_metrics.bytes_sent += len(payload)
+        super(ASRClient, self).send(payload, binary)
+
+    def _send_binary_frame(self, data):
+        """
+        Writes the bytearray data as a single binary frame. Unlike ws4py's
+        send, which copies the message to bytes and masks it into new buffers
+        in a Python loop, data is masked in place and sent along with the
+        frame header with scatter/gather I/O when the socket supports it.
+        Data is left masked, so it must not be reused by the caller.
+        """
+        length = len(data)
+        if length < 126:
+            header = pack("!BB", 0x82, 0x80 | length)
+        elif length < (1 << 16):
+            header = pack("!BBH", 0x82, 0x80 | 126, length)
+        else:
+            header = pack("!BBQ", 0x82, 0x80 | 127, length)
+        if self._trace is not None:
+            self._trace.sent(data)
+        if self._recog_metrics is not None:
+            self._recog_metrics.messages_sent += 1
+            self._recog_metrics.bytes_sent += length
+        # Client frames are always masked
+        key = os.urandom(4)
+        header += key
+        _mask(key, data)
+        if self.terminated or self.sock is None:
+            raise RuntimeError("Cannot send on a terminated websocket")
+        if self._is_secure or not hasattr(self.sock, "sendmsg"):
+            self.sock.sendall(header + data)
+            return
+        sent = self.sock.sendmsg([header, data])
+        if sent < len(header):
+            self.sock.sendall(header[sent:])
+            sent = len(header)
+        if sent < len(header) + length:
+            self.sock.sendall(memoryview(data)[sent - len(header) :])
 
     def disconnect(self):
         msg = release_session_msg()
@@ -127,29 +389,45 @@ class ASRClient(WebSocketClient):
         self._status = "IDLE"
 
     def opened(self):
+        if self._trace is not None:
+            self._trace.open_connection()
+        if self._sinks is not None:
+            now = monotonic()
+            self._connect_seconds = now - self._phase_time
+            self._phase_time = now
         msg = create_session_msg(self._user_agent, self._channel_identifier)
         self.send(msg, binary=True)
         self._logger.debug(b"SEND: " + msg)
 
     def closed(self, code, reason=None):
         self._status = "DISCONNECTED"
+        self.connection_lost = True
         self._logger.info("ASR WS closed down {}, {}".format(code, reason))
         self._abort()
 
     def received_message(self, msg):
+        if self._trace is not None:
+            self._trace.received(msg.data)
+        if self._recog_metrics is not None:
+            self._recog_metrics.messages_received += 1
         # Parsing and returning error if bad response
         self._logger.debug(msg.data)
-        call, h, b = parse_response(msg)
-        age_scores = AgeResponse()
-        gender_scores = GenderResponse()
-        emotion_scores = EmotionResponse()
+        call, h, b = parse_response(
+            msg, self._decode_partials or self._result_stream is not None
+        )
+        if b is None:
+            self.decode_errors += 1
+            if self._recog_metrics is not None:
+                self._recog_metrics.decode_errors += 1
+            self._logger.warning("Could not decode body of {}".format(call))
+            b = {}
         if call not in [
             "RESPONSE",
             "START_OF_SPEECH",
             "END_OF_SPEECH",
             "RECOGNITION_RESULT",
         ]:
-            self.warning("Bad response:\n\n{}".format(call))
+            self._logger.warning("Bad response:\n\n{}".format(call))
             return
 
         # Close if this is a RELEASE_SESSION response
@@ -159,27 +437,37 @@ class ASRClient(WebSocketClient):
                 self._status = "DISCONNECTED"
                 return
             if h["Method"] == "DEFINE_GRAMMAR":
+                request = self._pop_grammar_request(h.get("Content-ID"))
+                if request is None:
+                    self._logger.info("Ignored DEFINE_GRAMMAR response")
+                    return
+                grammar_id, future, start = request
                 if h["Result"] == "SUCCESS":
-                    self._logger.info(
-                        "[TIMER] GrammarDefinitionTime: {} s".format(
-                            time() - self._time_define_grammar
-                        )
-                    )
+                    metrics = self._recog_metrics
+                    if start is not None and metrics is not None:
+                        seconds = monotonic() - start
+                        metrics.define_grammar_seconds[grammar_id] = seconds
                     self._logger.debug("Grammar defined")
-                    with self._cv_define_grammar:
-                        self._cv_define_grammar.notify_all()
+                    _set_result(future, True)
                 else:
+                    # The session is still usable, so only the recognition
+                    # which needs this grammar fails
                     self._logger.warning(
                         "Error on defining grammar: " "{}".format(msg.data)
                     )
-                    self._abort()
+                    _set_result(future, False)
+                return
+            if h["Method"] == "CANCEL_RECOGNITION":
+                # Also on failure, i.e. if there was no recognition to cancel
+                self._status = "IDLE"
+                if self._cancel_future is not None:
+                    _set_result(self._cancel_future, True)
                 return
             if h["Method"] == "START_RECOGNITION":
                 if h["Result"] == "SUCCESS":
                     self._logger.debug("Starting recognition")
                     self._status = "LISTENING"
-                    with self._cv_send_audio:
-                        self._cv_send_audio.notify_all()
+                    _set_result(self._listening_future, True)
                 else:
                     self._logger.warning(
                         "Error on start recognition: " "{}".format(msg.data.decode())
@@ -207,6 +495,10 @@ class ASRClient(WebSocketClient):
                     "{}".format(session_status)
                 )
             else:
+                if self._sinks is not None:
+                    now = monotonic()
+                    self._create_session_seconds = now - self._phase_time
+                    self._phase_time = now
                 # Sends config message if set, otherwise the client will
                 # use the server's default parameters
                 if self._config is not None:
@@ -232,11 +524,6 @@ class ASRClient(WebSocketClient):
                 )
                 self._abort()
 
-            elif h["Method"] == "CANCEL_RECOGNITION":
-                with self._cv_wait_cancel:
-                    self._cv_wait_cancel.notify_all()
-                    self._status = "IDLE"
-
             # Default response case which is ignored
             else:
                 self._logger.info("Ignored {} response".format(h["Method"]))
@@ -244,66 +531,39 @@ class ASRClient(WebSocketClient):
 
         if call == "RECOGNITION_RESULT":
             if h["Result-Status"] == "PROCESSING":
-                self._listener.on_partial_recognition(
-                    PartialRecognitionResult(0, b["alternatives"][0]["text"].strip())
-                )
-            else:
-                if "alternatives" in b:
-                    result = b["alternatives"]
-                else:
-                    result = []
-                if "last_segment" in b:
-                    last_segment = b["last_segment"]
-                if "age_scores" in b:
-                    age_scores = AgeResponse(
-                        event=b["age_scores"]["event"],
-                        age=b["age_scores"]["age"],
-                        p=b["age_scores"]["p"],
-                        confidence=b["age_scores"]["confidence"],
-                    )
-                if "gender_scores" in b:
-                    gender_scores = GenderResponse(
-                        event=b["gender_scores"]["event"],
-                        p=b["gender_scores"]["p"],
-                        gender=b["gender_scores"]["gender"],
-                    )
-                if "emotion_scores" in b:
-                    emotion_scores = EmotionResponse(
-                        event=b["emotion_scores"]["event"],
-                        p=b["emotion_scores"]["p"],
-                        emotion=b["emotion_scores"]["emotion"],
-                        p_groups=b["emotion_scores"]["p_groups"],
+                metrics = self._recog_metrics
+                if metrics is not None and metrics.first_partial_seconds is None:
+                    metrics.first_partial_seconds = monotonic() - self._start_time
+                # Only decoded if used, see parse_response
+                if b:
+                    partial = PartialRecognitionResult(
+                        b.get("segment_index", 0),
+                        b["alternatives"][0]["text"].strip(),
                     )
-                else:
-                    last_segment = True
-                self.recognition_list.append(
-                    RecognitionResult(
-                        result_code=h["Result-Status"],
-                        speech_segment_index=0,
-                        last_speech_segment=last_segment,
-                        sentence_start_time_milliseconds=0,
-                        sentence_end_time_milliseconds=0,
-                        alternatives=result,
-                        age_scores=age_scores,
-                        gender_scores=gender_scores,
-                        emotion_scores=emotion_scores,
-                    )
-                )
+                    self._listener.on_partial_recognition(partial)
+                    stream = self._result_stream
+                    if stream is not None:
+                        stream.put(partial)
+            else:
+                result, last_segment = parse_recognition_result(h, b)
+                with self._results_lock:
+                    self.recognition_list.append(result)
+                    stream = self._result_stream
                 self._listener.on_recognition_result(b)
+                self._listener.on_segment_result(result)
+                if stream is not None:
+                    # Waits for room, without reading the socket meanwhile
+                    stream.put(result)
                 if last_segment:
-                    self._logger.info(
-                        "[TIMER] RecogTime: {} s".format(time() - self._time_wait_recog)
-                    )
-                    with self._cv_wait_recog:
-                        self._status = h["Result-Status"]
-                        self._cv_wait_recog.notify_all()
-
-
-if __name__ == "__main__":
-    cv = Condition()
-    listener = RecognitionListener()
-    listener.on_recognition_result = lambda x: print(x)
-    url = "ws://localhost:8025/asr-server/asr"
-    ws = ASRClient(url, Condition(), listener, logger=Logger(stderr, debug=True))
-    ws.connect()
-    ws.disconnect()
+                    metrics = self._recog_metrics
+                    if metrics is not None:
+                        now = monotonic()
+                        metrics.recognition_seconds = now - self._start_time
+                        if self._last_packet_time is not None:
+                            metrics.final_latency_seconds = (
+                                now - self._last_packet_time
+                            )
+                        self._emit_metrics(h["Result-Status"])
+                    self._status = h["Result-Status"]
+                    _set_result(self._recognition_future, True)
+
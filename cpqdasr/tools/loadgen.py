@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Load generator for SpeechRecognizer.
+
+Ramps the number of concurrent sessions through a list of levels. At each
+level, every session connects, runs a number of recognitions with audio
+paced at a given rate and closes, while the following latencies are
+recorded:
+    connect:        from the SpeechRecognizer constructor to the session
+                    being ready, i.e. handshake, CREATE_SESSION and
+                    SET_PARAMETERS
+    first partial:  from recognize() to the first partial result
+    final:          from the last audio packet to the final result
+
+Client CPU time of the whole process is also reported per session, so when
+the stand-in server is used it is run in a separate process.
+
+Usage:
+    cpqdasr-loadgen --stand-in -a audio.wav -c 1,10,50,100
+    cpqdasr-loadgen -w ws://host:8025/asr-server/asr -l builtin:slm/general \\
+        -a audio.wav -c 1,10,50
+"""
+from argparse import ArgumentParser
+from threading import Lock, Thread
+from time import monotonic, process_time
+import json
+import logging
+
+from cpqdasr.recognizer import (
+    SpeechRecognizer,
+    LanguageModelList,
+    RecognitionListener,
+    FileAudioSource,
+    PacedAudioSource,
+)
+from .server import StandInServer, start_process, stop_process
+
+
+def percentile(values, p):
+    """
+    Percentile with linear interpolation between closest ranks.
+
+    :values: Sorted list of values
+    :p:      Percentile, from 0 to 100
+    :returns: The percentile, or None if values is empty
+    """
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100.0
+    i = int(k)
+    j = min(i + 1, len(values) - 1)
+    return values[i] + (values[j] - values[i]) * (k - i)
+
+
+class _TimingListener(RecognitionListener):
+    def __init__(self):
+        self.first_partial = None
+        self.final = None
+
+    def on_partial_recognition(self, partial):
+        if self.first_partial is None:
+            self.first_partial = monotonic()
+
+    def on_recognition_result(self, result):
+        self.final = monotonic()
+
+
+class _TimedSource:
+    """
+    Records when the wrapped source is exhausted, which is when the send
+    audio thread sends the last packet.
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._iter = iter(source)
+        self.end = None
+
+    @property
+    def wav(self):
+        return getattr(self._source, "wav", None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            self.end = monotonic()
+            raise
+
+
+class LoadGenerator:
+    """
+    Runs SpeechRecognizer sessions concurrently and collects latencies.
+
+    :server_url:        The CPqD ASR Server Websocket URL
+    :audio_path:        Audio file sent in every recognition
+    :lm_list:           LanguageModelList for every recognition
+    :recognitions:      Recognitions per session
+    :rate:              Audio pacing relative to real time. None sends audio
+                        as fast as possible.
+    :recognizer_kwargs: kwargs for each SpeechRecognizer instance
+    """
+
+    def __init__(
+        self,
+        server_url,
+        audio_path,
+        lm_list,
+        recognitions=1,
+        rate=1.0,
+        **recognizer_kwargs
+    ):
+        assert isinstance(lm_list, LanguageModelList)
+        self._server_url = server_url
+        self._audio_path = audio_path
+        self._lm_list = lm_list
+        self._recognitions = recognitions
+        self._rate = rate
+        self._recognizer_kwargs = recognizer_kwargs
+        self._logger = logging.getLogger("cpqdasr")
+        self._lock = Lock()
+
+    def _session(self, samples):
+        listener = _TimingListener()
+        beg = monotonic()
+        asr = None
+        try:
+            asr = SpeechRecognizer(
+                self._server_url, listener=listener, **self._recognizer_kwargs
+            )
+            if not asr.wait_ready():
+                raise RuntimeError("Session is not ready")
+            connect = monotonic() - beg
+            with self._lock:
+                samples["connect"].append(connect)
+            for _ in range(self._recognitions):
+                listener.first_partial = None
+                listener.final = None
+                source = _TimedSource(
+                    PacedAudioSource(FileAudioSource(self._audio_path), self._rate)
+                )
+                start = monotonic()
+                asr.recognize(source, self._lm_list)
+                results = asr.wait_recognition_result()
+                if not results or listener.final is None or source.end is None:
+                    raise RuntimeError("Recognition failed")
+                with self._lock:
+                    if listener.first_partial is not None:
+                        samples["first_partial"].append(listener.first_partial - start)
+                    samples["final"].append(listener.final - source.end)
+        except Exception as e:
+            self._logger.warning("Load generator session error: {}".format(e))
+            with self._lock:
+                samples["errors"] += 1
+        finally:
+            if asr is not None:
+                asr.close()
+
+    def run_level(self, sessions):
+        """
+        Runs <sessions> concurrent sessions until all are finished.
+
+        :returns: dict with the level statistics. Latencies are in
+                  milliseconds.
+        """
+        samples = {"connect": [], "first_partial": [], "final": [], "errors": 0}
+        threads = [
+            Thread(target=self._session, args=(samples,)) for _ in range(sessions)
+        ]
+        cpu = process_time()
+        beg = monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = monotonic() - beg
+        cpu = process_time() - cpu
+        stats = {
+            "sessions": sessions,
+            "recognitions": len(samples["final"]),
+            "errors": samples["errors"],
+            "wall_seconds": wall,
+            "cpu_ms_per_session": cpu * 1000 / sessions,
+        }
+        for name in ["connect", "first_partial", "final"]:
+            values = sorted(samples[name])
+            for p in [50, 95, 99]:
+                value = percentile(values, p)
+                if value is not None:
+                    value *= 1000
+                stats["{}_p{}_ms".format(name, p)] = value
+        return stats
+
+    def run(self, levels):
+        """
+        Runs each concurrency level in turn.
+
+        :levels: Iterable with the number of concurrent sessions per level
+        :returns: List with the statistics dict of each level
+        """
+        return [self.run_level(sessions) for sessions in levels]
+
+
+_COLUMNS = [
+    ("sessions", "sessions", "{:>8}"),
+    ("recognitions", "recogs", "{:>7}"),
+    ("errors", "errors", "{:>7}"),
+    ("connect_p50_ms", "conn p50", "{:>9}"),
+    ("connect_p95_ms", "p95", "{:>7}"),
+    ("connect_p99_ms", "p99", "{:>7}"),
+    ("first_partial_p50_ms", "part p50", "{:>9}"),
+    ("first_partial_p95_ms", "p95", "{:>7}"),
+    ("first_partial_p99_ms", "p99", "{:>7}"),
+    ("final_p50_ms", "final p50", "{:>10}"),
+    ("final_p95_ms", "p95", "{:>7}"),
+    ("final_p99_ms", "p99", "{:>7}"),
+    ("cpu_ms_per_session", "cpu ms/sess", "{:>11}"),
+]
+
+
+def format_row(stats):
+    row = []
+    for key, _, fmt in _COLUMNS:
+        value = stats[key]
+        if isinstance(value, float):
+            value = "{:.1f}".format(value)
+        elif value is None:
+            value = "-"
+        row.append(fmt.format(value))
+    return " ".join(row)
+
+
+def format_header():
+    return " ".join(fmt.format(title) for _, title, fmt in _COLUMNS)
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog="cpqdasr-loadgen",
+        description="Ramps concurrent recognition sessions and reports "
+        "latency percentiles and client CPU per session.",
+    )
+    parser.add_argument("-w", "--url", help="ASR Server URL")
+    parser.add_argument(
+        "--stand-in",
+        action="store_true",
+        help="Run against a local stand-in server instead of --url",
+    )
+    parser.add_argument("-a", "--audio", required=True, help="Audio file")
+    parser.add_argument(
+        "-l", "--lm", default="builtin:slm/general", help="Language model URI"
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        default="1,2,4,8,16",
+        help="Comma separated concurrency levels",
+    )
+    parser.add_argument(
+        "-n", "--recognitions", type=int, default=1, help="Recognitions per session"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="Audio pacing relative to real time. 0 sends as fast as possible.",
+    )
+    parser.add_argument("-u", "--user", default="")
+    parser.add_argument("-p", "--password", default="")
+    parser.add_argument("--json", help="Also write the statistics to this file")
+    parser.add_argument("--partial-interval", type=float, default=0.5)
+    parser.add_argument("--partial-delay", type=float, default=0.0)
+    parser.add_argument("--final-delay", type=float, default=0.1)
+    parser.add_argument("--response-delay", type=float, default=0.0)
+    parser.add_argument(
+        "--log-level",
+        default="error",
+        choices=["error", "warning", "info", "debug"],
+    )
+    args = parser.parse_args(argv)
+    if not args.stand_in and not args.url:
+        parser.error("either --url or --stand-in is required")
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    server = None
+    url = args.url
+    if args.stand_in:
+        server, url = start_process(
+            StandInServer,
+            partial_interval=args.partial_interval,
+            partial_delay=args.partial_delay,
+            final_delay=args.final_delay,
+            response_delay=args.response_delay,
+        )
+    try:
+        generator = LoadGenerator(
+            url,
+            args.audio,
+            LanguageModelList(LanguageModelList.from_uri(args.lm)),
+            recognitions=args.recognitions,
+            rate=args.rate or None,
+            credentials=(args.user, args.password),
+        )
+        print(format_header())
+        levels = []
+        for sessions in [int(c) for c in args.concurrency.split(",")]:
+            stats = generator.run_level(sessions)
+            levels.append(stats)
+            print(format_row(stats))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(levels, f, indent=2)
+    finally:
+        if server is not None:
+            stop_process(server)
+
+
+if __name__ == "__main__":
+    main()
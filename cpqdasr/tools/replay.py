@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Replay server for session traces written by TraceWriter.
+
+Each incoming connection is served the next connection of the trace, in a
+round robin. Whenever the client sends a message, the server messages which
+followed the matching client message in the trace are sent back, each after
+its original delay from that client message multiplied by time_scale. So
+the client must send the same sequence of messages as in the trace, e.g.
+the same audio file with the same chunk size; mismatched commands are
+counted in stats["mismatches"].
+
+Depends on the 'websockets' package (cpqdasr[async]).
+
+Usage:
+    cpqdasr-replay session.trace --time-scale 1.0 --port 8025
+"""
+from argparse import ArgumentParser
+import asyncio
+
+from cpqdasr.recognizer_protocol import read_trace
+from cpqdasr.recognizer_protocol.trace import (
+    split_connections,
+    TRACE_SENT,
+    TRACE_RECEIVED,
+)
+from .server import _BackgroundServer
+
+
+def _command(payload):
+    return bytes(payload[:64]).split(b"\n", 1)[0]
+
+
+class _Connection:
+    def __init__(self, records):
+        self.records = records
+        self.index = 0
+        self.tail = None  # Last scheduled message
+        self.deadline = 0.0
+
+
+class ReplayServer(_BackgroundServer):
+    """
+    Serves recorded sessions back to clients.
+
+    :trace:       Path of a trace file, or a list of TraceRecord
+    :host:        Interface to listen on
+    :port:        Port to listen on. 0 picks a free port, which is available
+                  in "port" after start().
+    :time_scale:  Multiplies the recorded server delays. 1.0 keeps the
+                  original timing and 0 replays as fast as possible.
+
+    Attributes:
+    :stats: dict with the number of "connections", "messages" received and
+            "mismatches" between received and recorded commands
+    """
+
+    def __init__(self, trace, host="127.0.0.1", port=8025, time_scale=1.0):
+        super(ReplayServer, self).__init__(host, port)
+        if isinstance(trace, str):
+            trace = read_trace(trace)
+        self._connections = split_connections(trace)
+        if not self._connections:
+            raise ValueError("Trace has no connections")
+        self._time_scale = time_scale
+        self._next = 0
+        self.stats = {"connections": 0, "messages": 0, "mismatches": 0}
+
+    async def _handler(self, ws):
+        from websockets.exceptions import ConnectionClosed
+
+        records = self._connections[self._next % len(self._connections)]
+        self._next += 1
+        self.stats["connections"] += 1
+        connection = _Connection(records)
+        try:
+            async for data in ws:
+                if isinstance(data, str):
+                    data = data.encode()
+                self._replay(ws, connection, data)
+        except ConnectionClosed:
+            pass
+        finally:
+            if connection.tail is not None:
+                connection.tail.cancel()
+
+    def _replay(self, ws, connection, data):
+        self.stats["messages"] += 1
+        records = connection.records
+        i = connection.index
+        while i < len(records) and records[i].kind != TRACE_SENT:
+            i += 1
+        if i == len(records):
+            connection.index = i
+            self.stats["mismatches"] += 1
+            return
+        sent = records[i]
+        if _command(sent.payload) != _command(data):
+            self.stats["mismatches"] += 1
+        i += 1
+        while i < len(records) and records[i].kind == TRACE_RECEIVED:
+            delay = (records[i].timestamp - sent.timestamp) * self._time_scale
+            self._schedule(ws, connection, delay, records[i].payload)
+            i += 1
+        connection.index = i
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog="cpqdasr-replay",
+        description="Serves ASR session traces back to clients.",
+    )
+    parser.add_argument("trace", help="Trace file written by TraceWriter")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="Multiplies recorded delays. 0 replays as fast as possible.",
+    )
+    args = parser.parse_args(argv)
+    server = ReplayServer(args.trace, args.host, args.port, args.time_scale)
+    print("Serving on {}".format(server.url))
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Local stand-in for the CPqD ASR Server.
+
+Speaks the same WebSocket protocol as the server for CREATE_SESSION,
+SET_PARAMETERS, DEFINE_GRAMMAR, START_RECOGNITION, START_INPUT_TIMERS,
+SEND_AUDIO, CANCEL_RECOGNITION and RELEASE_SESSION, but does not recognize
+anything: START_OF_SPEECH is sent on the first audio packet, partial results
+with a growing prefix of a fixed text are sent as audio is received, and
+END_OF_SPEECH and the final result are sent after the last packet, each
+after a configurable delay. In continuous mode, i.e. if START_RECOGNITION
+sets decoder.continuousMode, a final result is also sent for every given
+interval of audio, as a speech segment of its own. Otherwise, recognitions
+may end before the last packet, once a given amount of digital silence is
+received, as the server does at the end of the first utterance. Grammars
+with an empty body are rejected, like invalid grammars in the server.
+Connections may also be dropped after a given amount of audio, to test
+reconnection. Used for load tests and for tests which do not need a
+licensed server.
+
+Depends on the 'websockets' package (cpqdasr[async]).
+
+Usage:
+    cpqdasr-stand-in --port 8025 --partial-interval 0.5 --final-delay 0.2
+"""
+from argparse import ArgumentParser
+from multiprocessing import Process
+from threading import Event, Thread
+from time import sleep, time
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+
+from cpqdasr.recognizer_protocol import VERSION
+from cpqdasr.ws_parser import parse_message
+
+
+def _message(command, headers, body=b""):
+    msg = "{} {}\n".format(VERSION, command)
+    for key, value in headers.items():
+        msg += "{}: {}\n".format(key, value)
+    if body:
+        msg += "Content-Type: application/json\n"
+        msg += "Content-Length: {}\n\n".format(len(body))
+    return msg.encode() + body
+
+
+class _Session:
+    def __init__(self, handle):
+        self.handle = handle
+        self.status = "IDLE"
+        self.audio_bytes = 0
+        self.next_partial = 0
+        self.partials = 0
+        self.continuous = False
+        self.segment = 0
+        self.segment_start = 0
+        self.silent_bytes = 0
+        self.ended_early = False  # Later audio is ignored
+        self.tail = None  # Last scheduled delayed message
+        self.deadline = 0.0
+
+
+class _BackgroundServer:
+    """
+    Base for local test servers, which serve from an event loop either in
+    the calling thread, with serve(), or in a daemon thread, with start().
+    Subclasses implement the connection handler "_handler".
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._logger = logging.getLogger("cpqdasr")
+        self._loop = None
+        self._stop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "ws://{}:{}/asr-server/asr".format(self.host, self.port)
+
+    async def serve(self, ready=None):
+        """
+        Serves until stop() is called.
+
+        :ready: Optional threading.Event set once the server is listening
+        """
+        from websockets.asyncio.server import serve
+
+        self._loop = asyncio.get_running_loop()
+        self._stop = self._loop.create_future()
+        async with serve(self._handler, self.host, self.port, max_size=None) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            if ready is not None:
+                ready.set()
+            await self._stop
+
+    def start(self):
+        """
+        Serves from a daemon thread with its own event loop. Returns once
+        the server is listening.
+        """
+        ready = Event()
+        self._thread = Thread(target=lambda: asyncio.run(self.serve(ready)))
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(
+                lambda: self._stop.done() or self._stop.set_result(None)
+            )
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, etype, value, traceback):
+        self.stop()
+
+    def _schedule(self, ws, state, delay, msg):
+        """
+        Sends msg after delay seconds without blocking the session, keeping
+        the order in which messages are scheduled.
+        """
+        state.deadline = max(state.deadline, self._loop.time() + delay)
+        state.tail = asyncio.ensure_future(
+            self._send_at(ws, state.tail, state.deadline, msg)
+        )
+
+    async def _send_at(self, ws, previous, deadline, msg):
+        from websockets.exceptions import ConnectionClosed
+
+        if previous is not None:
+            await asyncio.wait([previous])
+        await asyncio.sleep(max(deadline - self._loop.time(), 0))
+        try:
+            await ws.send(msg)
+        except ConnectionClosed:
+            pass
+
+
+class StandInServer(_BackgroundServer):
+    """
+    Stand-in ASR server.
+
+    :host:              Interface to listen on
+    :port:              Port to listen on. 0 picks a free port, which is
+                        available in "port" after start().
+    :text:              Text of the final result. Partial results are
+                        prefixes of it.
+    :response_delay:    Seconds before each RESPONSE is sent
+    :partial_interval:  Seconds of received audio between partial results.
+                        0 disables partial results.
+    :partial_delay:     Seconds between the audio packet which completes an
+                        interval and its partial result
+    :final_delay:       Seconds between the last audio packet and the final
+                        result
+    :sample_rate:       Sample rate used to convert received bytes to audio
+                        seconds, assuming 16-bit mono audio
+    :drop_after_bytes:  If set, the connection of a recognition is aborted,
+                        without a closing handshake, once it receives this
+                        many bytes of audio
+    :drops:             Number of connections dropped by drop_after_bytes
+    :segment_interval:  Seconds of received audio per speech segment in
+                        continuous mode
+    :end_silence:       If set, recognitions which are not in continuous
+                        mode end, without waiting for the last packet, once
+                        they receive this many seconds of zero samples in
+                        a row
+
+    Attributes:
+    :stats: dict with the number of "sessions", "active_sessions",
+            "recognitions", "grammars" defined, "audio_bytes" and "drops"
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8025,
+        text="um dois tres quatro cinco seis sete oito nove",
+        response_delay=0.0,
+        partial_interval=0.5,
+        partial_delay=0.0,
+        final_delay=0.1,
+        sample_rate=8000,
+        drop_after_bytes=None,
+        drops=1,
+        segment_interval=2.0,
+        end_silence=None,
+    ):
+        super(StandInServer, self).__init__(host, port)
+        self._words = text.split()
+        self._response_delay = response_delay
+        self._partial_bytes = int(partial_interval * sample_rate * 2)
+        self._partial_delay = partial_delay
+        self._final_delay = final_delay
+        self._sample_rate = sample_rate
+        self._drop_after_bytes = drop_after_bytes
+        self._drops = drops
+        self._segment_bytes = int(segment_interval * sample_rate * 2)
+        self._end_silence_bytes = None
+        if end_silence is not None:
+            self._end_silence_bytes = int(end_silence * sample_rate * 2)
+        self._handles = 0
+        self.stats = {
+            "sessions": 0,
+            "active_sessions": 0,
+            "recognitions": 0,
+            "grammars": 0,
+            "audio_bytes": 0,
+            "drops": 0,
+        }
+
+    async def _handler(self, ws):
+        from websockets.exceptions import ConnectionClosed
+
+        self._handles += 1
+        session = _Session("{}_{}".format(int(time() * 1000), self._handles))
+        self.stats["sessions"] += 1
+        self.stats["active_sessions"] += 1
+        try:
+            async for data in ws:
+                if isinstance(data, str):
+                    data = data.encode()
+                if not await self._dispatch(ws, session, data):
+                    break
+        except ConnectionClosed:
+            pass
+        finally:
+            self.stats["active_sessions"] -= 1
+            if session.tail is not None:
+                session.tail.cancel()
+
+    async def _respond(self, ws, session, method, result="SUCCESS", **headers):
+        if self._response_delay:
+            await asyncio.sleep(self._response_delay)
+        h = {
+            "Handle": session.handle,
+            "Method": method,
+            "Expires": 60,
+            "Result": result,
+            "Session-Status": session.status,
+        }
+        h.update(headers)
+        await ws.send(_message("RESPONSE", h))
+
+    async def _dispatch(self, ws, session, data):
+        version, command, headers, body = parse_message(data)
+        if command == "CREATE_SESSION":
+            await self._respond(ws, session, command)
+        elif command in ("SET_PARAMETERS", "START_INPUT_TIMERS"):
+            await self._respond(ws, session, command)
+        elif command == "DEFINE_GRAMMAR":
+            self.stats["grammars"] += 1
+            h = {"Content-ID": headers.get("Content-ID", "")}
+            if not body:
+                h.update({"Error-Code": "ERR_INVALID_GRAMMAR", "Message": "Empty"})
+                await self._respond(ws, session, command, "FAILURE", **h)
+            else:
+                await self._respond(ws, session, command, **h)
+        elif command == "START_RECOGNITION":
+            if session.status != "IDLE":
+                await self._respond(
+                    ws,
+                    session,
+                    command,
+                    "FAILURE",
+                    **{"Error-Code": "ERR_SESSION_STATUS", "Message": "Not idle"}
+                )
+                return True
+            session.status = "LISTENING"
+            session.audio_bytes = 0
+            session.next_partial = self._partial_bytes
+            session.partials = 0
+            session.continuous = headers.get("decoder.continuousMode") == "true"
+            session.segment = 0
+            session.segment_start = 0
+            session.silent_bytes = 0
+            session.ended_early = False
+            self.stats["recognitions"] += 1
+            await self._respond(ws, session, command)
+        elif command == "SEND_AUDIO":
+            await self._audio(ws, session, headers, body)
+        elif command == "CANCEL_RECOGNITION":
+            if session.tail is not None:
+                session.tail.cancel()
+                session.tail = None
+            session.status = "IDLE"
+            await self._respond(ws, session, command)
+        elif command == "RELEASE_SESSION":
+            session.status = "IDLE"
+            await self._respond(ws, session, command)
+            await ws.close()
+            return False
+        else:
+            self._logger.warning("Stand-in server: unknown command {}".format(command))
+        return True
+
+    async def _audio(self, ws, session, headers, body):
+        if session.ended_early:
+            return
+        if session.status not in ("LISTENING", "RECOGNIZING"):
+            await self._respond(
+                ws,
+                session,
+                "SEND_AUDIO",
+                "FAILURE",
+                **{"Error-Code": "ERR_SESSION_STATUS", "Message": "Not listening"}
+            )
+            return
+        if session.status == "LISTENING":
+            session.status = "RECOGNIZING"
+            h = {"Handle": session.handle, "Session-Status": session.status}
+            await ws.send(_message("START_OF_SPEECH", h))
+        session.audio_bytes += len(body)
+        self.stats["audio_bytes"] += len(body)
+        if (
+            self._drop_after_bytes is not None
+            and session.audio_bytes >= self._drop_after_bytes
+            and self.stats["drops"] < self._drops
+        ):
+            self.stats["drops"] += 1
+            ws.transport.abort()
+            return
+        last = headers.get("LastPacket") == "true"
+        if self._end_silence_bytes is not None and not session.continuous:
+            if len(body) and not bytes(body).strip(b"\x00"):
+                session.silent_bytes += len(body)
+            else:
+                session.silent_bytes = 0
+            if not last and session.silent_bytes >= self._end_silence_bytes:
+                session.ended_early = last = True
+        while (
+            self._partial_bytes > 0
+            and session.audio_bytes >= session.next_partial
+            and not last
+        ):
+            session.next_partial += self._partial_bytes
+            session.partials += 1
+            n = min(session.partials, len(self._words))
+            result = {
+                "alternatives": [{"text": " ".join(self._words[:n])}],
+                "segment_index": session.segment,
+                "final_result": False,
+            }
+            h = {
+                "Handle": session.handle,
+                "Result-Status": "PROCESSING",
+                "Session-Status": session.status,
+            }
+            self._schedule(
+                ws, session, self._partial_delay, _message(
+                    "RECOGNITION_RESULT", h, json.dumps(result).encode()
+                )
+            )
+        while (
+            session.continuous
+            and session.audio_bytes - session.segment_start >= self._segment_bytes
+            and not last
+        ):
+            end = session.segment_start + self._segment_bytes
+            msg = self._final_result(session, end, False)
+            self._schedule(ws, session, self._final_delay, msg)
+            session.segment += 1
+            session.segment_start = end
+            session.partials = 0
+        if last:
+            session.status = "IDLE"
+            h = {"Handle": session.handle, "Session-Status": "RECOGNIZING"}
+            await ws.send(_message("END_OF_SPEECH", h))
+            self._schedule(
+                ws,
+                session,
+                self._final_delay,
+                self._final_result(session, session.audio_bytes, True),
+            )
+
+    def _final_result(self, session, end_bytes, last_segment):
+        start_time = session.segment_start / (2.0 * self._sample_rate)
+        end_time = end_bytes / (2.0 * self._sample_rate)
+        step = (end_time - start_time) / max(len(self._words), 1)
+        words = [
+            {
+                "text": w,
+                "score": 90,
+                "start_time": round(start_time + i * step, 2),
+                "end_time": round(start_time + (i + 1) * step, 2),
+            }
+            for i, w in enumerate(self._words)
+        ]
+        result = {
+            "alternatives": [
+                {
+                    "text": " ".join(self._words),
+                    "score": 90,
+                    "lm": "builtin:slm/stand-in",
+                    "interpretations": [],
+                    "words": words,
+                }
+            ],
+            "segment_index": session.segment,
+            "last_segment": last_segment,
+            "final_result": True,
+            "start_time": round(start_time, 2),
+            "end_time": round(end_time, 2),
+            "result_status": "RECOGNIZED",
+        }
+        h = {
+            "Handle": session.handle,
+            "Result-Status": "RECOGNIZED",
+            "Session-Status": "IDLE" if last_segment else "RECOGNIZING",
+        }
+        return _message("RECOGNITION_RESULT", h, json.dumps(result).encode())
+
+
+def _serve_in_process(server_class, port, kwargs):
+    try:
+        asyncio.run(server_class(port=port, **kwargs).serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_process(server_class, **kwargs):
+    """
+    Starts a server in a child process, e.g. so that its CPU time is not
+    accounted as client CPU time in benchmarks.
+
+    :server_class: StandInServer or ReplayServer
+    :kwargs:       kwargs for the server, except for the port
+    :returns: Tuple with the process and the server URL
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    p = Process(target=_serve_in_process, args=(server_class, port, kwargs))
+    p.daemon = True
+    p.start()
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            if not p.is_alive():
+                raise RuntimeError("Server process failed to start")
+            sleep(0.05)
+    return p, "ws://127.0.0.1:{}/asr-server/asr".format(port)
+
+
+def stop_process(p):
+    """
+    Stops a server started with start_process.
+    """
+    # SIGINT lets the server close the remaining connections cleanly
+    os.kill(p.pid, signal.SIGINT)
+    p.join(5)
+    if p.is_alive():
+        p.terminate()
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog="cpqdasr-stand-in",
+        description="Local stand-in for the CPqD ASR Server, for load tests.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument(
+        "--text", default="um dois tres quatro cinco seis sete oito nove"
+    )
+    parser.add_argument("--response-delay", type=float, default=0.0)
+    parser.add_argument("--partial-interval", type=float, default=0.5)
+    parser.add_argument("--partial-delay", type=float, default=0.0)
+    parser.add_argument("--final-delay", type=float, default=0.1)
+    parser.add_argument("--sample-rate", type=int, default=8000)
+    parser.add_argument("--segment-interval", type=float, default=2.0)
+    parser.add_argument("--end-silence", type=float)
+    args = parser.parse_args(argv)
+    server = StandInServer(
+        args.host,
+        args.port,
+        text=args.text,
+        response_delay=args.response_delay,
+        partial_interval=args.partial_interval,
+        partial_delay=args.partial_delay,
+        final_delay=args.final_delay,
+        sample_rate=args.sample_rate,
+        segment_interval=args.segment_interval,
+        end_silence=args.end_silence,
+    )
+    print("Serving on {}".format(server.url))
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,55 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+
+def parse_message(payload):
+  """
+  Parses an ASR message in a single pass over its bytes.
+
+  The start line and headers end at the first blank line, and each header
+  is split at its first colon, so header values may contain colons. The
+  body is returned as a memoryview slice of the payload, limited by
+  Content-Length if present, so it is not copied.
+
+  :payload: bytes, bytearray or memoryview with the message. str is
+            accepted and encoded as UTF-8.
+  :returns: tuple with the version, the command, a dict with the headers
+            and the body
+  """
+  if isinstance(payload, str):
+    payload = payload.encode()
+  view = memoryview(payload)
+  if isinstance(payload, (bytes, bytearray)):
+    data = payload
+  else:
+    data = view.tobytes()
+  end = data.find(b"\n\n")
+  crlf_end = data.find(b"\n\r\n")
+  if crlf_end >= 0 and (end < 0 or crlf_end < end):
+    head, start = data[:crlf_end], crlf_end + 3
+  elif end >= 0:
+    head, start = data[:end], end + 2
+  else:
+    head, start = data, len(data)
+  version = ""
+  command = ""
+  headers = {}
+  lines = head.decode("utf-8").split("\n")
+  first = lines[0].split()
+  if len(first) >= 3 and first[0] == "ASR":
+    version, command = first[1], first[2]
+    lines = lines[1:]
+  for line in lines:
+    name, sep, value = line.partition(":")
+    if sep:
+      headers[name.strip()] = value.strip()
+  body = view[start:]
+  length = headers.get("Content-Length")
+  if length is not None and length.isdigit():
+    body = body[: int(length)]
+  return version, command, headers, body
+
+
 class WsParser():
   def __init__(self, payload):
     self.payload = payload
@@ -27,7 +76,7 @@ class WsParser():
     self.__init__(payload)
 
   def ProcessLine(self, line):
-    if line.find("ASR") >= 0:
+    if line.startswith("ASR "):
       self.command = line.split()[2]
       self.version = line.split()[1]
     elif line.count(":") == 1:
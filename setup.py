@@ -3,8 +3,6 @@ from setuptools import setup, find_packages
 
 install_requires = [
     "ws4py>=0.5.1",
-    "soundfile>=0.9.0.post1",
-    "pyaudio>=0.2.11",
 ]
 
 with open("README.md") as f:
@@ -13,6 +11,22 @@ with open("README.md") as f:
 with open("LICENSE") as f:
     license = f.read()
 
+extras_require = {
+    "mic": ["pyaudio>=0.2.11"],
+    "file": ["soundfile>=0.9.0.post1", "numpy"],
+    "async": ["websockets>=13.0"],
+    "json": ["orjson>=3.0"],
+}
+
+entry_points = {
+    "console_scripts": [
+        "cpqdasr-batch = cpqdasr.batch:main",
+        "cpqdasr-stand-in = cpqdasr.tools.server:main",
+        "cpqdasr-loadgen = cpqdasr.tools.loadgen:main",
+        "cpqdasr-replay = cpqdasr.tools.replay:main",
+    ],
+}
+
 tests_require = [
     "nose2",
 ]
@@ -22,7 +36,10 @@ setup(
     version="1.0.0",
     description="CPqD ASR SDK implementation using websockets in Python",
     long_description=readme,
+    python_requires=">=3.8",
     install_requires=install_requires,
+    extras_require=extras_require,
+    entry_points=entry_points,
     tests_require=tests_require,
     test_suite="nose2.collector.collector",
     author="Akira Miasato",
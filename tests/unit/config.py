@@ -22,6 +22,9 @@ log_path = "/tmp/asr-sdk-python-test.log"
 slm = "builtin:slm/callcenter-small"
 phone_grammar_uri = "builtin:grammar/phone"
 
+# Budget for "import cpqdasr", in milliseconds
+import_time_budget_ms = 250
+
 # Resource config
 res = "tests/unit/res/"
 phone_wav = res + "audio/phone-1937050211-8k.wav"
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tests with the asyncio recognizer
+"""
+from cpqdasr import AsyncSpeechRecognizer, LanguageModelList
+from cpqdasr import FileAudioSource
+from .config import url, credentials, phone_wav, phone_grammar_uri
+import asyncio
+
+
+asr_kwargs = {
+    "credentials": credentials,
+}
+
+
+# =============================================================================
+# Test cases
+# =============================================================================
+def test_async_basic_grammar():
+    async def run():
+        async with AsyncSpeechRecognizer(url, **asr_kwargs) as asr:
+            await asr.recognize(
+                FileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri)
+            )
+            return await asr.wait_recognition_result()
+
+    result = asyncio.run(run())
+    alt = result[0].alternatives[0]
+    assert len(alt["text"]) > 0
+    assert len(alt["interpretations"]) > 0
+    assert int(alt["score"]) > 90
+
+
+def test_async_concurrent_sessions():
+    async def run():
+        async with AsyncSpeechRecognizer(url, **asr_kwargs) as asr:
+            await asr.recognize(
+                FileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri)
+            )
+            return await asr.wait_recognition_result()
+
+    async def run_all():
+        return await asyncio.gather(*[run() for _ in range(10)])
+
+    for result in asyncio.run(run_all()):
+        assert len(result[0].alternatives[0]["text"]) > 0
+
+
+def test_async_cancel_on_recognize():
+    async def run():
+        async with AsyncSpeechRecognizer(url, **asr_kwargs) as asr:
+            await asr.recognize(
+                FileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri)
+            )
+            await asr.cancel_recognition()
+            return await asr.wait_recognition_result()
+
+    assert len(asyncio.run(run())) == 0
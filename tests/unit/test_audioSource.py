@@ -24,10 +24,23 @@ from cpqdasr import (
     LanguageModelList,
     FileAudioSource,
     BufferAudioSource,
+    PacedAudioSource,
+    EncodedAudioSource,
+    DecodedAudioSource,
+    VoiceActivitySource,
+    MultiChannelAudioSource,
 )
-from .config import url, credentials, slm, phone_wav
+from cpqdasr.recognizer.dsp import PolyphaseResampler, lowpass_filter
+from .config import url, credentials, slm, phone_wav, phone_raw, yes_wav
 
+from threading import Thread
 import soundfile as sf
+import io
+import numpy as np
+import os
+import struct
+import tempfile
+import time
 
 
 asr_kwargs = {"credentials": credentials}
@@ -66,3 +79,237 @@ def test_empty_buffer():
     res = asr.wait_recognition_result()
     assert len(res[0].alternatives) == 0
     asr.close()
+
+
+def test_buffer_chunks():
+    source = BufferAudioSource(chunk_size=4)
+    data = bytes(range(50))
+    for i in range(0, len(data), 7):
+        source.write(data[i : i + 7])
+    source.finish()
+    chunks = list(source)
+    assert b"".join(chunks) == data
+    assert all(len(c) == 4 for c in chunks[:-1])
+
+
+def test_buffer_wakes_on_write():
+    source = BufferAudioSource(chunk_size=4)
+    times = []
+
+    def read():
+        for _ in source:
+            times.append(time.time())
+
+    t = Thread(target=read)
+    t.start()
+    time.sleep(0.1)
+    beg = time.time()
+    source.write(b"\x00" * 4)
+    source.finish()
+    t.join(1)
+    assert not t.is_alive()
+    assert times[0] - beg < 0.04
+
+
+def test_buffer_block_when_full():
+    source = BufferAudioSource(chunk_size=4, max_size=8)
+    data = bytes(range(100))
+    t = Thread(target=lambda: (source.write(data), source.finish()))
+    t.start()
+    time.sleep(0.05)
+    assert len(source) == 8
+    assert b"".join(source) == data
+    t.join(1)
+    assert source.dropped_bytes == 0
+
+
+def test_buffer_close_releases_writer():
+    source = BufferAudioSource(chunk_size=4, max_size=8)
+    t = Thread(target=source.write, args=(bytes(100),))
+    t.start()
+    time.sleep(0.05)
+    assert t.is_alive()
+    source.close()
+    t.join(1)
+    assert not t.is_alive()
+    assert list(source) == []
+    source.write(bytes(4))
+    assert len(source) == 0
+
+
+def test_buffer_drop_when_full():
+    source = BufferAudioSource(chunk_size=4, max_size=8, overflow="drop")
+    source.write(bytes(range(6)))
+    source.write(bytes(range(6, 12)))
+    source.finish()
+    assert b"".join(source) == bytes(range(8))
+    assert source.dropped_bytes == 4
+
+
+def test_buffer_drop_oldest_when_full():
+    source = BufferAudioSource(chunk_size=4, max_size=8, overflow="drop_oldest")
+    source.write(bytes(range(6)))
+    source.write(bytes(range(6, 12)))
+    source.finish()
+    assert b"".join(source) == bytes(range(4, 12))
+    assert source.dropped_bytes == 4
+
+
+def test_file_strips_wav_header():
+    source = FileAudioSource(phone_wav, chunk_size=1000)
+    assert source.wav is False
+    assert source.sample_rate == 8000
+    chunks = list(source)
+    assert all(len(c) == 2000 for c in chunks[:-1])
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    assert b"".join(chunks) == sig.tobytes()
+
+
+def test_file_raw_passthrough():
+    source = FileAudioSource(phone_raw)
+    assert source.wav is None
+    with open(phone_raw, "rb") as f:
+        assert b"".join(source) == f.read()
+
+
+def test_file_close():
+    with FileAudioSource(phone_wav) as source:
+        chunk = next(source)
+    assert source._file.closed
+    assert len(chunk) > 0
+    assert list(source) == []
+
+
+def test_paced_source():
+    source = PacedAudioSource(FileAudioSource(yes_wav, chunk_size=800), rate=10.0)
+    assert source.wav is False
+    beg = time.time()
+    n_bytes = sum(len(c) for c in source)
+    elapsed = time.time() - beg
+    audio_seconds = n_bytes / 16000.0
+    assert abs(source.audio_seconds - audio_seconds) < 1e-6
+    assert elapsed >= audio_seconds / 10.0
+    assert abs(source.achieved_rate - 10.0) < 1.0
+
+
+def test_unthrottled_source():
+    source = PacedAudioSource(FileAudioSource(phone_wav), rate=None)
+    for _ in source:
+        pass
+    assert source.achieved_rate > 100.0
+
+
+def test_flac_source():
+    source = EncodedAudioSource(FileAudioSource(phone_wav, chunk_size=800))
+    assert source.content_type == "audio/flac"
+    stream = bytearray(b"".join(source))
+    assert stream.startswith(b"fLaC")
+    assert source.encoded_bytes == len(stream) < 0.8 * source.pcm_bytes
+    # Streams have no length, which is set here to read it as a file
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    (info,) = struct.unpack_from(">Q", stream, 18)
+    struct.pack_into(">Q", stream, 18, info & ~((1 << 36) - 1) | len(sig))
+    decoded, rate = sf.read(io.BytesIO(bytes(stream)), dtype="int16")
+    assert rate == 8000
+    assert (decoded == sig).all()
+
+
+def test_resampler_matches_convolution():
+    x = np.random.default_rng(0).standard_normal(2000).astype(np.float32)
+    for from_rate, to_rate in [(44100, 8000), (8000, 16000), (48000, 16000)]:
+        # Reference: zero stuffing, filtering and decimation of the whole signal
+        resampler = PolyphaseResampler(from_rate, to_rate)
+        up, down = resampler.up, resampler.down
+        taps = lowpass_filter(up, down)
+        upsampled = np.zeros(len(x) * up)
+        upsampled[::up] = x
+        total = -(-len(x) * up // down)
+        center = len(taps) // 2
+        expected = np.convolve(upsampled, taps)[center::down][:total]
+        # Streamed in blocks of uneven sizes
+        blocks = [resampler.process(x[i : i + 333]) for i in range(0, len(x), 333)]
+        y = np.concatenate(blocks + [resampler.flush()])
+        assert len(y) == total
+        assert np.abs(y - expected).max() < 1e-5
+
+
+def test_decoded_source():
+    # Stereo 44.1kHz FLAC with a 1kHz tone, decoded to mono 8kHz PCM
+    t = np.arange(44100) / 44100.0
+    tone = 0.5 * np.sin(2 * np.pi * 1000 * t)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.flac")
+        sf.write(path, np.stack([tone, tone], axis=1), 44100)
+        source = DecodedAudioSource(path, sample_rate=8000, chunk_size=800)
+        assert source.source_sample_rate == 44100
+        assert source.source_channels == 2
+        chunks = list(source)
+    assert all(len(c) == 1600 for c in chunks[:-1])
+    y = np.frombuffer(b"".join(chunks), dtype="<i2") / 32768.0
+    assert len(y) == 8000
+    spectrum = np.abs(np.fft.rfft(y[1000:7000]))
+    assert np.argmax(spectrum) * 8000 / 6000 == 1000
+    assert abs(np.abs(y[1000:7000]).max() - 0.5) < 0.01
+
+
+def test_decoded_source_same_rate():
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    chunks = list(DecodedAudioSource(phone_wav, sample_rate=rate))
+    assert b"".join(chunks) == sig.tobytes()
+
+
+def test_multichannel_source():
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    stereo = np.stack([sig, -sig, sig[::-1]], axis=1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "call.wav")
+        sf.write(path, stereo, rate, subtype="PCM_16")
+        source = MultiChannelAudioSource(path, chunk_size=1000, max_pending=2)
+        assert source.channels == 3
+        assert source.frames == len(sig)
+        out = [[] for _ in range(3)]
+
+        def consume(c):
+            out[c] = list(source.sources[c])
+
+        # Each channel from its own thread, and the last one closed early
+        threads = [Thread(target=consume, args=(c,)) for c in range(2)]
+        for t in threads:
+            t.start()
+        source.sources[2].close()
+        for t in threads:
+            t.join(10)
+        assert not any(t.is_alive() for t in threads)
+    assert all(len(c) == 2000 for c in out[0][:-1])
+    assert b"".join(out[0]) == sig.tobytes()
+    assert b"".join(out[1]) == (-sig).tobytes()
+
+
+def test_voice_activity_source():
+    # Noise and 1 second tones: 2s noise, tone, 3s noise, tone, 2s noise
+    rng = np.random.default_rng(0)
+    rate = 8000
+    tone = 0.1 * np.sin(2 * np.pi * 300 * np.arange(rate) / rate)
+    parts = []
+    for seconds in [2, None, 3, None, 2]:
+        if seconds is None:
+            parts.append(tone)
+        else:
+            parts.append(0.001 * rng.standard_normal(seconds * rate))
+    audio = (np.concatenate(parts) * 32768).astype("<i2").tobytes()
+    buf = BufferAudioSource(chunk_size=1000)
+    buf.write(audio)
+    buf.finish()
+    source = VoiceActivitySource(buf, padding_ms=300, max_silence_ms=1000)
+    sent = b"".join(source)
+    # 0.3 + 1 + (0.7 + 0.3) + 1 + 0.7 seconds are kept
+    assert abs(source.sent_seconds - 4.0) < 0.05
+    assert len(sent) == 2 * round(source.sent_seconds * rate)
+    assert source.audio_seconds == 9.0
+    # The first tone starts 0.3s into the sent audio, and the second 2.3s
+    assert abs(source.original_time(0.3) - 2.0) < 0.05
+    assert abs(source.original_time(2.3) - 6.0) < 0.05
+    assert abs(source.original_time(3.0) - 6.7) < 0.05
+    # The tones are sent untouched
+    start = int(0.3 * rate) * 2
+    assert sent[start + 400 : start + 2 * rate - 400] in audio
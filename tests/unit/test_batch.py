@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tests for batch transcription
+"""
+from cpqdasr import LanguageModelList
+from cpqdasr.batch import BatchTranscriber, list_inputs, read_checkpoint
+from .config import url, credentials, res, phone_wav, phone_grammar_uri
+import json
+import os
+import tempfile
+
+
+# =============================================================================
+# Test cases
+# =============================================================================
+def test_list_inputs_directory():
+    paths = list_inputs(res + "audio", "*.wav")
+    assert phone_wav in paths
+    assert all(p.endswith(".wav") for p in paths)
+    assert paths == sorted(paths)
+
+
+def test_list_inputs_manifest():
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = os.path.join(tmp, "manifest.txt")
+        with open(manifest, "w") as f:
+            f.write("# comment\n\na.wav\n/abs/b.raw\n")
+        assert list_inputs(manifest) == [os.path.join(tmp, "a.wav"), "/abs/b.raw"]
+
+
+def test_read_checkpoint():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out.jsonl")
+        assert read_checkpoint(output) == set()
+        with open(output, "w") as f:
+            f.write(json.dumps({"path": "a.wav", "status": "ok"}) + "\n")
+            f.write(json.dumps({"path": "b.wav", "status": "error"}) + "\n")
+            f.write('{"path": "c.wav", "sta')
+        assert read_checkpoint(output) == {"a.wav"}
+
+
+def test_batch():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out.jsonl")
+        lm = LanguageModelList(LanguageModelList.from_uri(phone_grammar_uri))
+        paths = [phone_wav] * 4
+        summary = BatchTranscriber(
+            url, lm, output, sessions=2, credentials=credentials
+        ).run(paths)
+        assert summary["completed"] == 4
+        assert summary["failed"] == 0
+        assert summary["audio_hours_per_wall_hour"] > 0
+        with open(output) as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 4
+        for record in records:
+            assert record["status"] == "ok"
+            assert record["results"][0]["result_code"] == "RECOGNIZED"
+        summary = BatchTranscriber(
+            url, lm, output, sessions=2, resume=True, credentials=credentials
+        ).run(paths)
+        assert summary["skipped"] == 4
+        assert summary["completed"] == 0
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Import time tests, with "python -X importtime" in a fresh interpreter
+"""
+from .config import import_time_budget_ms
+import os
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+def import_times(module):
+    """
+    :returns: dict with the cumulative import time of every module loaded by
+              "import <module>", in microseconds
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    times = {}
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def test_no_native_imports():
+    times = import_times("cpqdasr")
+    for module in ["pyaudio", "soundfile", "numpy"]:
+        assert module not in times
+
+
+def test_import_time():
+    # Best of a few runs, as the first may read the modules from disk
+    best = min(import_times("cpqdasr")["cpqdasr"] for _ in range(3))
+    assert best / 1000 < import_time_budget_ms
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tests for recognition metrics, with the stand-in server
+"""
+from cpqdasr import SpeechRecognizer, LanguageModelList, FileAudioSource
+from cpqdasr.metrics import (
+    RecognitionMetrics,
+    CallbackSink,
+    OpenMetricsExporter,
+    StatsdSink,
+)
+from cpqdasr.tools.server import StandInServer
+from .config import phone_wav, slm
+import socket
+
+
+def recognize(url, sinks, grammar=False, cancel=False):
+    asr = SpeechRecognizer(url, session_config={"a": "b"}, metrics=sinks)
+    lm = [LanguageModelList.from_uri(slm)]
+    if grammar:
+        lm.append(LanguageModelList.inline_grammar("g", "#ABNF 1.0;"))
+    lm = LanguageModelList(*lm)
+    for _ in range(2):
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        if cancel:
+            asr.cancel_recognition()
+        else:
+            asr.wait_recognition_result()
+    asr.close()
+
+
+# =============================================================================
+# Test cases
+# =============================================================================
+def test_recognition_metrics():
+    records = []
+    with StandInServer(port=0) as server:
+        recognize(server.url, CallbackSink(records.append), grammar=True)
+    assert len(records) == 2
+    first, second = records
+    assert first.result_status == "RECOGNIZED"
+    assert first.session_recognition == 0
+    assert second.session_recognition == 1
+    for m in records:
+        assert m.connect_seconds > 0
+        assert m.create_session_seconds > 0
+        assert m.set_parameters_seconds > 0
+        assert 0 < m.first_partial_seconds < m.recognition_seconds
+        assert 0 < m.final_latency_seconds < m.recognition_seconds
+        assert m.bytes_sent > 171000  # Audio, besides other messages
+        assert m.messages_sent > 20
+        assert m.messages_received > 5
+    assert second.connect_seconds == first.connect_seconds
+    # The grammar is only defined once per session
+    assert list(first.define_grammar_seconds) == ["g"]
+    assert second.define_grammar_seconds == {}
+    # and its DEFINE_GRAMMAR request and response are accounted
+    assert first.messages_sent == second.messages_sent + 1
+    assert first.bytes_sent > second.bytes_sent + len("#ABNF 1.0;")
+
+
+def test_canceled_metrics():
+    records = []
+    with StandInServer(port=0, final_delay=5) as server:
+        recognize(server.url, [CallbackSink(records.append)], cancel=True)
+    assert [m.result_status for m in records] == ["CANCELED", "CANCELED"]
+    assert records[0].final_latency_seconds is None
+
+
+def test_openmetrics():
+    exporter = OpenMetricsExporter(buckets=(0.1, 1.0))
+    m = RecognitionMetrics()
+    m.connect_seconds = 0.05
+    m.define_grammar_seconds = {"a": 0.5, "b": 2.0}
+    m.result_status = "RECOGNIZED"
+    m.bytes_sent = 10
+    exporter.record(m)
+    m.session_recognition = 1  # Session phases are accounted once
+    exporter.record(m)
+    text = exporter.render()
+    assert 'cpqdasr_connect_seconds_bucket{le="0.1"} 1\n' in text
+    assert "cpqdasr_connect_seconds_count 1\n" in text
+    assert 'cpqdasr_define_grammar_seconds_bucket{le="1.0"} 2\n' in text
+    assert 'cpqdasr_define_grammar_seconds_bucket{le="+Inf"} 4\n' in text
+    assert "cpqdasr_sent_bytes_total 20\n" in text
+    assert 'cpqdasr_recognitions_total{status="RECOGNIZED"} 2\n' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_statsd():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        sink = StatsdSink(port=server.getsockname()[1])
+        m = RecognitionMetrics()
+        m.final_latency_seconds = 0.25
+        m.messages_sent = 3
+        m.result_status = "RECOGNIZED"
+        sink.record(m)
+        sink.close()
+        lines = server.recv(65536).decode().split("\n")
+    assert "cpqdasr.final_latency:250.000|ms" in lines
+    assert "cpqdasr.sent_messages:3|c" in lines
+    assert "cpqdasr.recognitions.recognized:1|c" in lines
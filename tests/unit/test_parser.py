@@ -20,6 +20,7 @@ ASR Server WebSocket parser test
 """
 
 from cpqdasr import WsParser
+from cpqdasr.ws_parser import parse_message
 
 payload = \
 "ASR 1.0 RESPONSE\r\n" \
@@ -130,3 +131,34 @@ def test_parser_5():
   assert "RESPONSE" == parser.get_command()
   assert "1.0" == parser.get_version()
   assert "body\nsdfsidkf sdfsldk sldkfslfsidlfsidksldijfsdifldfk sodfjsdlfkjsdf" == parser.get_body()
+
+payload6 = \
+b"ASR 2.4 RECOGNITION_RESULT\n" \
+b"Handle: ASR-1234:5678\n" \
+b"Result-Status: RECOGNIZED\n" \
+b"Content-Type: application/json\n" \
+b"Content-Length: 27\n\n" \
+b'{"alternatives": [], "a":1}'
+def test_parse_message_1():
+  version, command, headers, body = parse_message(payload6)
+  assert "2.4" == version
+  assert "RECOGNITION_RESULT" == command
+  assert "ASR-1234:5678" == headers["Handle"]
+  assert "RECOGNIZED" == headers["Result-Status"]
+  assert isinstance(body, memoryview)
+  assert body.obj is payload6
+  assert b'{"alternatives": [], "a":1}' == body
+
+def test_parse_message_2():
+  version, command, headers, body = parse_message(payload)
+  assert "1.0" == version
+  assert "RESPONSE" == command
+  assert "201604081523970032" == headers["Handle"]
+  assert "CREATE_SESSION" == headers["Method"]
+  assert "body\nsdfsidkf sdfsldk sldkfslfsidlfsidksldijfsdifldfk sodfjsdlfkjsdf" == str(body, "utf-8")
+
+def test_parse_message_3():
+  version, command, headers, body = parse_message(b"ASR 2.4 RESPONSE\nMethod: CANCEL_RECOGNITION\nResult: SUCCESS")
+  assert "RESPONSE" == command
+  assert {"Method": "CANCEL_RECOGNITION", "Result": "SUCCESS"} == headers
+  assert 0 == len(body)
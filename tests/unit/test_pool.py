@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tests with the SpeechRecognizer pool
+"""
+from cpqdasr import RecognitionException
+from cpqdasr import SpeechRecognizerPool, LanguageModelList
+from cpqdasr import FileAudioSource
+from .config import url, credentials, phone_wav, phone_grammar_uri
+import time
+
+
+pool_kwargs = {
+    "credentials": credentials,
+}
+
+
+# =============================================================================
+# Test cases
+# =============================================================================
+def test_warm():
+    with SpeechRecognizerPool(url, min_size=2, max_size=4, **pool_kwargs) as pool:
+        assert pool.warm() == 2
+        assert pool.warm(4) == 4
+        assert pool.size == 4
+
+
+def test_lease_reuses_session():
+    with SpeechRecognizerPool(url, min_size=1, max_size=1, **pool_kwargs) as pool:
+        pool.warm()
+        for i in range(2):
+            with pool.leased() as asr:
+                if i == 0:
+                    first = asr
+                assert asr is first
+                asr.recognize(
+                    FileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri)
+                )
+                result = asr.wait_recognition_result()
+                assert len(result[0].alternatives[0]["text"]) > 0
+
+
+def test_lease_timeout():
+    with SpeechRecognizerPool(url, min_size=0, max_size=1, **pool_kwargs) as pool:
+        asr = pool.lease()
+        try:
+            pool.lease(timeout=0.5)
+        except RecognitionException as e:
+            assert e.code == "FAILURE"
+        else:
+            assert False
+        pool.release(asr)
+
+
+def test_idle_eviction():
+    with SpeechRecognizerPool(
+        url, min_size=1, max_size=3, max_idle_seconds=0.1, **pool_kwargs
+    ) as pool:
+        pool.warm(3)
+        time.sleep(0.2)
+        pool.maintain()
+        assert pool.size == 1
+        assert pool.idle_count == 1
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+ASR Server WebSocket API message builders tests
+"""
+from cpqdasr.recognizer_protocol import AudioFramer, send_audio_msg
+from cpqdasr.recognizer_protocol import parse_recognition_result, parse_response
+from cpqdasr.recognizer_protocol import json_backend, set_json_backend
+import pytest
+from cpqdasr.recognizer_protocol.ws4py_api import _mask
+import numpy  # noqa: F401, enables the numpy path of _mask
+import sys
+
+
+def test_audio_framer_equivalence():
+    framer = AudioFramer()
+    payloads = [b"", b"\x01\x02", bytes(range(256)) * 16, memoryview(bytes(4096))]
+    for payload in payloads:
+        for last in (True, False):
+            for audio_wav in (True, False):
+                msg = send_audio_msg(bytes(payload), last, audio_wav)
+                assert bytes(framer.frame(payload, last, audio_wav)) == msg
+            msg = send_audio_msg(bytes(payload), last, content_type="audio/flac")
+            assert b"Content-Type: audio/flac\n\n" in msg
+            frame = framer.frame(payload, last, content_type="audio/flac")
+            assert bytes(frame) == msg
+
+
+def test_audio_framer_reuses_buffer():
+    framer = AudioFramer()
+    first = framer.frame(bytes(4096))
+    second = framer.frame(b"\xff" * 4096)
+    assert first is second
+    assert second.endswith(b"\xff" * 4096)
+
+
+def test_mask():
+    key = b"\x12\x34\x56\x78"
+    for n in (0, 1, 3, 4, 5, 4099):
+        data = bytearray(range(256)) * (n // 256 + 1)
+        data = data[:n]
+        expected = bytes(b ^ key[i % 4] for i, b in enumerate(data))
+        _mask(key, data)
+        assert bytes(data) == expected
+
+
+def test_mask_without_numpy():
+    # _mask only uses numpy if it was imported
+    np = sys.modules.pop("numpy", None)
+    try:
+        test_mask()
+    finally:
+        if np is not None:
+            sys.modules["numpy"] = np
+
+
+def test_recognition_result_scores():
+    h = {"Result-Status": "RECOGNIZED"}
+    b = {
+        "alternatives": [{"text": "sim", "score": 90}],
+        "last_segment": True,
+        "age_scores": {"event": "AGE", "age": 30, "p": [0.1], "confidence": 0.9},
+        "emotion_scores": {
+            "event": "EMOTION",
+            "emotion": "neutral",
+            "p": [0.8],
+            "p_groups": {},
+        },
+    }
+    result, last_segment = parse_recognition_result(h, b)
+    assert last_segment
+    assert result.alternatives is b["alternatives"]
+    assert result._age_scores is None  # Built on first access
+    assert result.age_scores.age == 30
+    assert result.age_scores is result.age_scores
+    assert result.gender_scores.gender is None
+    assert result.emotion_scores.emotion == "neutral"
+    assert not hasattr(result, "__dict__")
+
+
+def test_parse_recognition_result_segments():
+    h = {"Result-Status": "RECOGNIZED"}
+    b = {
+        "alternatives": [],
+        "segment_index": 3,
+        "last_segment": False,
+        "start_time": 1.25,
+        "end_time": 2.5,
+    }
+    result, last_segment = parse_recognition_result(h, b)
+    assert not last_segment and not result.last_speech_segment
+    assert result.speech_segment_index == 3
+    assert result.sentence_start_time_milliseconds == 1250
+    assert result.sentence_end_time_milliseconds == 2500
+    # e.g. a body which could not be decoded
+    result, last_segment = parse_recognition_result(h, {})
+    assert last_segment and result.speech_segment_index == 0
+
+
+def result_msg(status, body):
+    body = body.encode() if isinstance(body, str) else body
+    head = "ASR 2.4 RECOGNITION_RESULT\nResult-Status: {}\nContent-Length: {}\n\n"
+    return head.format(status, len(body)).encode() + body
+
+
+def test_parse_response_bodies():
+    body = '{"alternatives": [{"text": "um dois"}]}'
+    call, h, b = parse_response(result_msg("PROCESSING", body))
+    assert call == "RECOGNITION_RESULT"
+    assert b == {"alternatives": [{"text": "um dois"}]}
+    assert parse_response(result_msg("PROCESSING", body), False)[2] == {}
+    assert parse_response(result_msg("RECOGNIZED", body), False)[2] == b
+    assert parse_response(result_msg("RECOGNIZED", '{"alter'))[2] is None
+
+
+def test_json_backends():
+    default = json_backend.json_backend
+    body = '{"alternatives": [{"text": "s\u00e3o", "score": 9.5}]}'
+    try:
+        for name in ["orjson", "ujson", "json"]:
+            try:
+                set_json_backend(name)
+            except ImportError:
+                continue
+            b = parse_response(result_msg("RECOGNIZED", body))[2]
+            assert b == {"alternatives": [{"text": "s\u00e3o", "score": 9.5}]}
+            assert parse_response(result_msg("RECOGNIZED", b'{"a": "\xff"}'))[2] is None
+        with pytest.raises(ValueError):
+            set_json_backend("yaml")
+    finally:
+        set_json_backend(default)
@@ -225,3 +225,31 @@ def test_multiple_recognize():
         assert len(result["text"]) > 0
         assert len(result["interpretations"]) > 0
         assert int(result["score"]) > 90
+
+
+def test_recognition_handle():
+    asr = SpeechRecognizer(url, **asr_kwargs)
+    handle = asr.recognize(
+        FileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri)
+    )
+    done = []
+    handle.add_done_callback(done.append)
+    result = handle.result()
+    asr.close()
+    assert handle.done()
+    assert done == [handle]
+    assert handle.result() is result
+    assert int(result[0].alternatives[0]["score"]) > 90
+
+
+def test_recognition_handle_cancel():
+    asr = SpeechRecognizer(url, **asr_kwargs)
+    handle = asr.recognize(
+        DelayedFileAudioSource(phone_wav), LanguageModelList(phone_grammar_uri), wav=False
+    )
+    time.sleep(1)
+    assert handle.cancel()
+    assert handle.cancelled()
+    assert handle.result() == []
+    assert not handle.cancel()
+    asr.close()
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+#
+#  Copyright 2017 CPqD. All rights reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tests with the stand-in server and the load generator, which do not need
+a CPqD ASR Server
+"""
+from cpqdasr import SpeechRecognizer, LanguageModelList, RecognitionListener
+from cpqdasr import AsyncSpeechRecognizer, PartialRecognitionResult
+from cpqdasr import FileAudioSource, PacedAudioSource, TraceWriter
+from cpqdasr import BufferAudioSource
+from cpqdasr import ReconnectPolicy, RecognitionException
+from cpqdasr.metrics import CallbackSink
+from cpqdasr.recognizer.send_queue import SendQueue
+from cpqdasr.recognizer_protocol import read_trace
+from cpqdasr.recognizer_protocol.trace import TRACE_OPEN, TRACE_SENT, TRACE_RECEIVED
+from cpqdasr.tools.server import StandInServer
+from cpqdasr.tools.replay import ReplayServer
+from cpqdasr.tools.loadgen import LoadGenerator, percentile
+from cpqdasr.multichannel import MultiChannelRecognizer
+from .config import phone_wav, slm
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import numpy as np
+import os
+import soundfile as sf
+import gc
+import tempfile
+import threading
+import time
+import weakref
+
+
+class PartialListener(RecognitionListener):
+    def __init__(self):
+        self.partials = []
+
+    def on_partial_recognition(self, partial):
+        self.partials.append(partial.text)
+
+
+class SegmentListener(RecognitionListener):
+    def __init__(self):
+        self.segments = []
+
+    def on_segment_result(self, result):
+        self.segments.append(result)
+
+
+def assert_threads_stopped(before, timeout=5.0):
+    """
+    Asserts that the threads started since the "before" snapshot of
+    threading.enumerate() stop within timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    for t in threading.enumerate():
+        if t not in before:
+            t.join(max(deadline - time.monotonic(), 0))
+    assert [t.name for t in threading.enumerate() if t not in before] == []
+
+
+# =============================================================================
+# Test cases
+# =============================================================================
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1.0], 99) == 1.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile(list(range(101)), 95) == 95
+
+
+def test_stand_in_recognition():
+    with StandInServer(port=0, text="um dois tres") as server:
+        listener = PartialListener()
+        asr = SpeechRecognizer(server.url, listener=listener)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        for _ in range(2):
+            asr.recognize(FileAudioSource(phone_wav), lm)
+            results = asr.wait_recognition_result()
+            assert len(results) == 1
+            assert results[0].result_code == "RECOGNIZED"
+            assert results[0].alternatives[0]["text"] == "um dois tres"
+        asr.close()
+        assert listener.partials[:3] == ["um", "um dois", "um dois tres"]
+        assert server.stats["sessions"] == 1
+        assert server.stats["recognitions"] == 2
+
+
+def test_stand_in_instance_partial_callback():
+    with StandInServer(port=0, text="um dois tres") as server:
+        partials = []
+        listener = RecognitionListener()
+        listener.on_partial_recognition = lambda p: partials.append(p.text)
+        asr = SpeechRecognizer(server.url, listener=listener)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        assert len(asr.wait_recognition_result()) == 1
+        asr.close()
+        assert partials[:3] == ["um", "um dois", "um dois tres"]
+
+
+def test_stand_in_cancel():
+    with StandInServer(port=0, final_delay=5) as server:
+        asr = SpeechRecognizer(server.url)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        asr.cancel_recognition()
+        assert asr.wait_recognition_result() == []
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        asr.cancel_recognition()
+        asr.close()
+
+
+def test_continuous_mode():
+    with StandInServer(port=0, segment_interval=2.0) as server:
+        listener = SegmentListener()
+        asr = SpeechRecognizer(
+            server.url, listener=listener, continuous_mode=True, retained_results=2
+        )
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        results = asr.wait_recognition_result()
+        asr.close()
+    segments = listener.segments
+    # 10.7 seconds of audio in 2 second segments
+    assert [r.speech_segment_index for r in segments] == list(range(6))
+    assert [r.last_speech_segment for r in segments] == [False] * 5 + [True]
+    assert segments[1].sentence_start_time_milliseconds == 2000
+    assert segments[1].sentence_end_time_milliseconds == 4000
+    assert results == segments[-2:]
+
+
+def test_stream_results():
+    with StandInServer(port=0, segment_interval=2.0) as server:
+        asr = SpeechRecognizer(server.url, continuous_mode=True, retained_results=1)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        finals = []
+        for result in asr.stream_results(max_pending=2):
+            if not isinstance(result, PartialRecognitionResult):
+                finals.append(result)
+            time.sleep(0.05)  # Slower than the server
+        assert [r.speech_segment_index for r in finals] == list(range(6))
+        assert finals[-1].last_speech_segment
+        assert asr.is_idle()
+        # Stops on cancel
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        results = asr.stream_results()
+        assert next(results) is not None
+        asr.cancel_recognition()
+        assert list(results) == []
+        asr.close()
+
+
+def test_cancel_releases_blocked_writer():
+    with StandInServer(port=0, final_delay=5) as server:
+        asr = SpeechRecognizer(server.url)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        source = BufferAudioSource(chunk_size=1600, max_size=3200)
+        writer = threading.Thread(target=source.write, args=(bytes(10 ** 6),))
+        asr.recognize(PacedAudioSource(source, sample_rate=8000), lm)
+        writer.start()
+        time.sleep(0.3)
+        assert writer.is_alive()
+        asr.cancel_recognition()
+        writer.join(1)
+        assert not writer.is_alive()
+        asr.close()
+
+
+def test_async_cancel_releases_blocked_writer():
+    source = BufferAudioSource(chunk_size=1600, max_size=3200)
+    writer = threading.Thread(target=source.write, args=(bytes(10 ** 6),))
+
+    async def run(url):
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        async with AsyncSpeechRecognizer(url) as asr:
+            await asr.recognize(PacedAudioSource(source, sample_rate=8000), lm)
+            writer.start()
+            await asyncio.sleep(0.3)
+            assert writer.is_alive()
+            await asr.cancel_recognition()
+
+    with StandInServer(port=0, final_delay=5) as server:
+        asyncio.run(run(server.url))
+    writer.join(1)
+    assert not writer.is_alive()
+
+
+def test_async_stream_results():
+    async def run(url):
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        async with AsyncSpeechRecognizer(url, continuous_mode=True) as asr:
+            await asr.recognize(FileAudioSource(phone_wav), lm)
+            finals = []
+            async for result in asr.stream_results(max_pending=2):
+                if not isinstance(result, PartialRecognitionResult):
+                    finals.append(result)
+                await asyncio.sleep(0.05)
+            return finals, asr.status
+
+    with StandInServer(port=0, segment_interval=2.0) as server:
+        finals, status = asyncio.run(run(server.url))
+    assert [r.speech_segment_index for r in finals] == list(range(6))
+    assert status == "IDLE"
+
+
+def test_async_cancel():
+    async def run(url):
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        async with AsyncSpeechRecognizer(url) as asr:
+            await asr.recognize(PacedAudioSource(FileAudioSource(phone_wav)), lm)
+            await asyncio.sleep(0.3)
+            assert asr.status == "LISTENING"
+            await asr.cancel_recognition()
+            # Only accepted once the cancel response is received
+            await asr.recognize(FileAudioSource(phone_wav), lm)
+            return await asr.wait_recognition_result()
+
+    with StandInServer(port=0, response_delay=0.05) as server:
+        assert len(asyncio.run(run(server.url))) == 1
+
+
+def test_async_audio_executor():
+    class CountingExecutor(ThreadPoolExecutor):
+        submitted = 0
+
+        def submit(self, *args, **kwargs):
+            self.submitted += 1
+            return super().submit(*args, **kwargs)
+
+    async def run(url, executor):
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        async with AsyncSpeechRecognizer(url, executor=executor) as asr:
+            # Read inline
+            await asr.recognize(FileAudioSource(phone_wav), lm)
+            assert len(await asr.wait_recognition_result()) == 1
+            assert executor.submitted == 0
+            # Read in the given executor
+            await asr.recognize(PacedAudioSource(FileAudioSource(phone_wav), 8.0), lm)
+            assert len(await asr.wait_recognition_result()) == 1
+            assert executor.submitted > 0
+
+    with StandInServer(port=0) as server, CountingExecutor(1) as executor:
+        asyncio.run(run(server.url, executor))
+
+
+def test_async_dropped_connection():
+    errors = []
+
+    async def run(url):
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr = AsyncSpeechRecognizer(url)
+        await asr.recognize(FileAudioSource(phone_wav), lm)
+        results = await asr.wait_recognition_result()
+        await asr.close()
+        gc.collect()  # Reports unretrieved task exceptions
+        return results
+
+    with StandInServer(port=0, drop_after_bytes=40000) as server:
+        assert asyncio.run(run(server.url)) == []
+    assert errors == []
+
+
+def test_grammar_cache():
+    with StandInServer(port=0) as server:
+        asr = SpeechRecognizer(server.url)
+        for body in ["#ABNF 1.0; $yes = sim;", "#ABNF 1.0; $yes = sim | nao;"]:
+            for _ in range(2):
+                lm = LanguageModelList(LanguageModelList.inline_grammar("yes_no", body))
+                asr.recognize(FileAudioSource(phone_wav), lm)
+                assert len(asr.wait_recognition_result()) == 1
+        asr.close()
+        assert server.stats["grammars"] == 2
+        assert asr.grammar_cache.misses == 2
+        assert asr.grammar_cache.hits == 2
+
+
+def test_pipelined_grammars():
+    grammars = [
+        LanguageModelList.inline_grammar(str(i), "#ABNF 1.0; $n = {};".format(i))
+        for i in range(3)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.trace")
+        with StandInServer(port=0, response_delay=0.1) as server:
+            with TraceWriter(path) as trace:
+                asr = SpeechRecognizer(server.url, trace=trace, pipeline_grammars=True)
+                asr.recognize(FileAudioSource(phone_wav), LanguageModelList(*grammars))
+                assert len(asr.wait_recognition_result()) == 1
+                # A failed grammar fails the recognition, but not the session
+                bad = LanguageModelList(grammars[0], ("bad", ""), ("other", "x"))
+                assert asr.recognize(FileAudioSource(phone_wav), bad) is None
+                asr.recognize(FileAudioSource(phone_wav), LanguageModelList(*grammars))
+                assert len(asr.wait_recognition_result()) == 1
+                asr.close()
+        records = read_trace(path)
+    assert server.stats["grammars"] == 5
+    sent = [
+        i
+        for i, r in enumerate(records)
+        if r.kind == TRACE_SENT and r.payload.startswith(b"ASR 2.4 DEFINE_GRAMMAR")
+    ]
+    responses = [
+        i
+        for i, r in enumerate(records)
+        if r.kind == TRACE_RECEIVED and b"Method: DEFINE_GRAMMAR" in r.payload
+    ]
+    start = [
+        i
+        for i, r in enumerate(records)
+        if r.kind == TRACE_SENT and r.payload.startswith(b"ASR 2.4 START_RECOGNITION")
+    ]
+    # All grammars are sent before the first response, and the recognition
+    # starts after the last one
+    assert sent[2] < responses[0]
+    assert responses[2] < start[0]
+    assert len(start) == 2
+
+
+def test_reconnect():
+    # The first connection drops, and so does the replay on the second one
+    with StandInServer(port=0, drop_after_bytes=40000, drops=2) as server:
+        threads = threading.enumerate()
+        policy = ReconnectPolicy(initial_delay=0.01)
+        asr = SpeechRecognizer(server.url, reconnect=policy)
+        lm = LanguageModelList(LanguageModelList.inline_grammar("g", "#ABNF 1.0;"))
+        asr.recognize(PacedAudioSource(FileAudioSource(phone_wav), 8.0), lm)
+        results = asr.wait_recognition_result()
+        assert len(results) == 1
+        assert results[0].result_code == "RECOGNIZED"
+        assert asr.reconnects == 2
+        assert server.stats["drops"] == 2
+        assert server.stats["grammars"] == 3
+        # The recovered session is reused
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        assert len(asr.wait_recognition_result()) == 1
+        asr.close()
+        assert server.stats["sessions"] == 3
+        assert_threads_stopped(threads)
+
+
+def test_reconnect_replay_overflow():
+    with StandInServer(port=0, drop_after_bytes=40000) as server:
+        threads = threading.enumerate()
+        policy = ReconnectPolicy(initial_delay=0.01, replay_seconds=1.0)
+        asr = SpeechRecognizer(server.url, reconnect=policy)
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        assert asr.wait_recognition_result() == []
+        assert asr.reconnects == 0
+        # A new connection is made for the next recognition
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        assert len(asr.wait_recognition_result()) == 1
+        asr.close()
+        assert_threads_stopped(threads)
+
+
+def test_unreferenced_recognizer_is_closed():
+    with StandInServer(port=0) as server:
+        threads = threading.enumerate()
+        asr = SpeechRecognizer(server.url, reconnect=ReconnectPolicy())
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        asr.recognize(FileAudioSource(phone_wav), lm)
+        assert len(asr.wait_recognition_result()) == 1
+        ref = weakref.ref(asr)
+        del asr
+        gc.collect()
+        assert ref() is None
+        # Closed on collection, releasing the session
+        assert_threads_stopped(threads)
+        deadline = time.monotonic() + 5.0
+        while server.stats["active_sessions"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.stats["active_sessions"] == 0
+
+
+def test_send_queue_policies():
+    queue = SendQueue(10, "drop_oldest")
+    for chunk in [b"a" * 4, b"b" * 4, b"c" * 4]:
+        assert queue.put(chunk)
+    assert queue.dropped_bytes == 4
+    assert queue.high_water_bytes == 8
+    queue.finish()
+    assert [queue.get(), queue.get(), queue.get()] == [b"bbbb", b"cccc", None]
+    queue = SendQueue(10, "coalesce")
+    for chunk in [b"a" * 4, b"b" * 4]:
+        queue.put(chunk)
+    assert queue.get() == b"aaaabbbb"
+    queue.close()
+    assert not queue.put(b"c") and queue.get() is None
+
+
+def test_send_queue():
+    records = []
+    with StandInServer(port=0) as server:
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        for overflow in ["block", "coalesce"]:
+            asr = SpeechRecognizer(
+                server.url,
+                send_queue_bytes=16384,
+                send_queue_overflow=overflow,
+                metrics=CallbackSink(records.append),
+            )
+            asr.recognize(FileAudioSource(phone_wav), lm)
+            assert len(asr.wait_recognition_result()) == 1
+            assert asr.send_queue.size == 0
+            asr.close()
+        audio_bytes = FileAudioSource(phone_wav).data_size
+        assert server.stats["audio_bytes"] == 2 * audio_bytes
+    block, coalesce = records
+    for m in records:
+        assert m.send_queue_high_water_bytes <= 16384
+        assert m.send_queue_stall_seconds >= 0
+        assert m.send_queue_dropped_bytes == 0
+    assert coalesce.messages_sent <= block.messages_sent
+
+
+def test_multichannel_recognizer():
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "call.wav")
+        sf.write(path, np.stack([sig, sig], axis=1), rate, subtype="PCM_16")
+        with StandInServer(port=0) as server:
+            lm = LanguageModelList(LanguageModelList.from_uri(slm))
+            with MultiChannelRecognizer(server.url, lm) as recognizer:
+                for _ in range(2):
+                    results = recognizer.recognize(path)
+                    # 6 segments of 2 seconds per channel, in continuous mode
+                    assert [r.channel for r in results] == [0, 1] * 6
+                    assert all(r.result.result_code == "RECOGNIZED" for r in results)
+                    starts = [r.start_seconds for r in results]
+                    assert starts == sorted(starts)
+                results = recognizer.recognize(path, [1])
+                assert [r.channel for r in results] == [1] * 6
+            # Sessions are reused between files
+            assert server.stats["sessions"] == 2
+            assert server.stats["recognitions"] == 5
+
+
+def test_multichannel_recognition_ends_early():
+    # Channel 0 ends with silence, which ends its recognition long before
+    # its audio, while channel 1 is recognized to the end
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    sig = np.tile(sig, 6)
+    speech = sig.copy()
+    speech[rate:] = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "call.wav")
+        sf.write(path, np.stack([speech, sig], axis=1), rate, subtype="PCM_16")
+        with StandInServer(port=0, end_silence=1.0, final_delay=0) as server:
+            lm = LanguageModelList(LanguageModelList.from_uri(slm))
+            with MultiChannelRecognizer(
+                server.url,
+                lm,
+                chunk_size=1024,  # 16 pending chunks are 2 seconds of audio
+                continuous_mode=False,
+                max_wait_seconds=5,
+            ) as recognizer:
+                results = recognizer.recognize(path)
+    assert sorted(r.channel for r in results) == [0, 1]
+    ends = {r.channel: r.end_seconds for r in results}
+    assert ends[0] < 3.0 and ends[1] > 60.0
+
+
+def test_multichannel_connection_dropped():
+    sig, rate = sf.read(phone_wav, dtype="int16")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "call.wav")
+        sf.write(path, np.stack([sig, sig], axis=1), rate, subtype="PCM_16")
+        with StandInServer(port=0, drop_after_bytes=40000) as server:
+            lm = LanguageModelList(LanguageModelList.from_uri(slm))
+            with MultiChannelRecognizer(server.url, lm) as recognizer:
+                try:
+                    recognizer.recognize(path)
+                    assert False
+                except RecognitionException as e:
+                    # Not replaced by an error on cancelling the sessions
+                    assert "aborted" in str(e)
+
+
+def test_load_generator():
+    with StandInServer(port=0) as server:
+        lm = LanguageModelList(LanguageModelList.from_uri(slm))
+        generator = LoadGenerator(server.url, phone_wav, lm, recognitions=2, rate=None)
+        stats = generator.run_level(3)
+        assert stats["errors"] == 0
+        assert stats["recognitions"] == 6
+        assert stats["connect_p50_ms"] <= stats["connect_p99_ms"]
+        assert stats["final_p50_ms"] > 0
+        assert stats["cpu_ms_per_session"] > 0
+
+
+def test_trace():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.trace")
+        with TraceWriter(path) as trace:
+            trace.open_connection()
+            trace.sent(b"ASR 2.4 SEND_AUDIO\nLastPacket: false\n\n" + bytes(100))
+            trace.received(b"ASR 2.4 RESPONSE\nMethod: CREATE_SESSION\n")
+        records = read_trace(path)
+        assert [r.kind for r in records] == [TRACE_OPEN, TRACE_SENT, TRACE_RECEIVED]
+        assert records[1].payload == b"ASR 2.4 SEND_AUDIO\nLastPacket: false\n\n"
+        assert records[2].payload == b"ASR 2.4 RESPONSE\nMethod: CREATE_SESSION\n"
+        assert records[0].timestamp <= records[1].timestamp <= records[2].timestamp
+
+
+def test_replay():
+    lm = LanguageModelList(LanguageModelList.from_uri(slm))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.trace")
+        with StandInServer(port=0, text="um dois tres") as server:
+            with TraceWriter(path) as trace:
+                asr = SpeechRecognizer(server.url, trace=trace)
+                asr.recognize(FileAudioSource(phone_wav), lm)
+                expected = asr.wait_recognition_result()
+                asr.close()
+        with ReplayServer(path, port=0, time_scale=0) as server:
+            for _ in range(2):
+                listener = PartialListener()
+                asr = SpeechRecognizer(server.url, listener=listener)
+                asr.recognize(FileAudioSource(phone_wav), lm)
+                results = asr.wait_recognition_result()
+                asr.close()
+                assert len(results) == len(expected)
+                assert results[0].alternatives == expected[0].alternatives
+                assert listener.partials[:3] == ["um", "um dois", "um dois tres"]
+            assert server.stats["connections"] == 2
+            assert server.stats["mismatches"] == 0